@@ -6,4 +6,5 @@ admin.site.register(Vendor)
 admin.site.register(Commande)
 admin.site.register(User)
 admin.site.register(ItemCommande)
-admin.site.register(ItemVendor)
\ No newline at end of file
+admin.site.register(ItemVendor)
+admin.site.register(StatCounter)
\ No newline at end of file
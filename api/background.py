@@ -0,0 +1,72 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """
+    A small bounded thread pool for work that must not hold up a request.
+
+    The backlog is bounded: when ``queue_size`` tasks are already waiting,
+    new ones are dropped and logged rather than queued without limit. Setting
+    ``<async_setting> = False`` runs tasks inline (used by tests).
+    """
+
+    def __init__(self, name, workers_setting, queue_size_setting, async_setting, workers=4, queue_size=1000):
+        self.name = name
+        self.workers_setting = workers_setting
+        self.queue_size_setting = queue_size_setting
+        self.async_setting = async_setting
+        self.default_workers = workers
+        self.default_queue_size = queue_size
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def get_executor(self):
+        # Created on first use so forked gunicorn workers each get their own threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, self.workers_setting, self.default_workers),
+                    thread_name_prefix=self.name,
+                )
+                self._slots = threading.BoundedSemaphore(
+                    getattr(settings, self.queue_size_setting, self.default_queue_size)
+                )
+        return self._executor
+
+    def submit(self, func, *args):
+        if not getattr(settings, self.async_setting, True):
+            func(*args)
+            return None
+
+        executor = self.get_executor()
+        if not self._slots.acquire(blocking=False):
+            logger.warning('%s queue full, dropping %s', self.name, func.__name__)
+            return None
+
+        future = executor.submit(run_task, func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_on_commit(self, func, *args):
+        # Only act on rows that actually committed.
+        transaction.on_commit(lambda: self.submit(func, *args))
+
+
+def run_task(func, *args):
+    # Pool threads hold their own DB connections; keep them fresh.
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        close_old_connections()
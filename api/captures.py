@@ -0,0 +1,89 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from cloudinary import uploader
+from django.conf import settings
+from django.utils import timezone
+
+from . import images
+from .background import BackgroundPool
+from .models import Commande
+
+
+logger = logging.getLogger(__name__)
+
+pool = BackgroundPool(
+    'captures', 'CAPTURE_UPLOAD_WORKERS', 'CAPTURE_UPLOAD_QUEUE_SIZE', 'CAPTURE_UPLOAD_ASYNC', workers=2,
+)
+
+
+def stage(uploaded_file):
+    """
+    Move an uploaded payment capture into the local staging directory and
+    return its path. Uploads are already streamed to a temporary file by
+    TemporaryFileUploadHandler, so this is a rename (or a chunked copy).
+    """
+    os.makedirs(settings.CAPTURE_STAGING_DIR, exist_ok=True)
+    extension = os.path.splitext(uploaded_file.name or '')[1].lower()[:10]
+    path = os.path.join(settings.CAPTURE_STAGING_DIR, f'{uuid.uuid4().hex}{extension}')
+
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        shutil.move(uploaded_file.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+    return path
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def upload(commande_id):
+    """
+    Normalize a staged capture, push it to Cloudinary with retries and
+    backoff, and record the outcome.
+    """
+    path = Commande.objects.filter(pk=commande_id).values_list('capture_staged', flat=True).first()
+    if not path:
+        return
+
+    if not images.is_normalized(path) and not images.undecodable_heif(path):
+        try:
+            path = images.normalize(path)
+        except Exception:
+            # Already validated on the request; upload the original rather than lose it.
+            logger.exception('Could not normalize capture for commande %s', commande_id)
+        else:
+            Commande.objects.filter(pk=commande_id).update(capture_staged=path)
+
+    field = Commande._meta.get_field('capture')
+    attempts = settings.CAPTURE_UPLOAD_ATTEMPTS
+
+    for attempt in range(1, attempts + 1):
+        try:
+            resource = uploader.upload_resource(path, type=field.type, resource_type=field.resource_type)
+            break
+        except Exception as err:
+            logger.warning('Capture upload for commande %s failed (%s/%s): %s', commande_id, attempt, attempts, err)
+            if attempt == attempts:
+                Commande.objects.filter(pk=commande_id).update(capture_status='failed', updated_at=timezone.now())
+                return
+            time.sleep(settings.CAPTURE_UPLOAD_BACKOFF * 2 ** (attempt - 1))
+
+    Commande.objects.filter(pk=commande_id).update(
+        capture=resource.get_prep_value(), capture_status='uploaded', capture_staged='',
+        updated_at=timezone.now(),
+    )
+    discard(path)
+
+
+def queue_upload(commande):
+    pool.submit_on_commit(upload, commande.pk)
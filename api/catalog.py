@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from .models import Vendor
+from .profiling import span
+from . import serializers
+
+
+# Snapshots are stored under a stable key per vendor type and tagged with the
+# catalog generation they were built from. Bumping the generation invalidates
+# every snapshot at once while keeping the old bytes around as a stale copy.
+GENERATION_KEY = 'catalog:generation'
+SNAPSHOT_KEY = 'catalog:snapshot:{}'
+REBUILD_LOCK_KEY = 'catalog:rebuild:{}'
+
+ALL_TYPES = 'all'
+REBUILD_LOCK_TIMEOUT = 30
+REBUILD_WAIT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+
+
+def vendor_types():
+    return [choice for choice, _ in Vendor.TYPE_CHOICES]
+
+
+def vendor_catalog_queryset(vendor_type=None):
+    vendors = Vendor.objects.prefetch_related('vendor_items')
+    if vendor_type is not None:
+        vendors = vendors.filter(type=vendor_type)
+    return vendors
+
+
+def render_catalog(vendor_type=None):
+    with span('serialize'):
+        return _render_catalog(vendor_type)
+
+
+def _render_catalog(vendor_type=None):
+    if vendor_type is not None:
+        data = serializers.VendorSerializer(vendor_catalog_queryset(vendor_type), many=True).data
+    else:
+        # All types in one pass: two queries total, then grouped in Python.
+        data = {choice: [] for choice in vendor_types()}
+        for vendor in serializers.VendorSerializer(vendor_catalog_queryset(), many=True).data:
+            data.setdefault(vendor['type'], []).append(vendor)
+
+    return JSONRenderer().render(data)
+
+
+def new_generation():
+    # A fresh timestamp rather than an increment: two workers invalidating at
+    # once must still end on a value neither built a snapshot against, and
+    # incr() is a read-then-write on the database cache. Also means a cache
+    # flush never hands out an ETag a client holds for older content.
+    return time.time_ns()
+
+
+def current_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, new_generation(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_catalog():
+    cache.set(GENERATION_KEY, new_generation(), None)
+
+
+def build_snapshot(vendor_type=None, generation=None):
+    if generation is None:
+        generation = current_generation()
+
+    body = render_catalog(vendor_type)
+    snapshot = {
+        'generation': generation,
+        'etag': 'W/"{}"'.format(hashlib.sha1(body).hexdigest()),
+        'body': body,
+        'gzip': gzip.compress(body, compresslevel=6),
+    }
+    cache.set(SNAPSHOT_KEY.format(vendor_type or ALL_TYPES), snapshot, getattr(settings, 'CATALOG_SNAPSHOT_TTL', 86400))
+    return snapshot
+
+
+def get_snapshot(vendor_type=None):
+    """
+    Return the rendered catalog for ``vendor_type`` (all types when None).
+
+    Only one worker rebuilds a stale snapshot at a time; the others keep
+    serving the previous bytes, or wait briefly when there is nothing to serve.
+    """
+    key = vendor_type or ALL_TYPES
+    # One round trip to the shared cache on the warm path.
+    found = cache.get_many([GENERATION_KEY, SNAPSHOT_KEY.format(key)])
+    generation = found.get(GENERATION_KEY) or current_generation()
+    snapshot = found.get(SNAPSHOT_KEY.format(key))
+
+    if snapshot is not None and snapshot['generation'] == generation:
+        return snapshot
+
+    lock_key = REBUILD_LOCK_KEY.format(key)
+    deadline = time.monotonic() + REBUILD_WAIT
+
+    while not cache.add(lock_key, True, REBUILD_LOCK_TIMEOUT):
+        if snapshot is not None:
+            return snapshot
+        if time.monotonic() >= deadline:
+            # The rebuilding worker is taking too long; build our own copy.
+            return build_snapshot(vendor_type, generation)
+        time.sleep(REBUILD_POLL_INTERVAL)
+        snapshot = cache.get(SNAPSHOT_KEY.format(key))
+        if snapshot is not None and snapshot['generation'] == generation:
+            return snapshot
+
+    try:
+        return build_snapshot(vendor_type, generation)
+    finally:
+        cache.delete(lock_key)
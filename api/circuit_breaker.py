@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast after ``failure_threshold`` consecutive failures.
+
+    Once ``reset_timeout`` seconds have passed a single trial call is let
+    through: success closes the circuit, failure re-opens it. Exceptions in
+    ``ignored_exceptions`` are the caller's problem (a bad token, a bad
+    number), not the remote's, and do not count as failures.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, ignored_exceptions=()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ignored_exceptions = ignored_exceptions
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def call(self, func, *args, **kwargs):
+        with self._lock:
+            if self._opened_at is not None:
+                if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f'{self.name} circuit is open')
+                self._trial_running = True
+
+        try:
+            result = func(*args, **kwargs)
+        except self.ignored_exceptions:
+            self._record(success=True)
+            raise
+        except Exception:
+            self._record(success=False)
+            raise
+        self._record(success=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def _record(self, success):
+        with self._lock:
+            self._trial_running = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
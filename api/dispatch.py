@@ -0,0 +1,69 @@
+import logging
+
+from django.conf import settings
+
+from .geo import GridIndex
+from .models import User, Commande
+from . import events, notifications
+
+
+logger = logging.getLogger(__name__)
+
+# Last reported position of every courier on duty, in this process.
+couriers = GridIndex(
+    cell_degrees=getattr(settings, 'DISPATCH_CELL_DEGREES', 0.01),
+    ttl=getattr(settings, 'COURIER_POSITION_TTL', 600),
+    max_km=getattr(settings, 'DISPATCH_MAX_KM', 50),
+)
+
+OFFER_MESSAGES = {
+    'ar': ('طلب جديد بالقرب منك', 'الطلب {code} على بعد {km:.1f} كم'),
+    'fr': ('Nouvelle commande proche', 'La commande {code} est à {km:.1f} km'),
+}
+
+
+def report_position(courier_id, latitude, longitude):
+    couriers.update(courier_id, latitude, longitude)
+
+
+def go_offline(courier_id):
+    couriers.remove(courier_id)
+
+
+def busy_couriers():
+    return set(
+        Commande.objects.filter(status='loading', livreur__isnull=False).values_list('livreur_id', flat=True)
+    )
+
+
+def propose(commande_id):
+    """Return ``(courier_id, distance_km)`` for the nearest free courier, or ``None``."""
+    if not len(couriers):
+        return None
+    location = Commande.objects.filter(pk=commande_id).values_list('latitude', 'longitude').first()
+    if location is None or location[0] is None:
+        return None
+    return couriers.nearest(*location, exclude=busy_couriers())
+
+
+def offer(commande_id):
+    """Tell the nearest free courier about a newly paid order. Taking it is still up to them."""
+    proposal = propose(commande_id)
+    if proposal is None:
+        return None
+
+    courier_id, km = proposal
+    courier = User.objects.filter(pk=courier_id).values('fcm_token', 'default_lang').first()
+    code = Commande.objects.filter(pk=commande_id).values_list('code', flat=True).first()
+    if courier is None or code is None:
+        return None
+
+    title, body = notifications.localized(OFFER_MESSAGES, courier['default_lang'])
+    notifications.send_notification(title, body.format(code=code, km=km), courier['fcm_token'])
+    events.publish_offer(commande_id, courier_id, km)
+    logger.info('Offered commande %s to courier %s (%.2f km)', commande_id, courier_id, km)
+    return proposal
+
+
+def offer_on_commit(commande_id):
+    notifications.dispatch(offer, commande_id)
@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TYPES = ['admin', 'super_admin']
+COURIER_TYPE = 'traitor'
+
+# Audiences an order event can be addressed to.
+ADMINS = 'admins'
+COURIERS = 'livreurs'  # the pool of paid, unassigned orders
+COURIER = 'livreur:{}'
+CUSTOMER = 'user:{}'
+
+
+class Subscription:
+    """One connected client: the audiences it listens to and its own bounded queue."""
+
+    def __init__(self, audiences, loop, queue_size):
+        self.audiences = frozenset(audiences)
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind reconnects and re-fetches instead.
+            self.overflowed = True
+
+
+class InProcessBroker:
+    """
+    Fans order events out to the event streams open in this process.
+
+    ``publish`` may be called from any thread; each subscriber's queue is fed
+    on its own event loop. Events are not shared between processes, so run
+    the stream behind a single ASGI process per host or replace the broker
+    (``ORDER_EVENTS_BROKER``) with one backed by a shared bus.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, audiences, queue_size=None):
+        subscription = Subscription(
+            audiences, asyncio.get_running_loop(),
+            queue_size or getattr(settings, 'ORDER_EVENTS_QUEUE_SIZE', 100),
+        )
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, event, audiences):
+        event = dict(event, id=next(self._ids))
+        with self._lock:
+            targets = [s for s in self._subscriptions if s.audiences & audiences]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The client's loop is gone; its stream will unsubscribe itself.
+                pass
+        return event
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'ORDER_EVENTS_BROKER', 'api.events.InProcessBroker'))()
+    return _broker
+
+
+def reset_broker():
+    global _broker
+    with _broker_lock:
+        _broker = None
+
+
+def audiences_for_user(user):
+    if user.type in ADMIN_TYPES:
+        return {ADMINS}
+    if user.type == COURIER_TYPE:
+        return {COURIERS, COURIER.format(user.pk), CUSTOMER.format(user.pk)}
+    return {CUSTOMER.format(user.pk)}
+
+
+def in_courier_pool(state):
+    return state is not None and state[0] == 'paid' and state[1] is None
+
+
+def event_type(old_state, new_state):
+    if old_state is None:
+        return 'commande.created'
+    if new_state[1] != old_state[1] and new_state[1] is not None:
+        return 'commande.assigned'
+    if new_state[0] != old_state[0]:
+        return 'commande.status_changed'
+    return None
+
+
+def audiences_for_commande(user_id, old_state, new_state):
+    audiences = {ADMINS, CUSTOMER.format(user_id)}
+    for state in (old_state, new_state):
+        if state is not None and state[1] is not None:
+            audiences.add(COURIER.format(state[1]))
+    # Couriers see orders entering and leaving the unassigned pool.
+    if in_courier_pool(old_state) or in_courier_pool(new_state):
+        audiences.add(COURIERS)
+    return audiences
+
+
+def serialize_commande(commande_id):
+    from .models import Commande
+    from .serializers import CommandeSerializer
+
+    commande = Commande.objects.with_details().filter(pk=commande_id).first()
+    return CommandeSerializer(commande).data if commande is not None else None
+
+
+def publish_commande_change(commande, old_state, new_state):
+    """
+    Queue an order event for ``commande`` moving from ``old_state`` to
+    ``new_state`` (``(status, livreur_id)``, ``None`` when just created).
+    It is published once the transaction commits, and only serialized when
+    someone is listening.
+    """
+    kind = event_type(old_state, new_state)
+    if kind is None:
+        return
+
+    event = {
+        'type': kind,
+        'commande_id': commande.pk,
+        'status': new_state[0],
+        'previous_status': old_state[0] if old_state else None,
+        'livreur_id': new_state[1],
+    }
+    audiences = audiences_for_commande(commande.user_id, old_state, new_state)
+
+    def publish():
+        broker = get_broker()
+        if not broker.has_subscribers():
+            return
+        try:
+            payload = dict(event, commande=serialize_commande(event['commande_id']))
+            broker.publish(payload, audiences)
+        except Exception:
+            logger.exception('Could not publish %s for commande %s', kind, event['commande_id'])
+
+    transaction.on_commit(publish)
+
+
+def publish_offer(commande_id, livreur_id, distance_km):
+    """A courier was proposed for a paid order (api/dispatch.py); admins see it too."""
+    broker = get_broker()
+    if broker.has_subscribers():
+        broker.publish(
+            {'type': 'commande.offered', 'commande_id': commande_id, 'livreur_id': livreur_id,
+             'distance_km': round(distance_km, 3)},
+            {ADMINS, COURIER.format(livreur_id)},
+        )
+
+
+def format_sse(event):
+    return f'id: {event["id"]}\nevent: {event["type"]}\ndata: {json.dumps(event, default=str)}\n\n'
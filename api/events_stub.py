@@ -0,0 +1,23 @@
+from .events import InProcessBroker
+
+
+class RecordingBroker(InProcessBroker):
+    """
+    Stand-in broker for tests: keeps every published event and its
+    audiences, and always reports a listener so payloads are built.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def has_subscribers(self):
+        return True
+
+    def publish(self, event, audiences):
+        event = super().publish(event, audiences)
+        self.published.append((event, frozenset(audiences)))
+        return event
+
+    def types(self):
+        return [event['type'] for event, _ in self.published]
@@ -0,0 +1,135 @@
+import math
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import catalog, pricing
+from .geo import distance_km, parse_location, valid
+from .models import Vendor
+
+
+Quote = namedtuple('Quote', ['fee', 'distance_km'])
+
+
+class OutOfRange(Exception):
+    """The delivery address is farther than ``DELIVERY_MAX_KM`` from a vendor."""
+
+    def __init__(self, distance):
+        super().__init__(distance)
+        self.distance_km = distance
+
+
+def zone_degrees():
+    return getattr(settings, 'DELIVERY_ZONE_DEGREES', 0.005)
+
+
+def zone(latitude, longitude):
+    """The zone a point falls in: coordinates rounded to the ``DELIVERY_ZONE_DEGREES`` grid."""
+    size = zone_degrees()
+    return round(latitude / size), round(longitude / size)
+
+
+@lru_cache(maxsize=getattr(settings, 'DELIVERY_DISTANCE_CACHE_SIZE', 100_000))
+def zone_distance(origin, destination):
+    """
+    Distance between two zone centres. This is the zone matrix: each cell is
+    computed the first time a vendor zone is quoted to a customer zone and
+    then served from the cache, so a warm quote is a dictionary lookup.
+    """
+    size = zone_degrees()
+    return distance_km(origin[0] * size, origin[1] * size, destination[0] * size, destination[1] * size)
+
+
+class VendorZones:
+    """
+    In-memory ``vendor id -> zone`` (``None`` without coordinates), tagged
+    with the catalog generation it was built from like ``pricing.PriceBook``.
+    """
+
+    def __init__(self, version, zones):
+        self.version = version
+        self.zones = zones
+
+    def lookup(self, vendor_ids):
+        found = {pk: self.zones[pk] for pk in vendor_ids if pk in self.zones}
+        missing = set(vendor_ids) - set(found)
+        if missing:
+            found.update(load_zones(Vendor.objects.filter(pk__in=missing)))
+        return found
+
+
+def load_zones(queryset):
+    return {
+        pk: zone(latitude, longitude) if latitude is not None and longitude is not None else None
+        for pk, latitude, longitude in queryset.values_list('id', 'latitude', 'longitude')
+    }
+
+
+_zones = None
+_lock = threading.Lock()
+
+
+def get_vendor_zones():
+    global _zones
+    version = catalog.current_generation()
+    zones = _zones
+    if zones is not None and zones.version == version:
+        return zones
+
+    with _lock:
+        if _zones is None or _zones.version != version:
+            _zones = VendorZones(version, load_zones(Vendor.objects.all()))
+        return _zones
+
+
+def fee_for(distance, vendor_count=1):
+    raw = (
+        settings.DELIVERY_FEE_BASE + settings.DELIVERY_FEE_PER_KM * distance
+        + settings.DELIVERY_FEE_EXTRA_VENDOR * max(vendor_count - 1, 0)
+    )
+    step = settings.DELIVERY_FEE_STEP
+    return math.ceil(raw / step) * step if step else raw
+
+
+def item_vendors(lines):
+    """Vendors the basket is picked up from, as recorded on the items (never as sent by the client)."""
+    prices = pricing.get_price_book().lookup({line.item_id for line in lines})
+    return {vendor_id for _, vendor_id in prices.values()}
+
+
+def quote_order(lines, latitude=None, longitude=None, location=None):
+    """
+    Quote for a validated basket (``ItemCommande`` lines). A point the app
+    sent as ``latitude``/``longitude`` that is out of range raises
+    ``OutOfRange``; one read from the ``location`` text falls back to the
+    default fee instead, since the text may not be where the customer is.
+    """
+    vendor_ids = item_vendors(lines)
+    if latitude is not None and longitude is not None:
+        return quote(vendor_ids, (latitude, longitude) if valid(latitude, longitude) else None)
+    try:
+        return quote(vendor_ids, parse_location(location))
+    except OutOfRange:
+        return Quote(settings.DELIVERY_FEE_DEFAULT, None)
+
+
+def quote(vendor_ids, point):
+    """
+    Delivery fee for picking up at ``vendor_ids`` and dropping at ``point``
+    (``(latitude, longitude)`` or ``None``). The farthest vendor sets the
+    distance; each extra vendor adds a pickup charge. Falls back to
+    ``DELIVERY_FEE_DEFAULT`` when either end has no coordinates and raises
+    ``OutOfRange`` beyond ``DELIVERY_MAX_KM``.
+    """
+    vendor_ids = set(vendor_ids)
+    origins = set(get_vendor_zones().lookup(vendor_ids).values())
+    if point is None or not origins or None in origins:
+        return Quote(settings.DELIVERY_FEE_DEFAULT, None)
+
+    target = zone(*point)
+    distance = max(zone_distance(origin, target) for origin in origins)
+    if distance > settings.DELIVERY_MAX_KM:
+        raise OutOfRange(round(distance, 2))
+    return Quote(fee_for(distance, len(vendor_ids)), round(distance, 2))
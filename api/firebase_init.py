@@ -6,13 +6,16 @@ from firebase_admin import credentials
 # Render sets this automatically: RENDER=True (or similar)
 RUNNING_ON_RENDER = os.getenv("RENDER") is not None
 
+# Bound every Firebase HTTP call so a slow FCM endpoint can't pin a worker thread
+FIREBASE_OPTIONS = {"httpTimeout": float(os.getenv("FIREBASE_HTTP_TIMEOUT", "10"))}
+
 try:
     if not firebase_admin._apps:
         if RUNNING_ON_RENDER:
             # Render → use credentials from environment variable
             cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
             cred = credentials.Certificate(cred_path)
-            firebase_admin.initialize_app(cred)
+            firebase_admin.initialize_app(cred, FIREBASE_OPTIONS)
             print("🔥 Firebase initialized with Render credentials")
         else:
             # Local → load from local file
@@ -20,7 +23,7 @@ try:
 
             if os.path.exists(local_cred_path):
                 cred = credentials.Certificate(local_cred_path)
-                firebase_admin.initialize_app(cred)
+                firebase_admin.initialize_app(cred, FIREBASE_OPTIONS)
                 print("🔥 Firebase initialized locally using firebase_admin_sdk.json")
             else:
                 print("⚠️ Local Firebase credential file missing:", local_cred_path)
@@ -0,0 +1,161 @@
+import math
+import re
+import threading
+import time
+from urllib.parse import unquote
+
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# Only forms an ordinary address can't take ("Maison 5, 3eme etage" is not a
+# point): geo: URIs, "@lat,lng" and "q=lat,lng" in maps links, and bare
+# pairs written with real decimal places.
+COORDINATE_FORMATS = [
+    # geo:18.07,-15.95
+    re.compile(r'\bgeo:\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)', re.IGNORECASE),
+    # https://www.google.com/maps/@18.07,-15.95,17z
+    re.compile(r'@(-?\d{1,2}\.\d+),\s*(-?\d{1,3}\.\d+)'),
+    # https://maps.google.com/?q=18.07,-15.95 (also query=, ll=, destination=)
+    re.compile(r'[?&](?:q|query|ll|destination)=(-?\d{1,2}\.\d+)\s*,\s*(-?\d{1,3}\.\d+)'),
+    # 18.0735, -15.9582
+    re.compile(r'(?<![\w.])(-?\d{1,2}\.\d{3,})\s*,\s*(-?\d{1,3}\.\d{3,})(?![\w.])'),
+]
+
+
+def valid(latitude, longitude):
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def parse_location(text):
+    """
+    Pull ``(latitude, longitude)`` out of a free-text location: decimal
+    coordinates, a ``geo:`` URI or a maps link. Addresses and place names
+    return ``None``; there is no geocoder behind this.
+    """
+    if not text:
+        return None
+    text = unquote(text)
+    for pattern in COORDINATE_FORMATS:
+        match = pattern.search(text)
+        if match is not None:
+            latitude, longitude = float(match.group(1)), float(match.group(2))
+            return (latitude, longitude) if valid(latitude, longitude) else None
+    return None
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """
+    Last known positions bucketed into square cells of ``cell_degrees``.
+
+    ``nearest`` searches rings of cells outward from the query point and
+    stops as soon as no unvisited ring can hold anything closer, so its cost
+    depends on local density rather than on the total number of entries.
+    Positions older than ``ttl`` seconds are ignored (and dropped).
+    """
+
+    def __init__(self, cell_degrees=0.01, ttl=600, max_km=50):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self.max_km = max_km
+        self._cells = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def update(self, key, latitude, longitude, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            self._discard(key)
+            cell = self.cell(latitude, longitude)
+            self._positions[key] = (latitude, longitude, at, cell)
+            self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        position = self._positions.pop(key, None)
+        if position is not None:
+            members = self._cells[position[3]]
+            members.discard(key)
+            if not members:
+                del self._cells[position[3]]
+
+    def position(self, key):
+        position = self._positions.get(key)
+        return position[:2] if position else None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def ring(self, center, radius):
+        cx, cy = center
+        if radius == 0:
+            yield center
+            return
+        for dx in range(-radius, radius + 1):
+            yield cx + dx, cy - radius
+            yield cx + dx, cy + radius
+        for dy in range(-radius + 1, radius):
+            yield cx - radius, cy + dy
+            yield cx + radius, cy + dy
+
+    def nearest(self, latitude, longitude, exclude=(), now=None):
+        """Return ``(key, distance_km)`` of the closest fresh entry not in ``exclude``, or ``None``."""
+        if not self._positions:
+            return None
+        now = time.time() if now is None else now
+        oldest = now - self.ttl
+        # The narrowest side of a cell here, for the "nothing closer further out" bound.
+        cell_km = self.cell_degrees * KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+        max_radius = int(self.max_km / cell_km) + 1
+        center = self.cell(latitude, longitude)
+        best = None
+        stale = []
+
+        with self._lock:
+            for radius in range(max_radius + 1):
+                # Everything in this ring or beyond is at least (radius - 1) cells away.
+                if best is not None and best[1] <= (radius - 1) * cell_km:
+                    break
+                for cell in self.ring(center, radius):
+                    for key in self._cells.get(cell, ()):
+                        lat, lng, at, _ = self._positions[key]
+                        if at < oldest:
+                            stale.append(key)
+                            continue
+                        if key in exclude:
+                            continue
+                        distance = distance_km(latitude, longitude, lat, lng)
+                        if best is None or distance < best[1]:
+                            best = (key, distance)
+            for key in stale:
+                self._discard(key)
+
+        if best is not None and best[1] > self.max_km:
+            return None
+        return best
+
+    def brute_force_nearest(self, latitude, longitude, exclude=(), now=None):
+        """Reference implementation for tests and the benchmark."""
+        now = time.time() if now is None else now
+        candidates = [
+            (key, distance_km(latitude, longitude, lat, lng))
+            for key, (lat, lng, at, _) in self._positions.items()
+            if key not in exclude and at >= now - self.ttl
+        ]
+        best = min(candidates, key=lambda candidate: candidate[1], default=None)
+        return best if best is not None and best[1] <= self.max_km else None
@@ -0,0 +1,117 @@
+import logging
+import os
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    # HEIC screenshots from iPhones, when the plugin is installed.
+    from pillow_heif import register_heif_opener
+except ImportError:  # pragma: no cover
+    register_heif_opener = None
+else:
+    register_heif_opener()
+
+
+logger = logging.getLogger(__name__)
+
+NORMALIZED_SUFFIX = '-normalized'
+EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+
+
+# ISO-BMFF brands of HEIF files, which is what iPhones save photos and screenshots as.
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+
+
+class InvalidImage(Exception):
+    """The upload is not an image we can decode, or is too large to decode safely."""
+
+
+def read_header(source, size=12):
+    if hasattr(source, 'read'):
+        header = source.read(size)
+        source.seek(0)
+        return header
+    with open(source, 'rb') as f:
+        return f.read(size)
+
+
+def is_heif(source):
+    header = read_header(source)
+    return header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS
+
+
+def undecodable_heif(source):
+    """A HEIC capture this process can't decode (no pillow_heif): stored as sent rather than refused."""
+    return register_heif_opener is None and is_heif(source)
+
+
+def check(source):
+    """
+    Make sure ``source`` (a path or file object) is a decodable image of a sane size.
+
+    Only the header is parsed for the size check, so an oversized image is
+    refused before its pixels are ever allocated. HEIC is let through on its
+    header alone when the decoder is missing.
+    """
+    if undecodable_heif(source):
+        return
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            if width * height > settings.CAPTURE_MAX_PIXELS:
+                raise InvalidImage(f'Image is too large ({width}x{height}).')
+            image.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as err:
+        raise InvalidImage('Upload a valid image.') from err
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+
+
+def is_normalized(path):
+    return os.path.splitext(path)[0].endswith(NORMALIZED_SUFFIX)
+
+
+def save_resized(path, target, max_dimension, image_format, quality):
+    """
+    Write ``path`` to ``target`` as ``image_format``, no larger than
+    ``max_dimension`` on either side, oriented by its EXIF tag and stripped
+    of all metadata. ``target`` appears atomically.
+    """
+    max_size = (max_dimension, max_dimension)
+    partial = target + '.part'
+
+    with Image.open(path) as image:
+        # Lets the JPEG decoder scale down while decoding instead of
+        # materialising the full-resolution bitmap first.
+        image.draft('RGB', max_size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        keep_alpha = image_format == 'WEBP' and image.mode in ('RGBA', 'LA', 'P')
+        image = image.convert('RGBA' if keep_alpha else 'RGB')
+
+        # A fresh image carries no EXIF/ICC/text chunks into the output.
+        clean = Image.new(image.mode, image.size)
+        clean.paste(image)
+        clean.save(partial, image_format, quality=quality, optimize=image_format == 'JPEG')
+
+    os.replace(partial, target)
+    return target
+
+
+def normalize(path):
+    """
+    Re-encode the capture at ``path`` for storage and return the new path.
+
+    The result is no larger than ``CAPTURE_MAX_DIMENSION`` and saved as
+    ``CAPTURE_FORMAT``. The original file is removed.
+    """
+    image_format = settings.CAPTURE_FORMAT
+    target = os.path.splitext(path)[0] + NORMALIZED_SUFFIX + EXTENSIONS[image_format]
+
+    save_resized(path, target, settings.CAPTURE_MAX_DIMENSION, image_format, settings.CAPTURE_QUALITY)
+    if target != path:
+        os.remove(path)
+    return target
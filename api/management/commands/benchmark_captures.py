@@ -0,0 +1,68 @@
+import glob
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import images
+
+
+class Command(BaseCommand):
+    help = (
+        'Run captures through the normalization stage and report bytes saved, '
+        'time per image and peak memory. Source files are copied, never modified.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Images to process (default: everything in MEDIA_ROOT/captures_commandes).',
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or sorted(glob.glob(os.path.join(settings.MEDIA_ROOT, 'captures_commandes', '*')))
+        if not paths:
+            raise CommandError('No images to benchmark.')
+
+        self.stdout.write(
+            f'Format {settings.CAPTURE_FORMAT}, quality {settings.CAPTURE_QUALITY}, '
+            f'max {settings.CAPTURE_MAX_DIMENSION}px'
+        )
+
+        total_before = total_after = 0
+        with tempfile.TemporaryDirectory() as workdir:
+            for index, path in enumerate(paths):
+                copy = os.path.join(workdir, f'{index}{os.path.splitext(path)[1]}')
+                shutil.copyfile(path, copy)
+                before = os.path.getsize(copy)
+
+                try:
+                    images.check(copy)
+                    start = time.perf_counter()
+                    output = images.normalize(copy)
+                    elapsed = time.perf_counter() - start
+                except images.InvalidImage as err:
+                    self.stdout.write(f'{os.path.basename(path)}: skipped ({err})')
+                    continue
+
+                after = os.path.getsize(output)
+                total_before += before
+                total_after += after
+                self.stdout.write(
+                    f'{os.path.basename(path)}: {before:,} -> {after:,} bytes '
+                    f'({100 * (1 - after / before):.1f}% saved, {elapsed * 1000:.0f} ms)'
+                )
+
+        if not total_before:
+            raise CommandError('None of the images could be decoded.')
+
+        saved = total_before - total_after
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f'Total: {total_before:,} -> {total_after:,} bytes, {saved:,} saved '
+            f'({100 * saved / total_before:.1f}%). Peak RSS {peak_mb:.0f} MB.'
+        ))
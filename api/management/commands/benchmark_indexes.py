@@ -0,0 +1,236 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api import catalog, stats
+from api.models import User, Vendor, ItemVendor, Commande, ItemCommande
+from api.views import (
+    MesCommandesView, PendingCommandesView, PendingCommandesView2, PendingCommandesLivreurView,
+    StatisticsView, LivreurStatisticsView,
+)
+
+
+# Indexes added for the hot filters; dropped for the "before" run and restored after.
+BENCHMARK_INDEXES = {
+    Commande: [
+        'commande_status_date_idx', 'commande_livreur_status_idx',
+        'commande_user_date_idx', 'commande_paid_unassigned_idx',
+    ],
+    User: ['user_type_idx'],
+    Vendor: ['vendor_type_idx'],
+}
+
+BENCH_PHONE_START = 900000000
+BENCH_CODE_PREFIX = 'BENCH'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large order history and report per-endpoint latency with and '
+        'without the hot-filter indexes. Runs against the configured database '
+        '(SQLite or PostgreSQL); seeded rows are removed afterwards unless --keep. '
+        'Drops live indexes while it runs, so it needs --yes and refuses a '
+        'database that holds real orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--couriers', type=int, default=50)
+        parser.add_argument('--admins', type=int, default=30)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows.')
+        parser.add_argument(
+            '--yes', action='store_true',
+            help='Confirm that this database is a scratch one: its indexes are dropped and rows bulk-deleted.',
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+
+        target = f'{connection.vendor} ({connection.settings_dict["NAME"]})'
+        if not options['yes']:
+            raise CommandError(f'This drops indexes on {target} and seeds/deletes rows; rerun with --yes.')
+        if Commande.objects.exclude(code__startswith=BENCH_CODE_PREFIX).exists():
+            raise CommandError(f'{target} holds real orders; run the benchmark against a scratch database.')
+
+        self.stdout.write(f'Backend: {target}')
+
+        start = time.perf_counter()
+        self.seed(options)
+        # bulk_create skips the signals that keep the dashboard counters current.
+        stats.rebuild()
+        self.stdout.write(f'Seeded {options["orders"]} orders in {time.perf_counter() - start:.1f}s')
+
+        try:
+            self.drop_indexes()
+            before = self.measure()
+            self.create_indexes()
+            after = self.measure()
+            self.report(before, after)
+        finally:
+            self.create_indexes()
+            if not options['keep']:
+                self.cleanup()
+
+    # --- seeding ---
+
+    def seed(self, options):
+        rng = random.Random(42)
+        batch_size = options['batch_size']
+        phone = iter(range(BENCH_PHONE_START, BENCH_PHONE_START + 10_000_000))
+
+        def users(count, user_type):
+            return User.objects.bulk_create([
+                User(phone=p, username=f'bench{p}', type=user_type, password='!')
+                for p in (next(phone) for _ in range(count))
+            ], batch_size=batch_size)
+
+        self.customers = users(options['customers'], 'simple')
+        self.couriers = users(options['couriers'], 'traitor')
+        self.admins = users(options['admins'], 'admin')
+
+        self.vendors = Vendor.objects.bulk_create([
+            Vendor(name=f'{BENCH_CODE_PREFIX} vendor {i}', type=vendor_type, image='bench.jpg')
+            for i, vendor_type in enumerate(rng.choice(catalog.vendor_types()) for _ in range(30))
+        ])
+        items = ItemVendor.objects.bulk_create([
+            ItemVendor(nom=f'item {i}', prix=rng.randint(50, 500), vendor=vendor, image='bench.jpg')
+            for vendor in self.vendors for i in range(10)
+        ])
+
+        # Mostly delivered history with a thin layer of open orders, like production.
+        statuses = ['delivered'] * 90 + ['rejected'] * 4 + ['waiting'] * 2 + ['paid'] * 2 + ['loading'] * 2
+        now = timezone.now()
+
+        for offset in range(0, options['orders'], batch_size):
+            size = min(batch_size, options['orders'] - offset)
+            with transaction.atomic():
+                commandes = []
+                for i in range(offset, offset + size):
+                    order_status = rng.choice(statuses)
+                    has_livreur = order_status in ('loading', 'delivered')
+                    commandes.append(Commande(
+                        code=f'{BENCH_CODE_PREFIX}{i:09}', prix=rng.randint(100, 5000), location='bench',
+                        status=order_status, user=rng.choice(self.customers),
+                        livreur=rng.choice(self.couriers) if has_livreur else None,
+                    ))
+                commandes = Commande.objects.bulk_create(commandes)
+
+                # auto_now_add stamps every row with "now"; spread them over a year instead.
+                for commande in commandes:
+                    commande.date = now - timezone.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                Commande.objects.bulk_update(commandes, ['date'])
+
+                lines = []
+                for commande in commandes:
+                    item = rng.choice(items)
+                    lines.append(ItemCommande(commande=commande, vendor_id=item.vendor_id, item=item, number=1))
+                ItemCommande.objects.bulk_create(lines)
+
+            self.stdout.write(f'  {offset + size}/{options["orders"]}', ending='\r')
+        self.stdout.write('')
+
+    def cleanup(self):
+        # Plain DELETEs, children first: delete() would load every seeded row
+        # and fire the per-row counter/event receivers, and the counters are
+        # rebuilt below anyway.
+        commandes = Commande.objects.filter(code__startswith=BENCH_CODE_PREFIX)
+        vendors = Vendor.objects.filter(name__startswith=BENCH_CODE_PREFIX)
+        users = User.objects.filter(username__startswith='bench', phone__gte=BENCH_PHONE_START)
+        with transaction.atomic():
+            for queryset in [
+                ItemCommande.objects.filter(commande__in=commandes),
+                commandes,
+                ItemCommande.objects.filter(vendor__in=vendors),
+                ItemVendor.objects.filter(vendor__in=vendors),
+                vendors,
+                users,
+            ]:
+                queryset._raw_delete(queryset.db)
+            stats.rebuild()
+        catalog.invalidate_catalog()
+
+    # --- indexes ---
+
+    def indexes(self):
+        for model, names in BENCHMARK_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    yield model, index
+
+    def existing_indexes(self, model):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, model._meta.db_table)
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self.indexes():
+                if index.name in self.existing_indexes(model):
+                    editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self.indexes():
+                if index.name not in self.existing_indexes(model):
+                    editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    # --- measuring ---
+
+    def endpoints(self):
+        customer = max(self.customers, key=lambda user: user.pk)
+        courier = self.couriers[0]
+        admin = self.admins[0]
+
+        return [
+            ('mes_commandes', MesCommandesView, customer),
+            ('pending', PendingCommandesView, admin),
+            ('pending2', PendingCommandesView2, admin),
+            ('pending_livreur', PendingCommandesLivreurView, courier),
+            ('stats', StatisticsView, admin),
+            ('stats_livreur', LivreurStatisticsView, courier),
+        ]
+
+    def measure(self):
+        factory = APIRequestFactory()
+        results = {}
+
+        for name, view_class, user in self.endpoints():
+            view = view_class.as_view()
+
+            def call():
+                request = factory.get('/', {'page_size': 20})
+                force_authenticate(request, user=user)
+                view(request).render()
+
+            results[name] = self.median(call)
+
+        results['category'] = self.median(lambda: catalog.render_catalog('restaurant'))
+        results['admin_fanout'] = self.median(
+            lambda: list(User.objects.filter(type__in=['admin', 'super_admin']))
+        )
+        return results
+
+    def median(self, func):
+        func()  # warm up
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def report(self, before, after):
+        self.stdout.write('')
+        self.stdout.write(f'{"endpoint":<18}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            self.stdout.write(f'{name:<18}{before[name]:>12.2f}{after[name]:>12.2f}{speedup:>9.1f}x')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api import catalog
+from api.models import Vendor, ItemVendor
+from api.variants import build_variants
+
+
+class Command(BaseCommand):
+    help = 'Compute image_variants for every vendor and item (run once after migrating, or after moving media).'
+
+    def handle(self, *args, **options):
+        changed = 0
+        for model in (Vendor, ItemVendor):
+            field = model._meta.get_field('image')
+            for pk, image, current in model.objects.values_list('pk', 'image', 'image_variants').iterator():
+                variants = build_variants(field, image)
+                if variants != current:
+                    model.objects.filter(pk=pk).update(image_variants=variants)
+                    changed += 1
+
+        if changed:
+            catalog.invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Updated image variants for {changed} row(s).'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = 'Compare the stats counters against a fresh recount; --fix rebuilds them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the counters when they drift.')
+
+    def handle(self, *args, **options):
+        drifted = stats.drift()
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Stats counters are consistent.'))
+            return
+
+        for name, (stored, expected) in sorted(drifted.items()):
+            self.stdout.write(f'{name}: stored {stored}, expected {expected}')
+
+        if not options['fix']:
+            raise CommandError(f'{len(drifted)} counter(s) drifted; run with --fix to rebuild.')
+
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats counters ({len(drifted)} fixed).'))
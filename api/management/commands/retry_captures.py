@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from api import captures
+from api.models import Commande
+
+
+class Command(BaseCommand):
+    help = (
+        'Push staged payment captures that failed, or have been pending for a while '
+        '(their upload died with its worker), to Cloudinary.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed-only', action='store_true', help='Only retry captures marked as failed.')
+        parser.add_argument(
+            '--pending-after', type=int, default=15,
+            help='Minutes a capture may stay pending (still in the upload pool) before it is retried.',
+        )
+
+    def handle(self, *args, **options):
+        retryable = Q(capture_status='failed')
+        if not options['failed_only']:
+            cutoff = timezone.now() - timedelta(minutes=options['pending_after'])
+            retryable |= Q(capture_status='pending', updated_at__lt=cutoff)
+        candidates = Commande.objects.filter(retryable).exclude(capture_staged='')
+        ids = list(candidates.values_list('id', flat=True))
+
+        uploaded = 0
+        for commande_id in ids:
+            # Claim the row first, so another run (or a late worker) that sees
+            # it afterwards no longer finds it retryable.
+            claimed = candidates.filter(pk=commande_id).update(capture_status='pending', updated_at=timezone.now())
+            if not claimed:
+                continue
+            captures.upload(commande_id)
+            uploaded += Commande.objects.filter(pk=commande_id, capture_status='uploaded').exists()
+
+        self.stdout.write(self.style.SUCCESS(f'{uploaded}/{len(ids)} capture(s) uploaded.'))
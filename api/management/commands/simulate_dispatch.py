@@ -0,0 +1,91 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.geo import GridIndex
+
+
+# Roughly Nouakchott.
+BOUNDS = ((18.00, 18.16), (-16.06, -15.90))
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate dispatching synthetic orders to the nearest free courier with the '
+        'in-memory grid index, and compare its latency and answers with a linear scan.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--couriers', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--cell', type=float, default=0.01, help='Grid cell size in degrees.')
+        parser.add_argument('--check', type=int, default=200, help='Orders also answered by a linear scan.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        index = GridIndex(cell_degrees=options['cell'])
+
+        def point():
+            return rng.uniform(*BOUNDS[0]), rng.uniform(*BOUNDS[1])
+
+        start = time.perf_counter()
+        for courier in range(options['couriers']):
+            index.update(courier, *point())
+        self.stdout.write(f'Indexed {len(index)} couriers in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+        orders = [point() for _ in range(options['orders'])]
+        busy = set()
+        timings, distances = [], []
+        mismatches = unassigned = 0
+        grid_check = brute_check = 0.0
+
+        for number, (latitude, longitude) in enumerate(orders):
+            start = time.perf_counter()
+            proposal = index.nearest(latitude, longitude, exclude=busy)
+            elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+
+            if number < options['check']:
+                start = time.perf_counter()
+                expected = index.brute_force_nearest(latitude, longitude, exclude=busy)
+                brute_check += time.perf_counter() - start
+                grid_check += elapsed
+                if (expected and expected[1]) != (proposal and proposal[1]):
+                    mismatches += 1
+
+            if proposal is None:
+                unassigned += 1
+                # Everyone is out; free them all, as if a wave of deliveries finished.
+                busy.clear()
+                continue
+            courier, distance = proposal
+            distances.append(distance)
+            busy.add(courier)
+            if len(busy) == len(index):
+                busy.clear()
+
+        timings.sort()
+        micro = 1_000_000
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))] * micro
+
+        self.stdout.write(
+            f'{len(orders)} orders: p50 {percentile(0.50):.0f} µs, p95 {percentile(0.95):.0f} µs, '
+            f'p99 {percentile(0.99):.0f} µs, max {timings[-1] * micro:.0f} µs'
+        )
+        self.stdout.write(
+            f'Mean distance {statistics.mean(distances):.2f} km, '
+            f'{unassigned} order(s) found every courier busy'
+        )
+        if options['check']:
+            checked = min(options['check'], len(orders))
+            self.stdout.write(
+                f'Linear scan on {checked} orders: {brute_check / checked * micro:.0f} µs each vs '
+                f'{grid_check / checked * micro:.0f} µs for the grid; {mismatches} mismatch(es)'
+            )
+        style = self.style.SUCCESS if not mismatches else self.style.ERROR
+        self.stdout.write(style('Done.'))
@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import sms
+from api.sms_stub import StubSmsGateway
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stand-in for the SMS gateway. Point SMS_GATEWAY_URL at the '
+        'printed URL, or pass --load N to push N OTPs through the SMS client and '
+        'report throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds per request.')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered 503.')
+        parser.add_argument('--load', type=int, default=0, help='Send this many OTPs, report and exit.')
+
+    def handle(self, *args, **options):
+        gateway = StubSmsGateway(port=options['port'], latency=options['latency'], fail_rate=options['fail_rate'])
+        self.stdout.write(f'Stub SMS gateway listening on {gateway.url}')
+
+        if not options['load']:
+            try:
+                gateway.serve_forever()
+            except KeyboardInterrupt:
+                self.stdout.write(f'\n{len(gateway.received)} SMS received ({gateway.attempts} attempts)')
+            return
+
+        with gateway:
+            self.load_test(gateway, options['load'])
+
+    def load_test(self, gateway, count):
+        settings.SMS_GATEWAY_URL = gateway.url
+        sms.reset_session()
+
+        start = time.perf_counter()
+        futures = [sms.queue_validation_sms(f'2{i:07}', '123456') for i in range(count)]
+        queued = time.perf_counter() - start
+        for future in futures:
+            if future is not None:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        dropped = sum(future is None for future in futures)
+        self.stdout.write(
+            f'{count} OTPs: queued in {queued * 1000:.1f} ms, delivered {len(gateway.received)} '
+            f'({gateway.attempts} attempts, {dropped} dropped) in {elapsed:.2f}s '
+            f'= {len(gateway.received) / elapsed:.1f} SMS/s'
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_rename_name_fr_vendor_name_remove_commande_title_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['-date', '-id'], name='commande_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:42
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_counters(apps, schema_editor):
+    Commande = apps.get_model('api', 'Commande')
+    User = apps.get_model('api', 'User')
+    StatCounter = apps.get_model('api', 'StatCounter')
+
+    counters = Counter()
+    for row in Commande.objects.order_by().values('status', 'livreur_id').annotate(n=Count('id')):
+        counters[f"commandes:{row['status']}"] += row['n']
+        if row['livreur_id'] is not None:
+            counters[f"commandes:{row['status']}:livreur:{row['livreur_id']}"] += row['n']
+    for row in User.objects.order_by().values('type').annotate(n=Count('id')):
+        counters[f"users:{row['type']}"] += row['n']
+
+    StatCounter.objects.bulk_create([StatCounter(name=name, value=value) for name, value in counters.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_counters, migrations.RunPython.noop),
+    ]
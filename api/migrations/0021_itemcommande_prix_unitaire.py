@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:51
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_current_prices(apps, schema_editor):
+    # Best effort for existing lines: the price they were sold at was never
+    # recorded, so take today's catalog price.
+    ItemCommande = apps.get_model('api', 'ItemCommande')
+    ItemVendor = apps.get_model('api', 'ItemVendor')
+    ItemCommande.objects.filter(item__isnull=False).update(
+        prix_unitaire=Subquery(ItemVendor.objects.filter(pk=OuterRef('item_id')).values('prix')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_statcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemcommande',
+            name='prix_unitaire',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(snapshot_current_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+def mark_existing_captures(apps, schema_editor):
+    # Captures saved before the background pipeline are already on Cloudinary.
+    Commande = apps.get_model('api', 'Commande')
+    Commande.objects.exclude(capture__isnull=True).exclude(capture='').update(capture_status='uploaded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_itemcommande_prix_unitaire'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='capture_staged',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='capture_status',
+            field=models.CharField(choices=[('none', 'None'), ('pending', 'Pending'), ('uploaded', 'Uploaded'), ('failed', 'Failed')], default='none', max_length=20),
+        ),
+        migrations.RunPython(mark_existing_captures, migrations.RunPython.noop),
+    ]
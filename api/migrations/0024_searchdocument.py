@@ -0,0 +1,97 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+SQLITE_INDEX = [
+    # External-content FTS5 table over api_searchdocument.body, kept in step by triggers.
+    """CREATE VIRTUAL TABLE api_searchdocument_fts USING fts5(
+        body, content='api_searchdocument', content_rowid='id', tokenize='unicode61 remove_diacritics 0'
+    )""",
+    """CREATE TRIGGER api_searchdocument_ai AFTER INSERT ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER api_searchdocument_ad AFTER DELETE ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(api_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER api_searchdocument_au AFTER UPDATE OF body ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(api_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO api_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS api_searchdocument_au',
+    'DROP TRIGGER IF EXISTS api_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS api_searchdocument_ai',
+    'DROP TABLE IF EXISTS api_searchdocument_fts',
+]
+
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX searchdocument_body_fts_idx ON api_searchdocument USING gin (to_tsvector('simple', body))",
+    'CREATE INDEX searchdocument_body_trgm_idx ON api_searchdocument USING gin (body gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS searchdocument_body_trgm_idx',
+    'DROP INDEX IF EXISTS searchdocument_body_fts_idx',
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+def index_catalog(apps, schema_editor):
+    from api.search import normalize
+
+    Vendor = apps.get_model('api', 'Vendor')
+    ItemVendor = apps.get_model('api', 'ItemVendor')
+    SearchDocument = apps.get_model('api', 'SearchDocument')
+
+    vendor_types = dict(Vendor.objects.values_list('pk', 'type'))
+    documents = [
+        SearchDocument(kind='vendor', object_id=pk, vendor_id=pk, vendor_type=vendor_type, body=normalize(name))
+        for pk, name, vendor_type in Vendor.objects.values_list('pk', 'name', 'type')
+    ]
+    documents += [
+        SearchDocument(
+            kind='item', object_id=pk, vendor_id=vendor_id,
+            vendor_type=vendor_types.get(vendor_id, ''), body=normalize(nom),
+        )
+        for pk, nom, vendor_id in ItemVendor.objects.values_list('pk', 'nom', 'vendor_id')
+    ]
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('vendor', 'Vendor'), ('item', 'Item')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('vendor_id', models.IntegerField(null=True)),
+                ('vendor_type', models.CharField(blank=True, max_length=50)),
+                ('body', models.TextField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='searchdocument_kind_object_uniq')],
+            },
+        ),
+        migrations.RunPython(
+            run({'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}),
+            run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+        migrations.RunPython(index_catalog, migrations.RunPython.noop),
+    ]
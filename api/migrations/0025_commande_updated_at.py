@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def backfill_from_date(apps, schema_editor):
+    # Existing orders have never been tracked; their creation date is the best watermark we have.
+    Commande = apps.get_model('api', 'Commande')
+    Commande.objects.update(updated_at=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_from_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['updated_at'], name='commande_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['user', 'updated_at'], name='commande_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+def parse_existing_locations(apps, schema_editor):
+    from api.geo import parse_location
+
+    Commande = apps.get_model('api', 'Commande')
+    for pk, location in Commande.objects.values_list('pk', 'location').iterator():
+        coordinates = parse_location(location)
+        if coordinates:
+            Commande.objects.filter(pk=pk).update(latitude=coordinates[0], longitude=coordinates[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_commande_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_existing_locations, migrations.RunPython.noop),
+    ]
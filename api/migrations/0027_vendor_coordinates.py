@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_commande_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendor',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
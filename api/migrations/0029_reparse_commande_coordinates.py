@@ -0,0 +1,38 @@
+import re
+from urllib.parse import unquote
+
+from django.db import migrations
+
+
+# What 0026 and Commande.save() used to accept: any "number, number".
+LOOSE_COORDINATES = re.compile(r'(-?\d{1,2}(?:\.\d+)?)\s*[,;]\s*(-?\d{1,3}(?:\.\d+)?)')
+
+
+def loose_parse(text):
+    match = LOOSE_COORDINATES.search(unquote(text or ''))
+    return (float(match.group(1)), float(match.group(2))) if match else None
+
+
+def reparse_locations(apps, schema_editor):
+    from api.geo import parse_location
+
+    Commande = apps.get_model('api', 'Commande')
+    rows = Commande.objects.filter(latitude__isnull=False).values_list('pk', 'location', 'latitude', 'longitude')
+    for pk, location, latitude, longitude in rows.iterator():
+        # Only rows whose point came from the text; coordinates sent by the app stay.
+        if loose_parse(location) != (latitude, longitude):
+            continue
+        coordinates = parse_location(location) or (None, None)
+        if coordinates != (latitude, longitude):
+            Commande.objects.filter(pk=pk).update(latitude=coordinates[0], longitude=coordinates[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_cache_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(reparse_locations, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from phonenumber_field.modelfields import PhoneNumberField
 from django.contrib.auth.models import AbstractUser, BaseUserManager, PermissionsMixin
 from django.utils.translation import gettext_lazy as _
@@ -6,6 +6,9 @@ from django.contrib.auth.hashers import make_password
 import uuid
 from cloudinary.models import CloudinaryField
 
+from .geo import parse_location
+from .variants import build_variants
+
 
 
 
@@ -57,6 +60,11 @@ class User(AbstractUser):
 
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['type'], name='user_type_idx'),
+        ]
+
     def __str__(self):
         return f'{self.phone}'
 
@@ -65,9 +73,23 @@ class User(AbstractUser):
         if self.password:
             self.password = self.password
 
-        super().save(*args, **kwargs)
+        # Keeps the stats counters (api/stats.py) in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 
+def refresh_image_variants(instance):
+    """
+    Recompute ``image_variants`` from ``image`` after a save. The image is
+    only final once the field has uploaded it, so this runs after the write
+    and issues a second UPDATE only when the variants actually changed.
+    """
+    variants = build_variants(instance._meta.get_field('image'), instance.image)
+    if variants != instance.image_variants:
+        instance.image_variants = variants
+        type(instance).objects.filter(pk=instance.pk).update(image_variants=variants)
+
 
 class Vendor(models.Model):
     TYPE_CHOICES = [
@@ -76,8 +98,22 @@ class Vendor(models.Model):
         ('epicerie', 'Epicerie'),
     ]
     image = CloudinaryField('image')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     name = models.CharField(max_length=100)
     type = models.CharField(max_length=50, choices=TYPE_CHOICES)
+    # Where orders are picked up; delivery fees are quoted from here (api/fees.py).
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['type'], name='vendor_type_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            refresh_image_variants(self)
 
     def __str__(self):
         return f'{self.name} - {self.type}'
@@ -89,7 +125,12 @@ class ItemVendor(models.Model):
     nom = models.CharField(max_length=100, null=True)
     prix = models.FloatField()
     vendor = models.ForeignKey(Vendor, related_name='vendor_items', on_delete=models.CASCADE, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            refresh_image_variants(self)
 
     def __str__(self):
         return f'{self.nom} - {self.prix}'
@@ -98,6 +139,14 @@ class ItemVendor(models.Model):
 
 
 
+class CommandeQuerySet(models.QuerySet):
+    def with_details(self):
+        # Everything CommandeSerializer touches, in two queries whatever the page size.
+        return self.select_related('user', 'livreur').prefetch_related(
+            models.Prefetch('items', queryset=ItemCommande.objects.select_related('vendor', 'item'))
+        )
+
+
 class Commande(models.Model):
     STATUS_CHOICES = [
         ('waiting', 'Waiting'),
@@ -113,16 +162,52 @@ class Commande(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
     location = models.TextField()
+    # Parsed from ``location`` when it carries coordinates, or sent by the app (api/geo.py).
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
     phone = models.CharField(max_length=100, default='')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     capture = CloudinaryField('image', blank=True, null=True)
+    CAPTURE_STATUS_CHOICES = [
+        ('none', 'None'),
+        ('pending', 'Pending'),
+        ('uploaded', 'Uploaded'),
+        ('failed', 'Failed'),
+    ]
+    capture_status = models.CharField(max_length=20, choices=CAPTURE_STATUS_CHOICES, default='none')
+    # Local file waiting to be pushed to Cloudinary (api/captures.py).
+    capture_staged = models.CharField(max_length=255, blank=True, default='')
     livreur = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True, related_name='livreur')
+    # Bumped on every save; bulk .update() calls must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CommandeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='commande_date_id_idx'),
+            models.Index(fields=['status', '-date', '-id'], name='commande_status_date_idx'),
+            models.Index(fields=['livreur', 'status'], name='commande_livreur_status_idx'),
+            models.Index(fields=['user', '-date', '-id'], name='commande_user_date_idx'),
+            # Delta sync (?since=): everything changed after a watermark, overall or per customer.
+            models.Index(fields=['updated_at'], name='commande_updated_idx'),
+            models.Index(fields=['user', 'updated_at'], name='commande_user_updated_idx'),
+            # Couriers' "paid and unassigned" list only ever holds a handful of rows.
+            models.Index(
+                fields=['-date', '-id'], name='commande_paid_unassigned_idx',
+                condition=models.Q(status='paid', livreur__isnull=True),
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.code:
             unique_code = uuid.uuid4().hex[:8].upper()
             self.code = f"CM{unique_code}"
-        super().save(*args, **kwargs)
+        if self.latitude is None and self.longitude is None:
+            self.latitude, self.longitude = parse_location(self.location) or (None, None)
+        # Keeps the stats counters (api/stats.py) in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Commande {self.id} - {self.status} - {self.code}"
@@ -135,6 +220,8 @@ class ItemCommande(models.Model):
     commande = models.ForeignKey(Commande, on_delete=models.CASCADE, related_name='items')
     number = models.PositiveIntegerField()
     item = models.ForeignKey(ItemVendor, on_delete=models.CASCADE, null=True)
+    # Unit price when the order was placed; later catalog changes don't rewrite history.
+    prix_unitaire = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return f"ItemCommande {self.id} - x{self.number}"
@@ -142,3 +229,39 @@ class ItemCommande(models.Model):
 
 
 
+class StatCounter(models.Model):
+    """
+    Denormalized dashboard counts, e.g. ``commandes:delivered``,
+    ``commandes:loading:livreur:12`` or ``users:simple``.
+    Maintained by api/stats.py; ``manage.py check_stats --fix`` rebuilds them.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} = {self.value}'
+
+
+class SearchDocument(models.Model):
+    """
+    One searchable vendor or item, with its name already normalized.
+    Kept in sync by api/signals.py and queried through the backend's
+    full-text index (see api/search.py).
+    """
+    KIND_CHOICES = [
+        ('vendor', 'Vendor'),
+        ('item', 'Item'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    vendor_id = models.IntegerField(null=True)
+    vendor_type = models.CharField(max_length=50, blank=True)
+    body = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='searchdocument_kind_object_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}: {self.body}'
@@ -0,0 +1,220 @@
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from firebase_admin import messaging
+from firebase_admin._messaging_utils import SenderIdMismatchError, UnregisteredError
+
+from .background import BackgroundPool
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .models import User
+from . import stats
+from .profiling import span
+from . import firebase_init  # noqa: F401  (initializes the Firebase app)
+
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TYPES = ['admin', 'super_admin']
+LANGS = ['fr', 'ar']
+DEFAULT_LANG = 'fr'
+
+# FCM accepts at most 500 tokens per multicast.
+MULTICAST_LIMIT = 500
+ADMIN_TOPIC = 'admins-{}'
+
+# Errors that mean the token itself is dead and will never work again.
+DEAD_TOKEN_ERRORS = (UnregisteredError, SenderIdMismatchError)
+PRUNED_TOKENS_COUNTER = 'fcm:pruned_tokens'
+
+# A dead token is the device's problem, not Firebase's; it must not trip the breaker.
+firebase_breaker = CircuitBreaker(
+    'firebase',
+    failure_threshold=getattr(settings, 'FIREBASE_BREAKER_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'FIREBASE_BREAKER_RESET', 30.0),
+    ignored_exceptions=DEAD_TOKEN_ERRORS,
+)
+
+pool = BackgroundPool(
+    'notifications', 'NOTIFICATION_WORKERS', 'NOTIFICATION_QUEUE_SIZE', 'NOTIFICATIONS_ASYNC',
+)
+
+
+def dispatch(func, *args):
+    pool.submit_on_commit(func, *args)
+
+
+def build_notification(title, body):
+    return messaging.Notification(
+        title=title,
+        body=body,
+    )
+
+
+def build_message(title, body, token=None, topic=None):
+    return messaging.Message(
+        notification=build_notification(title, body),
+        token=token,
+        topic=topic,
+    )
+
+
+def send_notification(title, body, token):
+    # Skip empty or None tokens
+    if not token:
+        return
+
+    try:
+        with span('outbound'):
+            response = firebase_breaker.call(messaging.send, build_message(title, body, token=token))
+        logger.info('Notification sent: %s', response)
+
+    except CircuitOpenError:
+        logger.warning('Firebase circuit open, notification skipped')
+
+    except DEAD_TOKEN_ERRORS:
+        # Token no longer valid — forget it so it isn't retried on every event
+        prune_tokens([token])
+
+    except Exception:
+        # Any other Firebase error — counted by the breaker, otherwise skipped
+        logger.exception('Firebase send failed')
+
+
+def send_multicast(title, body, tokens):
+    """Send one notification to many devices, ``MULTICAST_LIMIT`` tokens per FCM call."""
+    for start in range(0, len(tokens), MULTICAST_LIMIT):
+        message = messaging.MulticastMessage(
+            notification=build_notification(title, body),
+            tokens=tokens[start:start + MULTICAST_LIMIT],
+        )
+        try:
+            with span('outbound'):
+                response = firebase_breaker.call(messaging.send_each_for_multicast, message)
+            logger.info('Multicast sent: %s ok, %s failed', response.success_count, response.failure_count)
+            prune_tokens(dead_tokens(message.tokens, response))
+
+        except CircuitOpenError:
+            logger.warning('Firebase circuit open, multicast skipped')
+            return
+
+        except Exception:
+            logger.exception('Firebase multicast failed')
+
+
+def dead_tokens(tokens, batch_response):
+    # Responses come back in the same order as the tokens were sent.
+    return [
+        token for token, result in zip(tokens, batch_response.responses)
+        if not result.success and isinstance(result.exception, DEAD_TOKEN_ERRORS)
+    ]
+
+
+def prune_tokens(tokens):
+    """Clear dead tokens with a single UPDATE and tally them; returns how many were cleared."""
+    if not tokens:
+        return 0
+
+    pruned = User.objects.filter(fcm_token__in=tokens).update(fcm_token='')
+    if pruned:
+        stats.apply({PRUNED_TOKENS_COUNTER: pruned})
+        logger.info('Pruned %s dead FCM token(s)', pruned)
+    return pruned
+
+
+def send_to_topic(title, body, topic):
+    try:
+        with span('outbound'):
+            response = firebase_breaker.call(messaging.send, build_message(title, body, topic=topic))
+        logger.info('Topic notification sent to %s: %s', topic, response)
+
+    except CircuitOpenError:
+        logger.warning('Firebase circuit open, topic notification skipped')
+
+    except Exception:
+        logger.exception('Firebase topic send failed')
+
+
+def localized(messages, lang):
+    """Pick ``(title, body)`` for ``lang`` from ``{lang: (title, body)}``."""
+    return messages.get(lang) or messages[DEFAULT_LANG]
+
+
+def admin_tokens_by_lang():
+    tokens = defaultdict(list)
+    admins = User.objects.filter(type__in=ADMIN_TYPES).exclude(fcm_token='')
+    for lang, token in admins.values_list('default_lang', 'fcm_token'):
+        tokens[lang if lang in LANGS else DEFAULT_LANG].append(token)
+    return dict(tokens)
+
+
+def send_to_admins(messages, tokens_by_lang):
+    for lang, tokens in tokens_by_lang.items():
+        send_multicast(*localized(messages, lang), tokens)
+
+
+def send_to_admin_topics(messages):
+    for lang in LANGS:
+        send_to_topic(*localized(messages, lang), ADMIN_TOPIC.format(lang))
+
+
+def admin_topics_enabled():
+    return getattr(settings, 'NOTIFY_ADMINS_VIA_TOPIC', False)
+
+
+def notify_user(title, body, token):
+    if token:
+        dispatch(send_notification, title, body, token)
+
+
+def notify_admins(messages):
+    """
+    Tell every admin, each in their own ``default_lang``.
+
+    ``messages`` maps a language to ``(title, body)``. In topic mode this is
+    one FCM call per language; otherwise one multicast per 500 admins.
+    """
+    if admin_topics_enabled():
+        dispatch(send_to_admin_topics, messages)
+        return
+
+    # The token lookup stays on the request thread; only network I/O is deferred.
+    tokens_by_lang = admin_tokens_by_lang()
+    if tokens_by_lang:
+        dispatch(send_to_admins, messages, tokens_by_lang)
+
+
+# --- Admin topic subscriptions (NOTIFY_ADMINS_VIA_TOPIC) ---
+
+def change_topic(token, subscribe_to=None, unsubscribe_from=None):
+    try:
+        if unsubscribe_from:
+            firebase_breaker.call(messaging.unsubscribe_from_topic, [token], unsubscribe_from)
+        if subscribe_to:
+            firebase_breaker.call(messaging.subscribe_to_topic, [token], subscribe_to)
+
+    except CircuitOpenError:
+        logger.warning('Firebase circuit open, topic change skipped')
+
+    except Exception:
+        logger.exception('Firebase topic subscription failed')
+
+
+def sync_admin_topic(user, old_token, old_lang):
+    """
+    Keep ``user``'s device on the admin topic for their language.
+
+    Call after login, a language change or logout, passing the token and
+    language the user had before.
+    """
+    if not admin_topics_enabled() or user.type not in ADMIN_TYPES:
+        return
+
+    old_topic = ADMIN_TOPIC.format(old_lang)
+    new_topic = ADMIN_TOPIC.format(user.default_lang)
+
+    if old_token and (old_token, old_topic) != (user.fcm_token, new_topic):
+        dispatch(change_topic, old_token, None, old_topic)
+    if user.fcm_token:
+        # Subscribing is idempotent; repeat it on every login.
+        dispatch(change_topic, user.fcm_token, new_topic, None)
@@ -0,0 +1,81 @@
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# One pending code per (purpose, phone). Entries expire with the cache timeout,
+# and the cache's MAX_ENTRIES bounds how many can be held at once.
+OTP_KEY = 'otp:{}:{}'
+VERIFIED_KEY = 'otp:verified:{}:{}'
+# One slot per allowed guess at a given code (its nonce), reserved with add().
+ATTEMPT_KEY = 'otp:attempt:{}:{}:{}:{}'
+
+
+def generate_otp():
+    return f'{secrets.randbelow(900000) + 100000}'
+
+
+def digest(code):
+    return hmac.new(settings.SECRET_KEY.encode(), code.encode(), hashlib.sha256).hexdigest()
+
+
+def issue(phone, purpose):
+    """Create (or replace) the pending code for ``phone`` and return it."""
+    code = generate_otp()
+    entry = {'digest': digest(code), 'nonce': secrets.token_hex(8), 'expires': time.time() + settings.OTP_TTL}
+    cache.set(OTP_KEY.format(purpose, phone), entry, settings.OTP_TTL)
+    cache.delete(VERIFIED_KEY.format(purpose, phone))
+    return code
+
+
+def claim_attempt(phone, purpose, entry, timeout):
+    """
+    Reserve one of the ``OTP_MAX_ATTEMPTS`` guesses at this code. ``add()``
+    only succeeds for one caller per slot on every backend (a primary key on
+    the database cache), so parallel guesses can't share a count the way a
+    read-increment-write would; ``incr()`` is not atomic on the database cache.
+    """
+    for slot in range(settings.OTP_MAX_ATTEMPTS):
+        if cache.add(ATTEMPT_KEY.format(purpose, phone, entry['nonce'], slot), True, timeout):
+            return True
+    return False
+
+
+def verify(phone, purpose, code):
+    """
+    Check ``code`` against the pending one. A code is single-use and is
+    discarded once ``OTP_MAX_ATTEMPTS`` guesses have been made at it.
+    """
+    key = OTP_KEY.format(purpose, phone)
+    entry = cache.get(key)
+    if entry is None or not code:
+        return False
+
+    remaining = entry['expires'] - time.time()
+    if remaining <= 0 or not claim_attempt(phone, purpose, entry, remaining):
+        cache.delete(key)
+        return False
+
+    if hmac.compare_digest(entry['digest'], digest(str(code))):
+        cache.delete(key)
+        cache.set(VERIFIED_KEY.format(purpose, phone), True, settings.OTP_VERIFIED_TTL)
+        return True
+    return False
+
+
+def is_verified(phone, purpose):
+    return bool(cache.get(VERIFIED_KEY.format(purpose, phone)))
+
+
+def consume(phone, purpose):
+    """Use up a successful verification, so one code authorizes one signup or reset."""
+    return bool(cache.delete(VERIFIED_KEY.format(purpose, phone)))
+
+
+def required():
+    # Older app builds check the code on the device (OTP_EXPOSE_CODE) and never call verify-otp.
+    return not settings.OTP_EXPOSE_CODE
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CommandeCursorPagination(CursorPagination):
+    """
+    Keyset pagination over orders, newest first.
+
+    Pages are located with ``WHERE date < <cursor>`` against the
+    ``(date, id)`` index, so page cost does not depend on history depth.
+    """
+    ordering = ('-date', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def __init__(self, cursor_query_param=None):
+        if cursor_query_param is not None:
+            self.cursor_query_param = cursor_query_param
+
+    def get_page_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
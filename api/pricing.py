@@ -0,0 +1,55 @@
+import threading
+
+from . import catalog
+from .models import ItemVendor
+
+
+class PriceBook:
+    """
+    In-memory ``item id -> (prix, vendor id)`` for the whole catalog.
+
+    Tagged with the catalog generation it was built from, so the same
+    Vendor/ItemVendor signals that invalidate catalog snapshots retire it.
+    """
+
+    def __init__(self, version, prices):
+        self.version = version
+        self.prices = prices
+
+    def lookup(self, item_ids):
+        """
+        Return ``{item id: (prix, vendor id)}`` for the ids that exist.
+        Ids the book doesn't know (e.g. created by another worker since it was
+        built) are read from the database instead of being reported missing.
+        """
+        found = {pk: self.prices[pk] for pk in item_ids if pk in self.prices}
+        missing = set(item_ids) - set(found)
+        if missing:
+            found.update(load_prices(ItemVendor.objects.filter(pk__in=missing)))
+        return found
+
+
+def load_prices(queryset):
+    return {pk: (prix, vendor_id) for pk, prix, vendor_id in queryset.values_list('id', 'prix', 'vendor_id')}
+
+
+_book = None
+_lock = threading.Lock()
+
+
+def get_price_book():
+    global _book
+    version = catalog.current_generation()
+    book = _book
+    if book is not None and book.version == version:
+        return book
+
+    with _lock:
+        if _book is None or _book.version != version:
+            _book = PriceBook(version, load_prices(ItemVendor.objects.all()))
+        return _book
+
+
+def subtotal(lines):
+    """Order total from the unit prices snapshotted on each ItemCommande."""
+    return sum(line.prix_unitaire * line.number for line in lines)
@@ -0,0 +1,115 @@
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger('api.profiling')
+
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.timings = {'db': 0.0, 'serialize': 0.0, 'outbound': 0.0}
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add('db', time.perf_counter() - start)
+
+
+@contextmanager
+def span(name):
+    """
+    Charge the time spent in the block to ``name`` on the current request.
+
+    A no-op outside a profiled request, so call sites can stay instrumented.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+class RequestProfilingMiddleware:
+    """
+    Opt-in (``REQUEST_PROFILING = True``) per-request timings.
+
+    Reports query count, DB time, serialization/render time and outbound
+    (Firebase, SMS) time as ``Server-Timing`` headers and as one JSON line per
+    request on the ``api.profiling`` logger.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = time.perf_counter() - start
+        response['Server-Timing'] = self.server_timing(profile, total)
+        self.log(request, response, profile, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; count that as serialization.
+        profile = _current.get()
+        if profile is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: profile.add('serialize', time.perf_counter() - start)
+            )
+        return response
+
+    def server_timing(self, profile, total):
+        metrics = [f'db;dur={profile.timings["db"] * 1000:.1f};desc="{profile.queries} queries"']
+        metrics += [
+            f'{name};dur={seconds * 1000:.1f}'
+            for name, seconds in profile.timings.items() if name != 'db'
+        ]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log(self, request, response, profile, total):
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'ts': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': profile.queries,
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in profile.timings.items()},
+            'total_ms': round(total * 1000, 2),
+        }))
@@ -0,0 +1,152 @@
+import re
+import unicodedata
+
+from django.db import connection
+
+from .models import Vendor, ItemVendor, SearchDocument
+
+
+# --- Normalization (French and Arabic) ---
+
+TATWEEL = 'ـ'
+ARABIC_FOLD = str.maketrans({
+    'ٱ': 'ا',  # alef wasla -> alef
+    'ة': 'ه',  # ta marbuta -> ha
+    'ى': 'ي',  # alef maqsura -> ya
+})
+ARABIC_ARTICLE = 'ال'  # "al-"
+NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def strip_marks(text):
+    # NFKD splits accents (é), hamza/madda carriers (أ, آ) and harakat into
+    # combining marks, which are then dropped.
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def tokens(text):
+    text = strip_marks(text or '').replace(TATWEEL, '').translate(ARABIC_FOLD).casefold()
+    words = []
+    for word in NON_WORD.split(text):
+        if word.startswith(ARABIC_ARTICLE) and len(word) > 3:
+            word = word[len(ARABIC_ARTICLE):]
+        if word:
+            words.append(word)
+    return words
+
+
+def normalize(text):
+    return ' '.join(tokens(text))
+
+
+# --- Index maintenance (called from api/signals.py) ---
+
+def index_vendor(vendor):
+    SearchDocument.objects.update_or_create(
+        kind='vendor', object_id=vendor.pk,
+        defaults={'vendor_id': vendor.pk, 'vendor_type': vendor.type, 'body': normalize(vendor.name)},
+    )
+    # Items are filtered by their vendor's category.
+    SearchDocument.objects.filter(kind='item', vendor_id=vendor.pk).exclude(
+        vendor_type=vendor.type
+    ).update(vendor_type=vendor.type)
+
+
+def index_item(item):
+    vendor_type = item.vendor.type if item.vendor_id else ''
+    SearchDocument.objects.update_or_create(
+        kind='item', object_id=item.pk,
+        defaults={'vendor_id': item.vendor_id, 'vendor_type': vendor_type, 'body': normalize(item.nom)},
+    )
+
+
+def unindex(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild():
+    """Recreate every document from the catalog tables."""
+    vendor_types = dict(Vendor.objects.values_list('pk', 'type'))
+    documents = [
+        SearchDocument(kind='vendor', object_id=pk, vendor_id=pk, vendor_type=vendor_type, body=normalize(name))
+        for pk, name, vendor_type in Vendor.objects.values_list('pk', 'name', 'type')
+    ]
+    documents += [
+        SearchDocument(
+            kind='item', object_id=pk, vendor_id=vendor_id,
+            vendor_type=vendor_types.get(vendor_id, ''), body=normalize(nom),
+        )
+        for pk, nom, vendor_id in ItemVendor.objects.values_list('pk', 'nom', 'vendor_id')
+    ]
+    SearchDocument.objects.all().delete()
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+    return len(documents)
+
+
+# --- Querying ---
+
+def sqlite_query(terms, vendor_type, limit, offset):
+    # Every term must match, each as a prefix ("piz" finds "pizza").
+    match = ' '.join(f'"{term}"*' for term in terms)
+    sql = (
+        'SELECT d.id FROM api_searchdocument_fts f '
+        'JOIN api_searchdocument d ON d.id = f.rowid '
+        'WHERE api_searchdocument_fts MATCH %s'
+    )
+    params = [match]
+    if vendor_type:
+        sql += ' AND d.vendor_type = %s'
+        params.append(vendor_type)
+    sql += ' ORDER BY bm25(api_searchdocument_fts), length(d.body), d.id LIMIT %s OFFSET %s'
+    return sql, params + [limit, offset]
+
+
+def postgresql_query(terms, vendor_type, limit, offset):
+    # Prefix full-text match, with trigram similarity to forgive typos.
+    query = ' & '.join(f'{term}:*' for term in terms)
+    text = ' '.join(terms)
+    sql = (
+        "SELECT id FROM api_searchdocument "
+        "WHERE (to_tsvector('simple', body) @@ to_tsquery('simple', %s) OR body %% %s)"
+    )
+    params = [query, text]
+    if vendor_type:
+        sql += ' AND vendor_type = %s'
+        params.append(vendor_type)
+    sql += (
+        " ORDER BY ts_rank(to_tsvector('simple', body), to_tsquery('simple', %s)) "
+        "+ similarity(body, %s) DESC, length(body), id LIMIT %s OFFSET %s"
+    )
+    return sql, params + [query, text, limit, offset]
+
+
+QUERIES = {
+    'sqlite': sqlite_query,
+    'postgresql': postgresql_query,
+}
+
+
+def search(text, vendor_type=None, limit=20, offset=0):
+    """
+    Return up to ``limit`` matching documents, best first, skipping ``offset``.
+    """
+    terms = tokens(text)
+    if not terms:
+        return []
+
+    build = QUERIES.get(connection.vendor)
+    if build is None:
+        documents = SearchDocument.objects.all()
+        for term in terms:
+            documents = documents.filter(body__contains=term)
+        if vendor_type:
+            documents = documents.filter(vendor_type=vendor_type)
+        return list(documents.order_by('id')[offset:offset + limit])
+
+    sql, params = build(terms, vendor_type, limit, offset)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    documents = SearchDocument.objects.in_bulk(ids)
+    return [documents[pk] for pk in ids if pk in documents]
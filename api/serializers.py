@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import *
+from . import pricing
 
 class LoginSerializer(serializers.Serializer):
     phone = serializers.CharField(max_length=20)
@@ -31,6 +32,7 @@ class ItemVendorSerializer(serializers.ModelSerializer):
     class Meta:
         model = ItemVendor
         fields = '__all__'
+        read_only_fields = ['image_variants']
 
 
 class VendorSerializer(serializers.ModelSerializer):
@@ -38,24 +40,26 @@ class VendorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vendor
         fields = '__all__'
+        read_only_fields = ['image_variants']
 
 
 class VendorDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vendor
-        fields = ['id', 'name', 'image', 'type']
+        fields = ['id', 'name', 'image', 'image_variants', 'type']
 
 
 class ItemVendorSerializer(serializers.ModelSerializer):
     class Meta:
         model = ItemVendor
         fields = '__all__'
+        read_only_fields = ['image_variants']
 
 
 class ItemVendorDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = ItemVendor
-        fields = ['id', 'image', 'nom', 'prix' ]
+        fields = ['id', 'image', 'image_variants', 'nom', 'prix' ]
 
 
 class UserDetailSerializer(serializers.ModelSerializer):
@@ -78,8 +82,58 @@ class ItemCommandeSerializer(serializers.ModelSerializer):
         model = ItemCommande
         fields = [
             'id', 'commande', 'vendor', 'vendor_id',
-            'number', 'item', 'item_id'
+            'number', 'item', 'item_id', 'prix_unitaire'
         ]
+        read_only_fields = ['prix_unitaire']
+
+class OrderLineSerializer(serializers.Serializer):
+    vendor_id = serializers.IntegerField()
+    item_id = serializers.IntegerField()
+    number = serializers.IntegerField(min_value=1)
+
+
+class ItemCommandeBulkSerializer(serializers.Serializer):
+    """
+    Validates a whole basket at once: vendors are resolved with one IN query
+    and items against the cached price book, and ``save(commande=...)``
+    inserts all lines with a single ``bulk_create``. Each line carries the
+    unit price it was sold at.
+    """
+    items = OrderLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, lines):
+        vendors = Vendor.objects.in_bulk({line['vendor_id'] for line in lines})
+        items = pricing.get_price_book().lookup({line['item_id'] for line in lines})
+
+        errors = []
+        for line in lines:
+            error = {}
+            if line['vendor_id'] not in vendors:
+                error['vendor_id'] = [f'Invalid pk "{line["vendor_id"]}" - object does not exist.']
+            if line['item_id'] not in items:
+                error['item_id'] = [f'Invalid pk "{line["item_id"]}" - object does not exist.']
+            elif items[line['item_id']][1] != line['vendor_id']:
+                # The line's vendor drives the delivery fee; it has to be the one selling the item.
+                error['vendor_id'] = [f'Item {line["item_id"]} is not sold by vendor {line["vendor_id"]}.']
+            errors.append(error)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return [
+            ItemCommande(
+                vendor=vendors[line['vendor_id']], item_id=line['item_id'], number=line['number'],
+                prix_unitaire=items[line['item_id']][0],
+            )
+            for line in lines
+        ]
+
+    def create(self, validated_data):
+        lines = validated_data['items']
+        for line in lines:
+            line.commande = validated_data['commande']
+        return ItemCommande.objects.bulk_create(lines)
+
 
 class CommandeSerializer(serializers.ModelSerializer):
     user = UserDetailSerializer(read_only=True)
@@ -89,9 +143,10 @@ class CommandeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Commande
         fields = [
-            'id', 'code', 'prix', 'date', 'status', 'location', 'livraison', 'capture',
-            'phone', 'user', 'items', 'livreur'
+            'id', 'code', 'prix', 'date', 'status', 'location', 'latitude', 'longitude', 'livraison', 'capture',
+            'capture_status', 'phone', 'user', 'items', 'livreur', 'updated_at'
         ]
+        read_only_fields = ['capture_status', 'updated_at']
 
     def create(self, validated_data):
         user = self.context['user'] 
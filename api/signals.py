@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User, Vendor, ItemVendor, Commande
+from . import catalog, events, search, stats
+
+
+@receiver([post_save, post_delete], sender=Vendor)
+@receiver([post_save, post_delete], sender=ItemVendor)
+def invalidate_catalog_snapshot(sender, **kwargs):
+    # Wait for the commit so a rebuild never snapshots uncommitted rows.
+    transaction.on_commit(catalog.invalidate_catalog)
+
+
+# Search index: one SearchDocument per vendor and item (api/search.py).
+
+@receiver(post_save, sender=Vendor)
+def index_vendor(sender, instance, **kwargs):
+    search.index_vendor(instance)
+
+
+@receiver(post_save, sender=ItemVendor)
+def index_item(sender, instance, **kwargs):
+    search.index_item(instance)
+
+
+@receiver(post_delete, sender=Vendor)
+@receiver(post_delete, sender=ItemVendor)
+def unindex_catalog_entry(sender, instance, **kwargs):
+    search.unindex('vendor' if sender is Vendor else 'item', instance.pk)
+
+
+# Stats counters: remember what each row counted for when it was loaded, and
+# move it between counters when it is saved or deleted. Model.save() wraps
+# these in the same transaction as the write.
+
+@receiver(post_init, sender=Commande)
+def remember_commande_state(sender, instance, **kwargs):
+    instance._stats_state = stats.commande_state(instance)
+
+
+# Registered before count_commande_save, which moves _stats_state forward.
+@receiver(post_save, sender=Commande)
+def publish_commande_event(sender, instance, created, **kwargs):
+    old_state = None if created else instance._stats_state
+    events.publish_commande_change(instance, old_state, stats.commande_state(instance))
+
+
+@receiver(post_save, sender=Commande)
+def count_commande_save(sender, instance, created, **kwargs):
+    new_state = stats.commande_state(instance)
+    stats.record_commande_change(None if created else instance._stats_state, new_state)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=Commande)
+def count_commande_delete(sender, instance, **kwargs):
+    stats.record_commande_change(stats.commande_state(instance), None)
+
+
+@receiver(post_init, sender=User)
+def remember_user_state(sender, instance, **kwargs):
+    instance._stats_state = stats.user_state(instance)
+
+
+@receiver(post_save, sender=User)
+def count_user_save(sender, instance, created, **kwargs):
+    new_state = stats.user_state(instance)
+    stats.record_user_change(None if created else instance._stats_state, new_state)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=User)
+def count_user_delete(sender, instance, **kwargs):
+    stats.record_user_change(stats.user_state(instance), None)
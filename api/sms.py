@@ -0,0 +1,112 @@
+import logging
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .background import BackgroundPool
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .profiling import span
+
+
+logger = logging.getLogger(__name__)
+
+
+class SmsRejected(Exception):
+    """The gateway refused this message (4xx); retrying or tripping the breaker won't help."""
+
+
+sms_breaker = CircuitBreaker(
+    'sms',
+    failure_threshold=getattr(settings, 'SMS_BREAKER_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'SMS_BREAKER_RESET', 30.0),
+    ignored_exceptions=(SmsRejected,),
+)
+
+pool = BackgroundPool('sms', 'SMS_WORKERS', 'SMS_QUEUE_SIZE', 'SMS_ASYNC', workers=8)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """One pooled, keep-alive session per process, with bounded retries and backoff."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Sending an OTP is neither idempotent nor free: only retry when
+            # the gateway certainly didn't take the message (connection
+            # refused, 429, 503), never after a read timeout or another 5xx
+            # where it may already have gone out.
+            retry = Retry(
+                total=settings.SMS_RETRIES,
+                connect=settings.SMS_RETRIES,
+                read=0,
+                other=0,
+                backoff_factor=settings.SMS_RETRY_BACKOFF,
+                status_forcelist=(429, 503),
+                allowed_methods=frozenset(['POST']),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=getattr(settings, 'SMS_WORKERS', 8),
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+def reset_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def post(payload):
+    response = get_session().post(
+        settings.SMS_GATEWAY_URL,
+        json=payload,
+        headers={'Validation-token': settings.SMS_GATEWAY_TOKEN},
+        timeout=(settings.SMS_CONNECT_TIMEOUT, settings.SMS_READ_TIMEOUT),
+    )
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        raise SmsRejected(f'{response.status_code}: {response.text[:200]}')
+    response.raise_for_status()
+    return response
+
+
+def send_validation_sms(phone_number, code, lang='fr'):
+    payload = {
+        "phone": phone_number,
+        "lang": lang,
+        "code": code
+    }
+
+    try:
+        with span('outbound'):
+            response = sms_breaker.call(post, payload)
+        logger.info('Validation SMS sent to %s', phone_number)
+        return response.json()
+
+    except CircuitOpenError:
+        logger.warning('SMS circuit open, validation SMS to %s skipped', phone_number)
+
+    except SmsRejected as err:
+        logger.warning('SMS to %s rejected: %s', phone_number, err)
+
+    except requests.exceptions.RequestException as err:
+        logger.warning('SMS to %s failed: %s', phone_number, err)
+
+
+def queue_validation_sms(phone_number, code, lang='fr'):
+    """Send the OTP from the SMS pool so the request never waits on the gateway."""
+    return pool.submit(send_validation_sms, phone_number, code, lang)
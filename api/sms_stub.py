@@ -0,0 +1,86 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSmsGateway:
+    """
+    Local stand-in for the SMS provider, for tests and offline load tests.
+
+    Accepts ``POST`` on any path, waits ``latency`` seconds and answers 200,
+    or ``fail_status`` (503) for a ``fail_rate`` fraction of requests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, fail_status=503):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.received = []
+        self.attempts = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self.handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/sms/validation/stub'
+
+    def handler_class(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with gateway._lock:
+                    gateway.attempts += 1
+                if gateway.latency:
+                    time.sleep(gateway.latency)
+
+                if random.random() < gateway.fail_rate:
+                    self.reply(gateway.fail_status, {'error': 'stub failure'})
+                    return
+
+                with gateway._lock:
+                    gateway.received.append(json.loads(body or b'{}'))
+                self.reply(200, {'success': True})
+
+            def reply(self, code, payload):
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(code)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout); nothing left to answer.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
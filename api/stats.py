@@ -0,0 +1,111 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import User, Commande, StatCounter
+
+
+# Counters that can be recomputed from the source tables. Others (event
+# tallies such as ``fcm:pruned_tokens``) are left alone by drift()/rebuild().
+DERIVED_PREFIXES = ['commandes:', 'users:']
+
+
+def derived_counters():
+    query = Q()
+    for prefix in DERIVED_PREFIXES:
+        query |= Q(name__startswith=prefix)
+    return StatCounter.objects.filter(query)
+
+
+def commande_keys(status, livreur_id):
+    keys = [f'commandes:{status}']
+    if livreur_id is not None:
+        keys.append(f'commandes:{status}:livreur:{livreur_id}')
+    return keys
+
+
+def user_keys(user_type):
+    return [f'users:{user_type}']
+
+
+def commande_state(commande):
+    return commande.__dict__.get('status'), commande.__dict__.get('livreur_id')
+
+
+def user_state(user):
+    return user.__dict__.get('type')
+
+
+def diff(old_keys, new_keys):
+    deltas = Counter()
+    for key in old_keys:
+        deltas[key] -= 1
+    for key in new_keys:
+        deltas[key] += 1
+    return deltas
+
+
+def apply(deltas):
+    """
+    Add ``deltas`` (counter name -> increment) in place with ``value = value + n``.
+
+    Call inside the transaction that made the change so counters never commit
+    without it.
+    """
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        if not StatCounter.objects.filter(name=name).update(value=F('value') + delta):
+            StatCounter.objects.get_or_create(name=name)
+            StatCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def record_commande_change(old_state, new_state):
+    old_keys = commande_keys(*old_state) if old_state else []
+    new_keys = commande_keys(*new_state) if new_state else []
+    apply(diff(old_keys, new_keys))
+
+
+def record_user_change(old_type, new_type):
+    old_keys = user_keys(old_type) if old_type else []
+    new_keys = user_keys(new_type) if new_type else []
+    apply(diff(old_keys, new_keys))
+
+
+def read(names):
+    values = dict(StatCounter.objects.filter(name__in=names).values_list('name', 'value'))
+    return {name: values.get(name, 0) for name in names}
+
+
+def expected_counters():
+    """Recount everything from the source tables, one grouped aggregate per table."""
+    expected = Counter()
+    rows = Commande.objects.order_by().values('status', 'livreur_id').annotate(n=Count('id'))
+    for row in rows:
+        for key in commande_keys(row['status'], row['livreur_id']):
+            expected[key] += row['n']
+    for row in User.objects.order_by().values('type').annotate(n=Count('id')):
+        for key in user_keys(row['type']):
+            expected[key] += row['n']
+    return expected
+
+
+def drift():
+    """Return ``{name: (stored, expected)}`` for every counter that is off."""
+    expected = expected_counters()
+    stored = dict(derived_counters().values_list('name', 'value'))
+    return {
+        name: (stored.get(name, 0), expected.get(name, 0))
+        for name in set(expected) | set(stored)
+        if stored.get(name, 0) != expected.get(name, 0)
+    }
+
+
+def rebuild():
+    with transaction.atomic():
+        expected = expected_counters()
+        derived_counters().delete()
+        StatCounter.objects.bulk_create([
+            StatCounter(name=name, value=value) for name, value in expected.items() if value
+        ])
@@ -1,3 +1,1870 @@
-from django.test import TestCase
+import gzip
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from cloudinary import CloudinaryResource
+from firebase_admin import messaging
+from PIL import Image
+from firebase_admin._messaging_utils import UnregisteredError
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import OperationalError, connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User, Vendor, ItemVendor, Commande, ItemCommande, StatCounter, SearchDocument
+from . import catalog, dispatch, events, fees, geo, images, otp, pricing, search, stats, transitions
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from . import notifications
+from .notifications import firebase_breaker
+from . import sms
+from .sms_stub import StubSmsGateway
+
+
+# Query budgets below count the ORM's own work. The shared cache adds its
+# reads when it is the database (none on Redis); SharedCacheTests covers that.
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CategoryVendorViewTests(TestCase):
+    # Vendors + their items, whatever the catalog size.
+    QUERY_BUDGET = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        for vendor_type, _ in Vendor.TYPE_CHOICES:
+            for i in range(5):
+                vendor = Vendor.objects.create(name=f'{vendor_type} {i}', type=vendor_type, image='vendor.jpg')
+                ItemVendor.objects.bulk_create([
+                    ItemVendor(nom=f'item {j}', prix=100 + j, vendor=vendor, image='item.jpg')
+                    for j in range(4)
+                ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_single_type_returns_vendors_with_items(self):
+        response = self.client.get(reverse('category-type', args=['restaurant']))
+        data = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 5)
+        self.assertTrue(all(vendor['type'] == 'restaurant' for vendor in data))
+        self.assertTrue(all(len(vendor['vendor_items']) == 4 for vendor in data))
+
+    def test_all_types_grouped_by_type(self):
+        response = self.client.get(reverse('category-all'))
+        data = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(data), {'restaurant', 'pharmacie', 'epicerie'})
+        self.assertTrue(all(len(vendors) == 5 for vendors in data.values()))
+
+    def test_unknown_type_is_404(self):
+        response = self.client.get(reverse('category-type', args=['garage']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('category-type', args=['pharmacie']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vendor = Vendor.objects.create(name='extra', type='pharmacie', image='vendor.jpg')
+            ItemVendor.objects.create(nom='extra item', prix=50, vendor=vendor, image='item.jpg')
+
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('category-type', args=['pharmacie']))
+
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('category-all'))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CatalogSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg')
+        cls.item = ItemVendor.objects.create(nom='Burger', prix=150, vendor=cls.vendor, image='item.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse('category-type', args=['restaurant'])
+
+    def test_warm_snapshot_skips_the_database(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_matching_etag_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_gzip_copy_is_served_when_accepted(self):
+        plain = self.client.get(self.url)
+        compressed = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+    def test_item_change_invalidates_snapshot(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.prix = 175
+            self.item.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)[0]['vendor_items'][0]['prix'], 175)
+
+    def test_vendor_delete_invalidates_snapshot(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendor.delete()
+
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+
+class SharedCacheTests(TestCase):
+    # The default cache backend: a table every worker reads.
+
+    @classmethod
+    def setUpTestData(cls):
+        Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_snapshot_is_one_cache_read(self):
+        catalog.get_snapshot('restaurant')
+
+        with self.assertNumQueries(1):
+            catalog.get_snapshot('restaurant')
+
+    def test_back_to_back_invalidations_never_repeat_a_generation(self):
+        seen = {catalog.current_generation()}
+        for _ in range(3):
+            catalog.invalidate_catalog()
+            seen.add(catalog.current_generation())
+
+        self.assertEqual(len(seen), 4)
+
+    def test_price_change_in_another_worker_reaches_this_one(self):
+        item = ItemVendor.objects.create(nom='Burger', prix=150, vendor=Vendor.objects.get(), image='item.jpg')
+        self.assertEqual(pricing.get_price_book().lookup({item.pk})[item.pk][0], 150)
+
+        # Another process: its own cache client and its own on_commit hook.
+        ItemVendor.objects.filter(pk=item.pk).update(prix=175)
+        caches.create_connection('default').set(catalog.GENERATION_KEY, catalog.new_generation(), None)
+
+        self.assertEqual(pricing.get_price_book().lookup({item.pk})[item.pk][0], 175)
+
+    @override_settings(CATALOG_SNAPSHOT_TTL=60)
+    def test_snapshots_expire(self):
+        catalog.get_snapshot('restaurant')
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT expires FROM livrily_cache WHERE cache_key LIKE %s', ['%catalog:snapshot:restaurant'],
+            )
+            expires = cursor.fetchone()[0]
+        if isinstance(expires, str):
+            expires = datetime.fromisoformat(expires)
+        self.assertLess(expires.replace(tzinfo=None), datetime.now(dt_timezone.utc).replace(tzinfo=None) + timedelta(minutes=5))
+
+
+class CommandePaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone=22000001, password='secret')
+        cls.admin = User.objects.create_user(phone=22000002, password='secret', type='admin')
+        for i in range(7):
+            Commande.objects.create(user=cls.user, prix=100 + i, location='Tevragh Zeina', status='waiting')
+        for i in range(5):
+            Commande.objects.create(user=cls.user, prix=200 + i, location='Ksar', status='delivered')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def collect(self, url, key=None):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            page = data[key] if key else data
+            ids.extend(commande['id'] for commande in page['results'])
+            url = page['next']
+        return ids
+
+    def test_mes_commandes_pages_cover_every_order_once(self):
+        self.client.force_authenticate(self.user)
+
+        ids = self.collect(reverse('mes-commandes') + '?page_size=3')
+
+        expected = list(Commande.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_pending2_buckets_page_independently(self):
+        self.client.force_authenticate(self.admin)
+        url = reverse('pending2-commandes') + '?page_size=2'
+
+        data = self.client.get(url).json()
+
+        self.assertEqual(len(data['waiting']['results']), 2)
+        self.assertIn('delivered_cursor=', data['delivered']['next'])
+        self.assertEqual(len(self.collect(url, 'delivered')), 5)
+        self.assertEqual(len(self.collect(url, 'waiting')), 7)
+
+    def test_commande_viewset_is_paginated(self):
+        self.client.force_authenticate(self.admin)
+
+        data = self.client.get('/api/commandes/?page_size=4').json()
+
+        self.assertEqual(len(data['results']), 4)
+        self.assertIsNotNone(data['next'])
+
+
+class CommandeQueryCountTests(TestCase):
+    """
+    Seeds 100 orders of 3 lines each and pins the number of queries every
+    order-serializing endpoint issues, so an N+1 shows up as a failure.
+    """
+    ORDERS = 100
+    LINES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=22100001, password='secret')
+        cls.livreur = User.objects.create_user(phone=22100002, password='secret', type='traitor')
+        cls.admin = User.objects.create_user(phone=22100003, password='secret', type='admin')
+
+        vendor = Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg')
+        items = ItemVendor.objects.bulk_create([
+            ItemVendor(nom=f'item {i}', prix=100, vendor=vendor, image='item.jpg') for i in range(cls.LINES)
+        ])
+
+        statuses = ['waiting', 'paid', 'loading', 'delivered']
+        commandes = Commande.objects.bulk_create([
+            Commande(
+                user=cls.customer, prix=300, location='Ksar', code=f'CMBENCH{i:03}',
+                status=statuses[i % len(statuses)],
+                livreur=cls.livreur if statuses[i % len(statuses)] in ('loading', 'delivered') else None,
+            )
+            for i in range(cls.ORDERS)
+        ])
+        ItemCommande.objects.bulk_create([
+            ItemCommande(commande=commande, vendor=vendor, item=item, number=1)
+            for commande in commandes for item in items
+        ])
+        cls.commande = commandes[1]
+        # bulk_create skips the counter signals.
+        stats.rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertEndpointQueries(self, num, user, method, url, **kwargs):
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(num):
+            response = getattr(self.client, method)(url + '?page_size=100', **kwargs)
+        self.assertLess(response.status_code, 300)
+        return response
+
+    def test_mes_commandes(self):
+        response = self.assertEndpointQueries(2, self.customer, 'get', reverse('mes-commandes'))
+        self.assertEqual(len(response.data['results']), self.ORDERS)
+
+    def test_pending_commandes(self):
+        self.assertEndpointQueries(4, self.admin, 'get', reverse('pending-commandes'))
+
+    def test_pending_commandes2(self):
+        self.assertEndpointQueries(4, self.admin, 'get', reverse('pending2-commandes'))
+
+    def test_commande_viewset_list(self):
+        self.assertEndpointQueries(2, self.admin, 'get', '/api/commandes/')
+
+    def test_commande_viewset_detail(self):
+        self.assertEndpointQueries(2, self.admin, 'get', f'/api/commandes/{self.commande.pk}/')
+
+    def test_change_status(self):
+        url = reverse('change-commande-status', args=[self.commande.pk])
+        # Read the current state, then a savepoint around the conditional
+        # UPDATE and one UPDATE per affected stats counter, then reload the
+        # order (+ items prefetch) for the response.
+        self.assertEndpointQueries(8, self.admin, 'post', url, data={'status': 'loading'}, format='json')
+
+    def test_livreur_change_status(self):
+        url = reverse('livreur-change-commande-status', args=[self.commande.pk])
+        self.assertEndpointQueries(9, self.livreur, 'post', url, data={'status': 'loading'}, format='json')
+
+
+class RequestProfilingMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone=22200001, password='secret')
+        Commande.objects.create(user=cls.user, prix=100, location='Ksar')
+
+    def get(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(reverse('mes-commandes'))
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(REQUEST_PROFILING=True)
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('api.profiling', 'INFO') as logs:
+            response = self.get()
+
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'mes-commandes')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['queries'], 2)
+        self.assertGreater(line['serialize_ms'], 0)
+
+
+class StatCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(phone=22300001, password='secret', type='admin')
+        cls.livreur = User.objects.create_user(phone=22300002, password='secret', type='traitor')
+        cls.customer = User.objects.create_user(phone=22300003, password='secret')
+        cls.commandes = [
+            Commande.objects.create(user=cls.customer, prix=100, location='Ksar', status='paid')
+            for _ in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def stats(self, user, name):
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            return self.client.get(reverse(name)).json()
+
+    def test_counters_follow_creates_and_transitions(self):
+        self.client.force_authenticate(self.livreur)
+        self.client.post(
+            reverse('livreur-change-commande-status', args=[self.commandes[0].pk]),
+            {'status': 'loading'}, format='json',
+        )
+        for new_status in ['loading', 'delivered']:
+            self.client.post(
+                reverse('livreur-change-commande-status', args=[self.commandes[1].pk]),
+                {'status': new_status}, format='json',
+            )
+
+        self.assertEqual(self.stats(self.admin, 'stats'), {
+            'simple_users': 1, 'traitors': 1,
+            'commandes_delivered': 1, 'commandes_waiting': 0, 'commandes_loading': 1,
+        })
+        self.assertEqual(self.stats(self.livreur, 'stats-livreur'), {
+            'commandes_delivered': 1, 'commandes_loading': 1,
+        })
+        self.assertEqual(stats.drift(), {})
+
+    def test_counters_follow_deletes(self):
+        self.customer.delete()
+
+        self.assertEqual(stats.read(['commandes:paid', 'users:simple']), {'commandes:paid': 0, 'users:simple': 0})
+        self.assertEqual(stats.drift(), {})
+
+    def test_check_stats_detects_and_fixes_drift(self):
+        Commande.objects.filter(pk=self.commandes[2].pk).update(status='waiting')
+
+        with self.assertRaises(CommandError):
+            call_command('check_stats', stdout=StringIO())
+
+        call_command('check_stats', '--fix', stdout=StringIO())
+
+        self.assertEqual(stats.drift(), {})
+        self.assertEqual(StatCounter.objects.get(name='commandes:waiting').value, 1)
+
+
+class IndexBenchmarkTests(TransactionTestCase):
+    # The benchmark drops and recreates indexes, which SQLite can't do inside a test transaction.
+
+    def test_leaves_the_counters_consistent(self):
+        User.objects.create_user(phone=22100001, password='secret')
+
+        call_command(
+            'benchmark_indexes', '--orders', '60', '--customers', '4', '--couriers', '2', '--admins', '1',
+            '--repeat', '1', '--yes', stdout=StringIO(),
+        )
+
+        self.assertEqual(stats.drift(), {})
+        self.assertEqual(stats.read(['users:simple']), {'users:simple': 1})
+        self.assertFalse(Commande.objects.exists())
+        self.assertFalse(Vendor.objects.exists())
+
+    def test_refuses_without_confirmation_or_on_real_data(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_indexes', '--orders', '1', stdout=StringIO())
+
+        customer = User.objects.create_user(phone=22100002, password='secret')
+        Commande.objects.create(user=customer, prix=100, location='Ksar')
+        with self.assertRaises(CommandError):
+            call_command('benchmark_indexes', '--orders', '1', '--yes', stdout=StringIO())
+
+
+class NotificationDispatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(phone=22400001, password='secret', type='admin', fcm_token='admin-token')
+        cls.customer = User.objects.create_user(phone=22400002, password='secret', fcm_token='customer-token')
+        cls.commande = Commande.objects.create(user=cls.customer, prix=100, location='Ksar')
+
+    def setUp(self):
+        firebase_breaker.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    @patch('api.notifications.messaging.send')
+    def test_status_change_returns_before_firebase(self, send):
+        release, sent = threading.Event(), threading.Event()
+
+        def slow_send(message):
+            release.wait(5)
+            sent.set()
+            return 'message-id'
+
+        send.side_effect = slow_send
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('change-commande-status', args=[self.commande.pk]), {'status': 'paid'}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(sent.is_set())
+
+        release.set()
+        self.assertTrue(sent.wait(5))
+        self.assertEqual(send.call_args.args[0].token, 'customer-token')
+
+    @patch('api.notifications.messaging.send')
+    def test_nothing_is_sent_before_commit(self, send):
+        self.client.post(
+            reverse('change-commande-status', args=[self.commande.pk]), {'status': 'paid'}, format='json'
+        )
+        send.assert_not_called()
+
+
+class CircuitBreakerTests(TestCase):
+
+    def failing(self):
+        raise ConnectionError('down')
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(self.failing)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(lambda: 'ok')
+
+    def test_trial_call_after_timeout_closes_circuit(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing)
+
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+        self.assertFalse(breaker.is_open)
+
+    def test_ignored_exceptions_do_not_count(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, ignored_exceptions=(KeyError,))
+
+        with self.assertRaises(KeyError):
+            breaker.call(lambda: {}['missing'])
+
+        self.assertFalse(breaker.is_open)
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class AdminFanOutTests(TestCase):
+    MESSAGES = {'fr': ('Nouvelle commande', 'fr body'), 'ar': ('طلب جديد', 'ar body')}
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            User.objects.create_user(phone=22500000 + i, password='x', type='admin', fcm_token=f'fr-{i}')
+        for i in range(2):
+            User.objects.create_user(phone=22500100 + i, password='x', type='super_admin', default_lang='ar', fcm_token=f'ar-{i}')
+        User.objects.create_user(phone=22500200, password='x', type='admin')
+        User.objects.create_user(phone=22500300, password='x', fcm_token='customer')
+
+    def setUp(self):
+        firebase_breaker.reset()
+
+    @patch('api.notifications.messaging.send_each_for_multicast')
+    def test_one_multicast_per_language(self, send_each):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.notify_admins(self.MESSAGES)
+
+        sent = {
+            call.args[0].notification.title: sorted(call.args[0].tokens)
+            for call in send_each.call_args_list
+        }
+        self.assertEqual(sent, {
+            'Nouvelle commande': ['fr-0', 'fr-1', 'fr-2'],
+            'طلب جديد': ['ar-0', 'ar-1'],
+        })
+
+    @patch('api.notifications.messaging.send_each_for_multicast')
+    def test_multicast_is_chunked(self, send_each):
+        notifications.send_multicast('title', 'body', [f'token-{i}' for i in range(1201)])
+
+        self.assertEqual([len(call.args[0].tokens) for call in send_each.call_args_list], [500, 500, 201])
+
+    @override_settings(NOTIFY_ADMINS_VIA_TOPIC=True)
+    @patch('api.notifications.messaging.send')
+    def test_topic_mode_is_one_call_per_language(self, send):
+        with self.assertNumQueries(0), self.captureOnCommitCallbacks(execute=True):
+            notifications.notify_admins(self.MESSAGES)
+
+        self.assertEqual(sorted(call.args[0].topic for call in send.call_args_list), ['admins-ar', 'admins-fr'])
+
+    @override_settings(NOTIFY_ADMINS_VIA_TOPIC=True)
+    @patch('api.notifications.messaging.unsubscribe_from_topic')
+    @patch('api.notifications.messaging.subscribe_to_topic')
+    def test_language_change_moves_admin_topic(self, subscribe, unsubscribe):
+        admin = User.objects.get(fcm_token='fr-0')
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/update-lang/', {'default_lang': 'ar'}, format='json')
+
+        unsubscribe.assert_called_once_with(['fr-0'], 'admins-fr')
+        subscribe.assert_called_once_with(['fr-0'], 'admins-ar')
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class DeadTokenPruningTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.live = User.objects.create_user(phone=22600001, password='x', type='admin', fcm_token='live')
+        cls.dead = [
+            User.objects.create_user(phone=22600010 + i, password='x', type='admin', fcm_token=f'dead-{i}')
+            for i in range(3)
+        ]
+        StatCounter.objects.create(name=notifications.PRUNED_TOKENS_COUNTER)
+
+    def setUp(self):
+        firebase_breaker.reset()
+
+    def batch_response(self, message):
+        return messaging.BatchResponse([
+            messaging.SendResponse(None, UnregisteredError('gone')) if token.startswith('dead')
+            else messaging.SendResponse({'name': f'sent/{token}'}, None)
+            for token in message.tokens
+        ])
+
+    @patch('api.notifications.messaging.send_each_for_multicast')
+    def test_multicast_failures_are_cleared_in_one_update(self, send_each):
+        send_each.side_effect = self.batch_response
+        tokens = ['live'] + [user.fcm_token for user in self.dead]
+
+        with self.assertNumQueries(2):  # one UPDATE for the users, one for the counter
+            notifications.send_multicast('title', 'body', tokens)
+
+        self.assertEqual(
+            list(User.objects.filter(type='admin').exclude(fcm_token='').values_list('fcm_token', flat=True)),
+            ['live'],
+        )
+        self.assertEqual(stats.read([notifications.PRUNED_TOKENS_COUNTER]), {notifications.PRUNED_TOKENS_COUNTER: 3})
+
+    @patch('api.notifications.messaging.send', side_effect=UnregisteredError('gone'))
+    def test_single_send_prunes_its_token(self, send):
+        notifications.send_notification('title', 'body', 'dead-0')
+
+        self.dead[0].refresh_from_db()
+        self.assertEqual(self.dead[0].fcm_token, '')
+
+    def test_rebuilding_stats_keeps_event_counters(self):
+        notifications.prune_tokens(['dead-1'])
+
+        stats.rebuild()
+
+        self.assertEqual(stats.read([notifications.PRUNED_TOKENS_COUNTER]), {notifications.PRUNED_TOKENS_COUNTER: 1})
+
+
+@override_settings(SMS_ASYNC=False, SMS_RETRY_BACKOFF=0)
+class SmsClientTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        sms.sms_breaker.reset()
+        sms.reset_session()
+        self.addCleanup(sms.reset_session)
+
+    def test_sends_through_the_gateway(self):
+        with StubSmsGateway() as gateway, self.settings(SMS_GATEWAY_URL=gateway.url):
+            sms.queue_validation_sms('22000000', '123456')
+
+        self.assertEqual(gateway.received, [{'phone': '22000000', 'lang': 'fr', 'code': '123456'}])
+
+    def test_retries_are_bounded(self):
+        with StubSmsGateway(fail_rate=1) as gateway, self.settings(SMS_GATEWAY_URL=gateway.url, SMS_RETRIES=2), \
+                self.assertLogs('api.sms', 'WARNING'):
+            self.assertIsNone(sms.send_validation_sms('22000000', '123456'))
+
+        self.assertEqual(gateway.attempts, 3)
+
+    def test_possibly_delivered_messages_are_not_resent(self):
+        with StubSmsGateway(fail_rate=1, fail_status=500) as gateway, \
+                self.settings(SMS_GATEWAY_URL=gateway.url, SMS_RETRIES=2), self.assertLogs('api.sms', 'WARNING'):
+            sms.send_validation_sms('22000000', '123456')
+        self.assertEqual(gateway.attempts, 1)
+
+        sms.reset_session()
+        with StubSmsGateway(latency=0.3) as gateway, \
+                self.settings(SMS_GATEWAY_URL=gateway.url, SMS_READ_TIMEOUT=0.1, SMS_RETRIES=2), \
+                self.assertLogs('api.sms', 'WARNING'):
+            sms.send_validation_sms('22000000', '123456')
+        self.assertEqual(gateway.attempts, 1)
+
+    def test_slow_gateway_times_out(self):
+        with StubSmsGateway(latency=0.5) as gateway, \
+                self.settings(SMS_GATEWAY_URL=gateway.url, SMS_READ_TIMEOUT=0.1, SMS_RETRIES=0), \
+                self.assertLogs('api.sms', 'WARNING'):
+            start = time.perf_counter()
+            self.assertIsNone(sms.send_validation_sms('22000000', '123456'))
+            elapsed = time.perf_counter() - start
+
+        # The caller gives up at the read timeout; the slow gateway may still deliver it.
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(gateway.attempts, 1)
+
+    def test_breaker_stops_calling_a_failing_gateway(self):
+        with StubSmsGateway(fail_rate=1) as gateway, self.settings(SMS_GATEWAY_URL=gateway.url, SMS_RETRIES=0), \
+                self.assertLogs('api.sms', 'WARNING'):
+            for _ in range(sms.sms_breaker.failure_threshold + 3):
+                sms.send_validation_sms('22000000', '123456')
+
+        self.assertTrue(sms.sms_breaker.is_open)
+        self.assertEqual(gateway.attempts, sms.sms_breaker.failure_threshold)
+
+    def test_check_phone_does_not_wait_for_the_gateway(self):
+        with StubSmsGateway(latency=1) as gateway, \
+                self.settings(SMS_GATEWAY_URL=gateway.url, SMS_ASYNC=True):
+            start = time.perf_counter()
+            response = APIClient().post(
+                reverse('check-phone'), {'phone': '22000000', 'purpose': 'signup'}, format='json'
+            )
+            elapsed = time.perf_counter() - start
+
+            deadline = time.monotonic() + 5
+            while not gateway.received and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(len(gateway.received), 1)
+
+
+class OTPTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def request_code(self, phone='22700001', purpose='signup', **extra):
+        return self.client.post(reverse('check-phone'), {'phone': phone, 'purpose': purpose}, format='json', **extra)
+
+    def verify(self, code, phone='22700001', purpose='signup'):
+        return self.client.post(
+            reverse('verify-otp'), {'phone': phone, 'purpose': purpose, 'code': code}, format='json'
+        )
+
+    @patch('api.views.queue_validation_sms')
+    def test_code_is_verified_server_side_once(self, queue_sms):
+        response = self.request_code()
+
+        self.assertEqual(response.data, {'otp_sent': True, 'exists': False})
+        phone, code = queue_sms.call_args.args
+        self.assertEqual(self.verify('000000').status_code, 400)
+        self.assertEqual(self.verify(code).data, {'verified': True})
+        self.assertTrue(otp.is_verified('22700001', 'signup'))
+        self.assertEqual(self.verify(code).status_code, 400)
+
+    @patch('api.views.queue_validation_sms')
+    def test_code_is_dropped_after_too_many_wrong_guesses(self, queue_sms):
+        self.request_code()
+        code = queue_sms.call_args.args[1]
+
+        for _ in range(settings.OTP_MAX_ATTEMPTS):
+            self.verify('000000' if code != '000000' else '111111')
+
+        self.assertEqual(self.verify(code).status_code, 400)
+
+    def test_guesses_past_the_limit_never_reach_the_code(self):
+        code = otp.issue('22700001', 'signup')
+        wrong = '000000' if code != '000000' else '111111'
+
+        with patch('api.otp.digest', wraps=otp.digest) as compared:
+            for _ in range(settings.OTP_MAX_ATTEMPTS + 3):
+                self.assertFalse(otp.verify('22700001', 'signup', wrong))
+            self.assertFalse(otp.verify('22700001', 'signup', code))
+
+        self.assertEqual(compared.call_count, settings.OTP_MAX_ATTEMPTS)
+
+    def test_a_stale_read_does_not_grant_more_guesses(self):
+        # Parallel requests all read the entry before any of them writes back.
+        code = otp.issue('22700001', 'signup')
+        entry = cache.get(otp.OTP_KEY.format('signup', '22700001'))
+        wrong = '000000' if code != '000000' else '111111'
+
+        claimed = [otp.claim_attempt('22700001', 'signup', entry, 60) for _ in range(settings.OTP_MAX_ATTEMPTS + 3)]
+
+        self.assertEqual(claimed.count(True), settings.OTP_MAX_ATTEMPTS)
+        self.assertFalse(otp.verify('22700001', 'signup', wrong))
+
+    def test_verification_is_throttled_per_phone(self):
+        limit = int(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['otp_verify_phone'].split('/')[0])
+
+        for _ in range(limit):
+            self.verify('000000')
+
+        self.assertEqual(self.verify('000000').status_code, 429)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    @patch('api.views.queue_validation_sms')
+    def test_repeat_send_for_same_phone_is_throttled(self, queue_sms):
+        self.assertEqual(self.request_code().status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.request_code()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(queue_sms.call_count, 1)
+
+    @patch('api.views.queue_validation_sms')
+    def test_sends_per_ip_are_throttled(self, queue_sms):
+        limit = int(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['otp_ip'].split('/')[0])
+
+        for i in range(limit):
+            self.request_code(phone=f'2280{i:04}')
+
+        self.assertEqual(self.request_code(phone='22899999').status_code, 429)
+        self.assertEqual(queue_sms.call_count, limit)
+
+    @patch('api.views.queue_validation_sms')
+    def test_signup_needs_a_verified_phone_once(self, queue_sms):
+        signup = {'phone': '22700001', 'username': 'nouveau', 'password': 'secret'}
+        self.assertEqual(self.client.post(reverse('signup'), signup, format='json').status_code, 403)
+
+        self.request_code()
+        self.verify(queue_sms.call_args.args[1])
+
+        self.assertEqual(self.client.post(reverse('signup'), signup, format='json').status_code, 201)
+        self.assertFalse(otp.is_verified('22700001', 'signup'))
+
+    @patch('api.views.queue_validation_sms')
+    def test_password_reset_needs_a_verified_phone(self, queue_sms):
+        user = User.objects.create_user(phone=22700001, password='old')
+        reset = {'phone': '22700001', 'new_password': 'new'}
+
+        self.assertEqual(self.client.post(reverse('reset_password'), reset, format='json').status_code, 403)
+
+        self.request_code(purpose='forgot_password')
+        self.verify(queue_sms.call_args.args[1], purpose='forgot_password')
+
+        self.assertEqual(self.client.post(reverse('reset_password'), reset, format='json').status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('new'))
+        # The verification is spent.
+        self.assertEqual(self.client.post(reverse('reset_password'), reset, format='json').status_code, 403)
+
+    @override_settings(OTP_EXPOSE_CODE=True)
+    def test_older_apps_skip_server_side_verification(self):
+        User.objects.create_user(phone=22700001, password='old')
+
+        response = self.client.post(
+            reverse('reset_password'), {'phone': '22700001', 'new_password': 'new'}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+    @patch('api.views.queue_validation_sms')
+    def test_no_code_when_purpose_does_not_match(self, queue_sms):
+        User.objects.create_user(phone=22700001, password='x')
+
+        response = self.request_code(purpose='signup')
+
+        self.assertEqual(response.data, {'otp_sent': False, 'exists': True})
+        queue_sms.assert_not_called()
+
+
+class AddCommandeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=22800001, password='secret')
+        cls.vendor = Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg')
+        cls.items = ItemVendor.objects.bulk_create([
+            ItemVendor(nom=f'item {i}', prix=100 + i, vendor=cls.vendor, image='item.jpg') for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def post(self, lines):
+        return self.client.post(reverse('add-commande'), {
+            'items': json.dumps(lines), 'prix': 500, 'livraison': 50, 'location': 'Ksar', 'phone': '22800001',
+        })
+
+    def lines(self, count):
+        return [{'vendor_id': self.vendor.pk, 'item_id': item.pk, 'number': 2} for item in self.items[:count]]
+
+    def test_creates_order_with_all_lines(self):
+        response = self.post(self.lines(3))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(ItemCommande.objects.filter(commande_id=response.data['id']).count(), 3)
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        self.post(self.lines(1))  # creates the stats counter row
+
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.lines(1))
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.lines(25))
+
+        self.assertEqual(len(small), len(large))
+
+    def test_zero_quantity_lines_are_rejected(self):
+        lines = self.lines(2)
+        lines[1]['number'] = 0
+
+        response = self.post(lines)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('number', response.data['errors'][1])
+        self.assertFalse(Commande.objects.exists())
+
+    def test_unknown_item_rejects_the_whole_order(self):
+        lines = self.lines(2) + [{'vendor_id': self.vendor.pk, 'item_id': 999999, 'number': 1}]
+
+        response = self.post(lines)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('item_id', response.data['errors'][2])
+        self.assertFalse(Commande.objects.exists())
+
+
+
+def image_bytes(size=(64, 48), image_format='PNG', **save_options):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, image_format, **save_options)
+    return buffer.getvalue()
+
+
+HEIC_HEADER = b'\x00\x00\x00\x1cftypheic'
+
+
+class CaptureUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23000001, password='secret')
+        cls.vendor = Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg')
+        cls.item = ItemVendor.objects.create(nom='Burger', prix=250, vendor=cls.vendor, image='item.jpg')
+
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging, ignore_errors=True)
+        overrides = override_settings(
+            CAPTURE_STAGING_DIR=self.staging, CAPTURE_UPLOAD_ASYNC=False, CAPTURE_UPLOAD_BACKOFF=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def post_with_capture(self, content=None):
+        lines = [{'vendor_id': self.vendor.pk, 'item_id': self.item.pk, 'number': 1}]
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('add-commande'), {
+                'items': json.dumps(lines), 'livraison': 50, 'location': 'Ksar', 'phone': '23000001',
+                'capture': SimpleUploadedFile('recu.png', content or image_bytes(), content_type='image/png'),
+            })
+
+    def test_undecodable_capture_is_rejected(self):
+        response = self.post_with_capture(b'not an image')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('capture', response.data)
+        self.assertFalse(Commande.objects.exists())
+        self.assertEqual(os.listdir(self.staging), [])
+
+    @patch('api.captures.uploader.upload_resource')
+    def test_order_is_created_before_the_upload_and_updated_after(self, upload_resource):
+        upload_resource.return_value = CloudinaryResource(
+            'captures/recu', format='png', version=1, type='upload', resource_type='image',
+        )
+
+        response = self.post_with_capture()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['capture_status'], 'pending')
+        staged_path = upload_resource.call_args.args[0]
+        self.assertTrue(staged_path.startswith(self.staging))
+        self.assertTrue(images.is_normalized(staged_path))
+
+        commande = Commande.objects.get(pk=response.data['id'])
+        self.assertEqual(commande.capture_status, 'uploaded')
+        self.assertEqual(commande.capture.public_id, 'captures/recu')
+        self.assertEqual(commande.capture_staged, '')
+        self.assertFalse(os.path.exists(staged_path))
+
+    @patch('api.images.register_heif_opener', None)
+    @patch('api.captures.uploader.upload_resource')
+    def test_heic_is_uploaded_as_sent_without_a_decoder(self, upload_resource):
+        upload_resource.return_value = CloudinaryResource('captures/recu', format='heic', version=1)
+
+        response = self.post_with_capture(HEIC_HEADER + b'\0' * 64)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(images.is_normalized(upload_resource.call_args.args[0]))
+        self.assertEqual(Commande.objects.get(pk=response.data['id']).capture_status, 'uploaded')
+
+    @patch('api.captures.uploader.upload_resource', side_effect=Exception('cloudinary down'))
+    def test_failed_upload_keeps_the_staged_file_for_a_retry(self, upload_resource):
+        with self.assertLogs('api.captures', 'WARNING'):
+            response = self.post_with_capture()
+
+        commande = Commande.objects.get(pk=response.data['id'])
+        self.assertEqual(upload_resource.call_count, settings.CAPTURE_UPLOAD_ATTEMPTS)
+        self.assertEqual(commande.capture_status, 'failed')
+        self.assertTrue(os.path.exists(commande.capture_staged))
+
+        upload_resource.side_effect = None
+        upload_resource.return_value = CloudinaryResource('captures/recu', format='png', version=1)
+        output = StringIO()
+        call_command('retry_captures', stdout=output)
+
+        commande.refresh_from_db()
+        self.assertEqual(commande.capture_status, 'uploaded')
+        self.assertIn('1/1 capture(s) uploaded', output.getvalue())
+
+    @patch('api.captures.uploader.upload_resource')
+    def test_retry_leaves_captures_still_in_the_upload_pool(self, upload_resource):
+        upload_resource.return_value = CloudinaryResource('captures/recu', format='png', version=1)
+        staged = {}
+        for name in ('fresh', 'stale'):
+            staged[name] = os.path.join(self.staging, f'{name}.png')
+            with open(staged[name], 'wb') as f:
+                f.write(image_bytes())
+        fresh, stale = (
+            Commande.objects.create(
+                user=self.customer, prix=1, location='Ksar', capture_status='pending', capture_staged=staged[name],
+            )
+            for name in ('fresh', 'stale')
+        )
+        Commande.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        call_command('retry_captures', stdout=StringIO())
+
+        self.assertEqual(upload_resource.call_count, 1)
+        self.assertTrue(upload_resource.call_args.args[0].startswith(os.path.join(self.staging, 'stale')))
+        self.assertEqual(Commande.objects.get(pk=fresh.pk).capture_status, 'pending')
+
+
+@override_settings(CAPTURE_MAX_DIMENSION=100, CAPTURE_FORMAT='WEBP', CAPTURE_QUALITY=80, CAPTURE_MAX_PIXELS=10_000_000)
+class ImageNormalizationTests(TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.workdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    @skipUnless(images.register_heif_opener, 'pillow_heif is not installed')
+    def test_heic_is_decoded_and_normalized(self):
+        path = self.write('capture.heic', image_bytes((300, 200), 'HEIF'))
+
+        images.check(path)
+        normalized = images.normalize(path)
+
+        with Image.open(normalized) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (100, 67)))
+
+    @patch('api.images.register_heif_opener', None)
+    def test_heic_is_kept_as_sent_without_a_decoder(self):
+        heic = self.write('capture.heic', HEIC_HEADER + b'\0' * 64)
+
+        images.check(heic)
+        self.assertTrue(images.undecodable_heif(heic))
+        with self.assertRaises(images.InvalidImage):
+            images.check(self.write('capture.png', b'not an image'))
+
+    def test_downscales_strips_metadata_and_reencodes(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'  # Make
+        path = self.write('recu.jpg', image_bytes((400, 200), 'JPEG', exif=exif.tobytes()))
+
+        output = images.normalize(path)
+
+        self.assertFalse(os.path.exists(path))
+        with Image.open(output) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (100, 50))
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_small_images_are_not_upscaled(self):
+        output = images.normalize(self.write('recu.png', image_bytes((40, 30))))
+
+        with Image.open(output) as image:
+            self.assertEqual(image.size, (40, 30))
+
+    @override_settings(CAPTURE_FORMAT='JPEG')
+    def test_jpeg_output(self):
+        output = images.normalize(self.write('recu.png', image_bytes((400, 400))))
+
+        self.assertTrue(output.endswith('.jpg'))
+        with Image.open(output) as image:
+            self.assertEqual(image.format, 'JPEG')
+
+    @override_settings(CAPTURE_MAX_PIXELS=1000)
+    def test_oversized_image_is_refused_from_its_header(self):
+        with self.assertRaises(images.InvalidImage):
+            images.check(self.write('huge.png', image_bytes((100, 100))))
+
+    def test_truncated_image_is_refused(self):
+        with self.assertRaises(images.InvalidImage):
+            images.check(self.write('broken.png', image_bytes((100, 100))[:60]))
+
+
+class ImageVariantTests(TestCase):
+
+    def test_cloudinary_images_get_transformation_urls(self):
+        vendor = Vendor.objects.create(name='Snack', type='restaurant', image='image/upload/v1/vendors/snack.png')
+
+        vendor.refresh_from_db()
+        self.assertEqual(set(vendor.image_variants), set(settings.IMAGE_VARIANTS))
+        self.assertIn('c_limit,f_auto,h_160,q_auto,w_160', vendor.image_variants['thumbnail'])
+        self.assertIn('vendors/snack', vendor.image_variants['full'])
+
+    def test_local_media_images_get_webp_derivatives(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, 'category_images'))
+        with open(os.path.join(media_root, 'category_images', 'plat.jpg'), 'wb') as f:
+            f.write(image_bytes((800, 600), 'JPEG'))
+
+        with self.settings(MEDIA_ROOT=media_root):
+            item = ItemVendor.objects.create(nom='Plat', prix=100, image='category_images/plat.jpg')
+
+        self.assertEqual(item.image_variants['thumbnail'], '/media/variants/thumbnail/category_images/plat.webp')
+        with Image.open(os.path.join(media_root, 'variants', 'thumbnail', 'category_images', 'plat.webp')) as image:
+            self.assertEqual(image.size, (160, 120))
+
+    def test_catalog_payload_carries_the_variants(self):
+        vendor = Vendor.objects.create(name='Snack', type='restaurant', image='image/upload/v1/vendors/snack.png')
+        ItemVendor.objects.create(nom='Burger', prix=250, vendor=vendor, image='image/upload/v1/items/burger.jpg')
+
+        payload = json.loads(catalog.render_catalog('restaurant'))
+
+        self.assertIn('medium', payload[0]['image_variants'])
+        self.assertIn('thumbnail', payload[0]['vendor_items'][0]['image_variants'])
+
+    def test_command_backfills_rows_written_in_bulk(self):
+        ItemVendor.objects.bulk_create([ItemVendor(nom='Burger', prix=250, image='image/upload/v1/items/burger.jpg')])
+
+        call_command('build_image_variants', stdout=StringIO())
+
+        self.assertIn('thumbnail', ItemVendor.objects.get().image_variants)
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pizzeria = Vendor.objects.create(name='Pizzéria Nouakchott', type='restaurant', image='vendor.jpg')
+        cls.pharmacy = Vendor.objects.create(name='الصيدلية المركزية', type='pharmacie', image='vendor.jpg')
+        cls.pizza = ItemVendor.objects.create(nom='Pizza Reine', prix=300, vendor=cls.pizzeria, image='item.jpg')
+        cls.creme = ItemVendor.objects.create(nom='Crème brûlée', prix=150, vendor=cls.pizzeria, image='item.jpg')
+        cls.bread = ItemVendor.objects.create(nom='خُبْزٌ', prix=20, vendor=cls.pharmacy, image='item.jpg')
+        ItemVendor.objects.bulk_create([
+            ItemVendor(nom=f'Pizza {i}', prix=100 + i, vendor=cls.pizzeria, image='item.jpg') for i in range(30)
+        ])
+        search.rebuild()
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_normalization_folds_accents_and_arabic_variants(self):
+        self.assertEqual(search.normalize('Crème Brûlée'), 'creme brulee')
+        self.assertEqual(search.normalize('الصيدلِيّة'), 'صيدليه')
+        self.assertEqual(search.normalize('أحمد إبراهيم آمنة'), 'احمد ابراهيم امنه')
+
+    def test_prefix_search_without_accents(self):
+        results = self.search(q='creme bru')['results']
+
+        self.assertEqual([(r['kind'], r['item']['id']) for r in results], [('item', self.creme.pk)])
+
+    def test_arabic_search_ignores_article_and_harakat(self):
+        results = self.search(q='صيدليه')['results']
+        self.assertEqual(results[0]['vendor']['id'], self.pharmacy.pk)
+
+        results = self.search(q='الخبز')['results']
+        self.assertEqual(results[0]['item']['id'], self.bread.pk)
+
+    def test_results_are_ranked_and_paginated(self):
+        first = self.search(q='pizza', page_size=10)
+
+        self.assertEqual(len(first['results']), 10)
+        self.assertIsNotNone(first['next'])
+        self.assertIsNone(first['previous'])
+        # The shortest, closest name wins.
+        self.assertEqual(first['results'][0]['item']['nom'], 'Pizza 0')
+
+        seen = set()
+        url = reverse('search') + '?q=pizza&page_size=10'
+        while url:
+            page = self.client.get(url).json()
+            seen.update((r['kind'], r['vendor_id'], r.get('item', r.get('vendor'))['id']) for r in page['results'])
+            url = page['next']
+        self.assertEqual(len(seen), 31)  # 'Pizzéria' is not a prefix match for 'pizza'
+
+    def test_filter_by_category(self):
+        results = self.search(q='pizz', type='pharmacie')['results']
+
+        self.assertEqual(results, [])
+
+    def test_signals_keep_the_index_in_sync(self):
+        self.pizza.nom = 'Calzone'
+        self.pizza.save()
+        self.assertEqual(self.search(q='calzone')['results'][0]['item']['id'], self.pizza.pk)
+
+        self.pizzeria.type = 'epicerie'
+        self.pizzeria.save()
+        self.assertTrue(self.search(q='calzone', type='epicerie')['results'])
+
+        self.creme.delete()
+        self.assertEqual(self.search(q='creme')['results'], [])
+        self.assertFalse(SearchDocument.objects.filter(kind='item', object_id=self.creme.pk).exists())
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(q='pizza', page_size=50)
+
+        # Ranked ids, their documents, vendors, items.
+        self.assertLessEqual(len(queries), 4)
+
+
+@override_settings(ORDER_EVENTS_BROKER='api.events_stub.RecordingBroker', ORDER_EVENTS_HEARTBEAT=0.05)
+class OrderEventTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23100001, password='secret')
+        cls.livreur = User.objects.create_user(phone=23100002, password='secret', type='traitor')
+        cls.admin = User.objects.create_user(phone=23100003, password='secret', type='admin')
+
+    def setUp(self):
+        events.reset_broker()
+        self.addCleanup(events.reset_broker)
+        self.broker = events.get_broker()
+
+    def test_order_lifecycle_publishes_events_to_the_right_audiences(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            commande = Commande.objects.create(user=self.customer, prix=100, status='waiting')
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.status = 'paid'
+            commande.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.status, commande.livreur = 'loading', self.livreur
+            commande.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.save()  # nothing changed
+
+        self.assertEqual(self.broker.types(), ['commande.created', 'commande.status_changed', 'commande.assigned'])
+        (created, to_created), (paid, to_paid), (assigned, to_assigned) = self.broker.published
+        self.assertEqual(to_created, {'admins', f'user:{self.customer.pk}'})
+        self.assertIn('livreurs', to_paid)
+        self.assertEqual(assigned['commande']['id'], commande.pk)
+        self.assertEqual(assigned['previous_status'], 'paid')
+        self.assertTrue({f'livreur:{self.livreur.pk}', 'livreurs'} <= to_assigned)
+
+    def test_nothing_is_published_for_a_rolled_back_write(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Commande.objects.create(user=self.customer, prix=100)
+
+        self.assertEqual(self.broker.published, [])
+        self.assertEqual(len(callbacks), 1)
+
+    async def test_subscribers_only_receive_their_audiences(self):
+        admin = self.broker.subscribe(events.audiences_for_user(self.admin))
+        customer = self.broker.subscribe({f'user:{self.customer.pk}'})
+        other = self.broker.subscribe({'user:0'})
+
+        self.broker.publish({'type': 'commande.created'}, {'admins', f'user:{self.customer.pk}'})
+        await asyncio.sleep(0)
+
+        self.assertEqual((await admin.queue.get())['type'], 'commande.created')
+        self.assertEqual(customer.queue.qsize(), 1)
+        self.assertTrue(other.queue.empty())
+
+    async def test_stream_pushes_events_as_server_sent_events(self):
+        token = str(AccessToken.for_user(self.admin))
+        response = await self.async_client.get(reverse('commande-events'), {'token': token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertEqual(await anext(stream), b': keepalive\n\n')
+
+        self.broker.publish({'type': 'commande.assigned', 'commande_id': 7}, {'admins'})
+        chunk = await anext(stream)
+
+        self.assertTrue(chunk.startswith(b'id: 1\nevent: commande.assigned\ndata: '))
+
+    async def test_stream_requires_a_valid_token(self):
+        response = await self.async_client.get(reverse('commande-events'), {'token': 'nope'})
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_stream_is_refused_under_wsgi(self):
+        token = str(AccessToken.for_user(self.admin))
+
+        response = self.client.get(reverse('commande-events'), {'token': token})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.streaming)
+
+
+@override_settings(COMMANDE_WATERMARK_LAG=0)
+class DeltaSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23200001, password='secret')
+        cls.other = User.objects.create_user(phone=23200002, password='secret')
+        cls.livreur = User.objects.create_user(phone=23200003, password='secret', type='traitor')
+        cls.admin = User.objects.create_user(phone=23200004, password='secret', type='admin')
+        cls.paid = [Commande.objects.create(user=cls.customer, prix=100, status='paid') for _ in range(3)]
+        Commande.objects.create(user=cls.other, prix=100, status='waiting')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_idle_refresh_is_one_query_and_empty(self):
+        self.client.force_authenticate(self.admin)
+        watermark = self.get('pending-commandes')['paid']['watermark']
+
+        with self.assertNumQueries(1):
+            data = self.get('pending-commandes', since=watermark)
+
+        self.assertEqual(data['paid']['results'], [])
+        self.assertEqual(data['loading']['removed'], [])
+
+    def test_rows_moving_between_buckets(self):
+        self.client.force_authenticate(self.admin)
+        watermark = self.get('pending-commandes')['paid']['watermark']
+
+        moved = self.paid[0]
+        moved.status, moved.livreur = 'loading', self.livreur
+        moved.save()
+
+        data = self.get('pending-commandes', since=watermark)
+
+        self.assertEqual(data['paid']['results'], [])
+        self.assertEqual(data['paid']['removed'], [moved.pk])
+        self.assertEqual([c['id'] for c in data['loading']['results']], [moved.pk])
+        self.assertGreater(data['loading']['watermark'], watermark)
+
+    def test_mes_commandes_delta_only_sees_own_orders(self):
+        self.client.force_authenticate(self.customer)
+        watermark = self.get('mes-commandes')['watermark']
+
+        Commande.objects.filter(user=self.other).get().save()
+        self.paid[1].save()
+
+        data = self.get('mes-commandes', since=watermark)
+
+        self.assertEqual([c['id'] for c in data['results']], [self.paid[1].pk])
+
+    @override_settings(COMMANDE_DELTA_LIMIT=1)
+    def test_too_many_changes_ask_for_a_full_reload(self):
+        self.client.force_authenticate(self.customer)
+        watermark = self.get('mes-commandes')['watermark']
+        for commande in self.paid:
+            commande.save()
+
+        self.assertTrue(self.get('mes-commandes', since=watermark)['reset'])
+
+    def test_invalid_watermark_is_rejected(self):
+        self.client.force_authenticate(self.customer)
+
+        response = self.client.get(reverse('mes-commandes'), {'since': 'yesterday'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class StatusTransitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23300001, password='secret')
+        cls.livreur = User.objects.create_user(phone=23300002, password='secret', type='traitor')
+        cls.other_livreur = User.objects.create_user(phone=23300003, password='secret', type='traitor')
+        cls.admin = User.objects.create_user(phone=23300004, password='secret', type='admin')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.commande = Commande.objects.create(user=self.customer, prix=100, status='paid')
+
+    def post(self, user, name, new_status):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse(name, args=[self.commande.pk]), {'status': new_status}, format='json')
+
+    def test_second_courier_to_take_gets_409(self):
+        first = self.post(self.livreur, 'livreur-change-commande-status', 'loading')
+        second = self.post(self.other_livreur, 'livreur-change-commande-status', 'loading')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.data['status'], 'loading')
+        self.commande.refresh_from_db()
+        self.assertEqual(self.commande.livreur, self.livreur)
+
+    def test_courier_can_only_deliver_their_own_order(self):
+        self.post(self.livreur, 'livreur-change-commande-status', 'loading')
+
+        self.assertEqual(self.post(self.other_livreur, 'livreur-change-commande-status', 'delivered').status_code, 409)
+        self.assertEqual(self.post(self.livreur, 'livreur-change-commande-status', 'delivered').status_code, 200)
+
+    def test_transitions_outside_the_table_are_refused(self):
+        self.commande.status = 'delivered'
+        self.commande.save()
+
+        self.assertEqual(self.post(self.admin, 'change-commande-status', 'waiting').status_code, 409)
+
+    def test_admin_sending_back_to_the_pool_unassigns(self):
+        self.post(self.livreur, 'livreur-change-commande-status', 'loading')
+
+        response = self.post(self.admin, 'change-commande-status', 'paid')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['commande']['livreur'])
+        self.assertEqual(stats.drift(), {})
+
+    def test_unknown_order_is_404(self):
+        self.client.force_authenticate(self.admin)
+
+        response = self.client.post(reverse('change-commande-status', args=[999999]), {'status': 'paid'}, format='json')
+
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(ORDER_EVENTS_BROKER='api.events_stub.RecordingBroker')
+    def test_events_are_published_without_the_model_signals(self):
+        events.reset_broker()
+        self.addCleanup(events.reset_broker)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post(self.livreur, 'livreur-change-commande-status', 'loading')
+
+        self.assertEqual(events.get_broker().types(), ['commande.assigned'])
+
+
+class StatusTransitionStressTests(TransactionTestCase):
+    COURIERS = 8
+    ROUNDS = 5
+
+    def setUp(self):
+        customer = User.objects.create_user(phone=23400001, password='secret')
+        self.couriers = [
+            User.objects.create_user(phone=23400100 + i, password='secret', type='traitor')
+            for i in range(self.COURIERS)
+        ]
+        self.commandes = [Commande.objects.create(user=customer, prix=100, status='paid') for _ in range(self.ROUNDS)]
+
+    def race(self, commande):
+        """Every courier reads the order as available, then all try to take it at once."""
+        barrier = threading.Barrier(self.COURIERS)
+        waited = threading.local()
+        synchronized = []
+        outcomes = []
+        read_state = QuerySet.first
+
+        def synchronized_read(queryset):
+            # apply() reads the order with ``.first()`` right before its
+            # conditional UPDATE; hold every thread there until all have read.
+            result = read_state(queryset)
+            if not getattr(waited, 'done', False):
+                waited.done = True
+                barrier.wait(timeout=5)
+                synchronized.append(result)
+            return result
+
+        def take(courier):
+            try:
+                while True:
+                    try:
+                        transitions.apply(commande.pk, 'loading', transitions.COURIER, courier)
+                        outcomes.append(courier.pk)
+                        break
+                    except transitions.TransitionRefused:
+                        outcomes.append(None)
+                        break
+                    except OperationalError:
+                        # The in-memory test database fails fast on a write
+                        # lock instead of waiting like a real one.
+                        time.sleep(random.uniform(0.001, 0.01))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=take, args=(courier,)) for courier in self.couriers]
+        # The threads open their own connections. Under SQLite those begin
+        # IMMEDIATE transactions, which take the write lock before apply()
+        # even reads and so would keep the reads from overlapping.
+        options = {'transaction_mode': 'DEFERRED'} if connection.vendor == 'sqlite' else {}
+        with patch.object(QuerySet, 'first', synchronized_read), \
+                patch.dict(connection.settings_dict['OPTIONS'], options):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Every courier got past the barrier having seen the order available.
+        self.assertFalse(barrier.broken)
+        self.assertEqual(synchronized, [('paid', None, commande.user_id)] * self.COURIERS)
+        return outcomes
+
+    def test_exactly_one_courier_wins_each_order(self):
+        for commande in self.commandes:
+            outcomes = self.race(commande)
+
+            winners = [pk for pk in outcomes if pk is not None]
+            self.assertEqual(len(outcomes), self.COURIERS)
+            self.assertEqual(len(winners), 1)
+            commande.refresh_from_db()
+            self.assertEqual((commande.status, commande.livreur_id), ('loading', winners[0]))
+
+        self.assertEqual(stats.drift(), {})
+
+
+class ClaimNextTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23500001, password='secret')
+        cls.livreur = User.objects.create_user(phone=23500002, password='secret', type='traitor')
+        cls.other_livreur = User.objects.create_user(phone=23500003, password='secret', type='traitor')
+        cls.oldest, cls.newest = [Commande.objects.create(user=cls.customer, prix=100, status='paid') for _ in range(2)]
+        Commande.objects.create(user=cls.customer, prix=100, status='waiting')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def claim(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('claim-next-commande'))
+
+    def test_couriers_get_the_oldest_orders_one_each(self):
+        first = self.claim(self.livreur)
+        second = self.claim(self.other_livreur)
+        third = self.claim(self.livreur)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['commande']['id'], self.oldest.pk)
+        self.assertEqual(first.data['commande']['status'], 'loading')
+        self.assertEqual(second.data['commande']['id'], self.newest.pk)
+        self.assertEqual(third.status_code, 204)
+        self.assertEqual(stats.drift(), {})
+
+    def test_skip_locked_path(self):
+        with patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            response = self.claim(self.livreur)
+
+        self.assertEqual(response.data['commande']['id'], self.oldest.pk)
+
+    def test_only_couriers_can_claim(self):
+        self.assertEqual(self.claim(self.customer).status_code, 403)
+
+    def test_pending_livreur_route_serves_the_courier_view(self):
+        self.claim(self.livreur)
+        self.client.force_authenticate(self.other_livreur)
+
+        data = self.client.get(reverse('pending-livreur-commandes')).json()
+
+        self.assertEqual([c['id'] for c in data['paid']['results']], [self.newest.pk])
+        self.assertEqual(data['loading']['results'], [])
+
+
+class ClaimNextStressTests(TransactionTestCase):
+    COURIERS = 8
+    ORDERS = 20
+
+    def test_concurrent_claims_never_hand_out_the_same_order(self):
+        customer = User.objects.create_user(phone=23600001, password='secret')
+        couriers = [
+            User.objects.create_user(phone=23600100 + i, password='secret', type='traitor')
+            for i in range(self.COURIERS)
+        ]
+        for _ in range(self.ORDERS):
+            Commande.objects.create(user=customer, prix=100, status='paid')
+        claimed = []
+        barrier = threading.Barrier(self.COURIERS)
+
+        def work(courier):
+            barrier.wait(timeout=5)
+            try:
+                while True:
+                    try:
+                        pk = transitions.claim_next(courier)
+                    except OperationalError:
+                        time.sleep(0.005)  # see StatusTransitionStressTests
+                        continue
+                    if pk is None:
+                        return
+                    claimed.append((pk, courier.pk))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(courier,)) for courier in couriers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(pk for pk, _ in claimed), sorted(Commande.objects.values_list('pk', flat=True)))
+        self.assertEqual(
+            dict(claimed), dict(Commande.objects.values_list('pk', 'livreur_id')),
+        )
+        self.assertEqual(stats.drift(), {})
+
+
+class GeoIndexTests(TestCase):
+
+    def test_parse_location_formats(self):
+        self.assertEqual(geo.parse_location('18.0735, -15.9582'), (18.0735, -15.9582))
+        self.assertEqual(geo.parse_location('geo:18.07,-15.95?z=17'), (18.07, -15.95))
+        self.assertEqual(geo.parse_location('https://maps.google.com/?q=18.0861%2C-15.9753'), (18.0861, -15.9753))
+        self.assertEqual(geo.parse_location('https://www.google.com/maps/@18.09,-15.97,17z'), (18.09, -15.97))
+        self.assertIsNone(geo.parse_location('Carrefour'))
+        self.assertIsNone(geo.parse_location('95.000,10.000'))
+
+    def test_addresses_are_not_coordinates(self):
+        for address in ['Maison 5, 3eme etage', 'Tevragh Zeina, ilot 12, 45', 'Lot 12.5, 3.25',
+                        'https://maps.app/?q=Maison 5, 3']:
+            self.assertIsNone(geo.parse_location(address), address)
+
+    def test_grid_matches_a_linear_scan(self):
+        rng = random.Random(7)
+        index = geo.GridIndex(cell_degrees=0.01, max_km=20)
+        for courier in range(300):
+            index.update(courier, rng.uniform(18.0, 18.2), rng.uniform(-16.1, -15.9))
+        busy = set(range(0, 300, 3))
+
+        for _ in range(200):
+            latitude, longitude = rng.uniform(17.95, 18.25), rng.uniform(-16.15, -15.85)
+            self.assertEqual(
+                index.nearest(latitude, longitude, exclude=busy),
+                index.brute_force_nearest(latitude, longitude, exclude=busy),
+            )
+
+    def test_stale_and_far_positions_are_ignored(self):
+        index = geo.GridIndex(ttl=60, max_km=5)
+        index.update('stale', 18.08, -15.96, at=time.time() - 120)
+        index.update('far', 18.5, -15.96)
+
+        self.assertIsNone(index.nearest(18.08, -15.96))
+        self.assertIsNone(index.position('stale'))
+
+
+@override_settings(NOTIFICATIONS_ASYNC=False)
+class DispatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=23700001, password='secret')
+        cls.admin = User.objects.create_user(phone=23700002, password='secret', type='admin')
+        cls.near = User.objects.create_user(phone=23700003, password='secret', type='traitor', fcm_token='near-token')
+        cls.far = User.objects.create_user(phone=23700004, password='secret', type='traitor', fcm_token='far-token')
+
+    def setUp(self):
+        self.addCleanup(dispatch.couriers._positions.clear)
+        self.addCleanup(dispatch.couriers._cells.clear)
+        self.client = APIClient()
+        for courier, (latitude, longitude) in [(self.near, (18.0860, -15.9750)), (self.far, (18.1200, -15.9300))]:
+            self.client.force_authenticate(courier)
+            response = self.client.post(
+                reverse('livreur-position'), {'latitude': latitude, 'longitude': longitude}, format='json',
+            )
+            self.assertEqual(response.status_code, 204)
+
+    def test_coordinates_are_parsed_from_the_location_text(self):
+        commande = Commande.objects.create(user=self.customer, prix=100, location='geo:18.0861,-15.9753')
+
+        self.assertEqual((commande.latitude, commande.longitude), (18.0861, -15.9753))
+
+    @patch('api.notifications.messaging.send', return_value='message-id')
+    def test_paid_order_is_offered_to_the_nearest_free_courier(self, send):
+        commande = Commande.objects.create(user=self.customer, prix=100, location='18.0870,-15.9760')
+        self.client.force_authenticate(self.admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('change-commande-status', args=[commande.pk]), {'status': 'paid'}, format='json')
+
+        self.assertEqual(send.call_args.args[0].token, 'near-token')
+
+    def test_busy_couriers_are_skipped(self):
+        Commande.objects.create(user=self.customer, prix=100, location='x', status='loading', livreur=self.near)
+        commande = Commande.objects.create(user=self.customer, prix=100, location='18.0870,-15.9760')
+
+        self.assertEqual(dispatch.propose(commande.pk)[0], self.far.pk)
+
+    def test_orders_without_coordinates_get_no_offer(self):
+        commande = Commande.objects.create(user=self.customer, prix=100, location='Carrefour')
+
+        self.assertIsNone(dispatch.propose(commande.pk))
+
+    def test_going_offline_and_permissions(self):
+        self.client.force_authenticate(self.near)
+        self.client.post(reverse('livreur-position'), {'available': False}, format='json')
+        self.assertIsNone(dispatch.couriers.position(self.near.pk))
+
+        self.client.force_authenticate(self.customer)
+        response = self.client.post(reverse('livreur-position'), {'latitude': 18, 'longitude': -16}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(
+    DELIVERY_FEE_BASE=50, DELIVERY_FEE_PER_KM=10, DELIVERY_FEE_STEP=10, DELIVERY_FEE_EXTRA_VENDOR=20,
+    DELIVERY_FEE_DEFAULT=100, DELIVERY_MAX_KM=20, CACHES=LOCAL_CACHE,
+)
+class DeliveryFeeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=22910001, password='secret')
+        cls.snack = Vendor.objects.create(name='Snack', type='restaurant', image='vendor.jpg',
+                                          latitude=18.0860, longitude=-15.9750)
+        cls.pharma = Vendor.objects.create(name='Pharma', type='pharmacie', image='vendor.jpg',
+                                           latitude=18.1100, longitude=-15.9750)
+        cls.unplaced = Vendor.objects.create(name='Boutique', type='epicerie', image='vendor.jpg')
+        cls.burger = ItemVendor.objects.create(nom='Burger', prix=200, vendor=cls.snack, image='item.jpg')
+        cls.doliprane = ItemVendor.objects.create(nom='Doliprane', prix=120, vendor=cls.pharma, image='item.jpg')
+        cls.riz = ItemVendor.objects.create(nom='Riz', prix=90, vendor=cls.unplaced, image='item.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def lines(self, *items):
+        return [{'vendor_id': item.vendor_id, 'item_id': item.pk, 'number': 1} for item in items]
+
+    def order(self, items, **data):
+        return self.client.post(reverse('add-commande'), dict(
+            {'items': json.dumps(self.lines(*items)), 'livraison': 1, 'location': 'Ksar', 'phone': '22910001'},
+            **data,
+        ))
+
+    def quote(self, items, **data):
+        return self.client.post(reverse('quote-commande'), dict({'items': self.lines(*items)}, **data), format='json')
+
+    def test_fee_follows_the_distance_not_the_client(self):
+        # ~2.7 km north of the snack.
+        response = self.order([self.burger], location='18.1100,-15.9750')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['livraison'], 80)
+
+    def test_farthest_vendor_sets_the_distance_and_each_extra_pickup_costs(self):
+        response = self.quote([self.burger, self.doliprane], latitude=18.0860, longitude=-15.9750)
+
+        self.assertEqual(response.data['distance_km'], 2.78)
+        self.assertEqual(response.data['livraison'], 100)
+        self.assertEqual(response.data['total'], 420)
+
+    def test_default_fee_without_coordinates(self):
+        self.assertEqual(self.order([self.burger], location='Ksar').data['livraison'], 100)
+        self.assertEqual(self.quote([self.riz], latitude=18.09, longitude=-15.97).data['livraison'], 100)
+
+    def test_out_of_range(self):
+        response = self.order([self.burger], latitude='18.5', longitude='-15.9750')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Commande.objects.exists())
+        self.assertFalse(self.quote([self.burger], latitude=18.5, longitude=-15.975).data['deliverable'])
+
+    def test_points_read_from_the_text_never_refuse_the_order(self):
+        self.assertEqual(self.quote([self.burger], location='geo:18.5,-15.975').data['livraison'], 100)
+
+        response = self.order([self.burger], location='Tevragh Zeina, Maison 5, 3eme etage')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['livraison'], 100)
+
+    def test_client_cannot_pick_the_vendor_a_fee_is_quoted_from(self):
+        # The burger is sold by the snack; claiming the nearer pharmacy sells it is refused.
+        spoofed = [{'vendor_id': self.pharma.pk, 'item_id': self.burger.pk, 'number': 1}]
+
+        response = self.client.post(
+            reverse('quote-commande'), {'items': spoofed, 'latitude': 18.1100, 'longitude': -15.9750}, format='json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('vendor_id', response.data['errors'][0])
+
+    def test_warm_quote_needs_no_query(self):
+        fees.quote({self.snack.pk}, (18.1100, -15.9750))
+
+        with self.assertNumQueries(0):
+            # A few metres away: same zone, same matrix cell.
+            quote = fees.quote({self.snack.pk}, (18.1101, -15.9751))
+
+        self.assertEqual(quote.fee, 80)
+
+    def test_moving_a_vendor_updates_its_quotes(self):
+        fees.quote({self.snack.pk}, (18.1100, -15.9750))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Vendor.objects.filter(pk=self.snack.pk).update(latitude=18.1100)
+            Vendor.objects.get(pk=self.snack.pk).save()
+
+        self.assertEqual(fees.quote({self.snack.pk}, (18.1100, -15.9750)).fee, 50)
+
+
+class DatabaseSettingsTests(TestCase):
+
+    def test_sqlite_writers_wait_for_the_lock(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class PricingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(phone=22900001, password='secret')
+        cls.vendor = Vendor.objects.create(name='Pharma', type='pharmacie', image='vendor.jpg')
+        cls.doliprane = ItemVendor.objects.create(nom='Doliprane', prix=120, vendor=cls.vendor, image='item.jpg')
+        cls.spray = ItemVendor.objects.create(nom='Spray', prix=300, vendor=cls.vendor, image='item.jpg')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def order(self, prix=1):
+        return self.client.post(reverse('add-commande'), {
+            'items': json.dumps([
+                {'vendor_id': self.vendor.pk, 'item_id': self.doliprane.pk, 'number': 2},
+                {'vendor_id': self.vendor.pk, 'item_id': self.spray.pk, 'number': 1},
+            ]),
+            'prix': prix, 'livraison': 50, 'location': 'Ksar', 'phone': '22900001',
+        })
+
+    def test_total_is_computed_from_the_catalog(self):
+        response = self.order(prix=1)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['prix'], 540)
+        self.assertEqual(sorted(item['prix_unitaire'] for item in response.data['items']), [120, 300])
+
+    def test_unit_price_is_a_snapshot(self):
+        commande_id = self.order().data['id']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doliprane.prix = 150
+            self.doliprane.save()
+
+        line = ItemCommande.objects.get(commande_id=commande_id, item=self.doliprane)
+        self.assertEqual(line.prix_unitaire, 120)
+        self.assertEqual(self.order().data['prix'], 600)
+
+    def test_warm_price_book_needs_no_query(self):
+        pricing.get_price_book()
+
+        with self.assertNumQueries(0):
+            prices = pricing.get_price_book().lookup({self.doliprane.pk, self.spray.pk})
+
+        self.assertEqual(prices[self.spray.pk], (300, self.vendor.pk))
+
+    def test_price_book_falls_back_to_db_for_unknown_items(self):
+        pricing.get_price_book()
+        new_item = ItemVendor.objects.create(nom='Sirop', prix=80, vendor=self.vendor, image='item.jpg')
+
+        self.assertEqual(pricing.get_price_book().lookup({new_item.pk}), {new_item.pk: (80, self.vendor.pk)})
+
+    def test_line_vendor_must_sell_the_item(self):
+        other = Vendor.objects.create(name='Autre', type='pharmacie', image='vendor.jpg')
+
+        response = self.client.post(reverse('add-commande'), {
+            'items': json.dumps([{'vendor_id': other.pk, 'item_id': self.doliprane.pk, 'number': 1}]),
+            'location': 'Ksar', 'phone': '22900001',
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('vendor_id', response.data['errors'][0])
+        self.assertFalse(Commande.objects.exists())
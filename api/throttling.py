@@ -0,0 +1,38 @@
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class OTPPhoneThrottle(SimpleRateThrottle):
+    """
+    Sliding-window limit on OTP sends per phone number, so retries are
+    rejected before they cost another SMS.
+    """
+
+    def get_cache_key(self, request, view):
+        phone = request.data.get('phone')
+        if not phone:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': str(phone).strip()}
+
+
+class OTPPhoneBurstThrottle(OTPPhoneThrottle):
+    scope = 'otp_phone_burst'
+
+
+class OTPPhoneSustainedThrottle(OTPPhoneThrottle):
+    scope = 'otp_phone_sustained'
+
+
+class OTPIPThrottle(SimpleRateThrottle):
+    scope = 'otp_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class OTPVerifyPhoneThrottle(OTPPhoneThrottle):
+    """Guesses per phone number, on top of the per-code attempt limit (api/otp.py)."""
+    scope = 'otp_verify_phone'
+
+
+class OTPVerifyIPThrottle(OTPIPThrottle):
+    scope = 'otp_verify_ip'
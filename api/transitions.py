@@ -0,0 +1,149 @@
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Commande
+from . import dispatch, events, stats
+
+
+ADMIN = 'admin'
+COURIER = 'livreur'
+
+# Who the order must be assigned to for the move to be allowed...
+ANY = 'any'
+UNASSIGNED = 'unassigned'
+SELF = 'self'
+# ...and what happens to the assignment.
+KEEP = 'keep'
+ASSIGN = 'assign'
+CLEAR = 'clear'
+
+Transition = namedtuple('Transition', ['requires', 'livreur'])
+
+# (actor, from_status, to_status) -> Transition. Anything missing is refused.
+TRANSITIONS = {
+    (ADMIN, 'waiting', 'paid'): Transition(ANY, KEEP),
+    (ADMIN, 'waiting', 'rejected'): Transition(ANY, KEEP),
+    (ADMIN, 'paid', 'waiting'): Transition(ANY, KEEP),
+    (ADMIN, 'paid', 'rejected'): Transition(ANY, KEEP),
+    (ADMIN, 'paid', 'loading'): Transition(ANY, KEEP),
+    (ADMIN, 'rejected', 'waiting'): Transition(ANY, KEEP),
+    (ADMIN, 'rejected', 'paid'): Transition(ANY, KEEP),
+    # Back to the pool: whoever had it loses it.
+    (ADMIN, 'loading', 'paid'): Transition(ANY, CLEAR),
+    (ADMIN, 'loading', 'delivered'): Transition(ANY, KEEP),
+    (COURIER, 'paid', 'loading'): Transition(UNASSIGNED, ASSIGN),
+    (COURIER, 'loading', 'delivered'): Transition(SELF, KEEP),
+}
+
+
+def dispatch_offers_enabled():
+    return getattr(settings, 'DISPATCH_OFFERS', True)
+
+
+def target_statuses(actor):
+    return sorted({to_status for (who, _, to_status) in TRANSITIONS if who == actor})
+
+
+class TransitionRefused(Exception):
+    """The order is not (or no longer) in a state this move can start from."""
+
+    def __init__(self, current_status):
+        super().__init__(current_status)
+        self.current_status = current_status
+
+
+def allowed(transition, livreur_id, user):
+    if transition.requires == UNASSIGNED:
+        return livreur_id is None
+    if transition.requires == SELF:
+        return livreur_id == user.pk
+    return True
+
+
+def new_livreur(transition, livreur_id, user):
+    if transition.livreur == ASSIGN:
+        return user.pk
+    if transition.livreur == CLEAR:
+        return None
+    return livreur_id
+
+
+def apply(pk, to_status, actor, user):
+    """
+    Move order ``pk`` to ``to_status`` as ``actor`` with one conditional
+    UPDATE that only matches the exact state the move was checked against.
+
+    When two requests race, the database lets exactly one UPDATE match; the
+    other gets ``TransitionRefused``. Raises ``Commande.DoesNotExist`` for an
+    unknown order. Stats counters and order events are recorded here since
+    ``update()`` bypasses the model signals.
+    """
+    with transaction.atomic():
+        current = Commande.objects.filter(pk=pk).values_list('status', 'livreur_id', 'user_id').first()
+        if current is None:
+            raise Commande.DoesNotExist()
+        from_status, livreur_id, user_id = current
+
+        transition = TRANSITIONS.get((actor, from_status, to_status))
+        if transition is None or not allowed(transition, livreur_id, user):
+            raise TransitionRefused(from_status)
+
+        assigned = new_livreur(transition, livreur_id, user)
+        updated = Commande.objects.filter(pk=pk, status=from_status, livreur_id=livreur_id).update(
+            status=to_status, livreur_id=assigned, updated_at=timezone.now(),
+        )
+        if not updated:
+            # Someone else moved it between our read and our write.
+            raise TransitionRefused(
+                Commande.objects.filter(pk=pk).values_list('status', flat=True).first()
+            )
+
+        old_state, new_state = (from_status, livreur_id), (to_status, assigned)
+        stats.record_commande_change(old_state, new_state)
+        events.publish_commande_change(Commande(pk=pk, user_id=user_id), old_state, new_state)
+        if dispatch_offers_enabled() and events.in_courier_pool(new_state):
+            dispatch.offer_on_commit(pk)
+    return old_state, new_state
+
+
+# Serializes claims inside this process when the database cannot skip
+# locked rows (SQLite, which only has one writer anyway).
+_claim_lock = threading.Lock()
+
+
+def claimable():
+    return Commande.objects.filter(status='paid', livreur__isnull=True).order_by('date', 'id')
+
+
+def claim_next(user):
+    """
+    Assign the oldest paid, unassigned order to courier ``user`` and return
+    its pk, or ``None`` when there is nothing to take.
+
+    On PostgreSQL each claimer locks the first row nobody else holds
+    (``FOR UPDATE SKIP LOCKED``), so concurrent couriers walk down the queue
+    without waiting on each other. Elsewhere claims go one at a time, and a
+    row taken by another process in between is simply skipped.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = claimable().select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            apply(pk, 'loading', COURIER, user)
+            return pk
+
+    with _claim_lock:
+        while True:
+            pk = claimable().values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            try:
+                apply(pk, 'loading', COURIER, user)
+                return pk
+            except TransitionRefused:
+                continue
@@ -13,6 +13,7 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('signup/', SignupView.as_view(), name='signup'),
     path('check-phone/', check_phone_exists, name='check-phone'),
+    path('verify-otp/', verify_otp, name='verify-otp'),
     path('update-lang/', update_default_lang),
     path('me/delete/', DeleteAccountView.as_view(), name='delete-account'),
     path('reset-password/', reset_password, name='reset_password'),
@@ -20,18 +21,22 @@ urlpatterns = [
 
 
     # Custom category views
-    path('category/restaurant/', RestaurantVendorView.as_view(), name='category-restaurant'),
-    path('category/pharmacie/', PharmacieVendorView.as_view(), name='category-pharmacie'),
-    path('category/epicerie/', EpicerieVendorView.as_view(), name='category-epicerie'),
+    path('category/', CategoryVendorView.as_view(), name='category-all'),
+    path('category/<str:type>/', CategoryVendorView.as_view(), name='category-type'),
+    path('search/', SearchView.as_view(), name='search'),
 
     # Commande-related views
     path('mes_commandes/', MesCommandesView.as_view(), name='mes-commandes'),
     path('commandes/add/', AddCommandeView.as_view(), name='add-commande'),
+    path('commandes/quote/', QuoteCommandeView.as_view(), name='quote-commande'),
     path('commandes/pending/', PendingCommandesView.as_view(), name='pending-commandes'),  #done
     path('commandes/pending2/', PendingCommandesView2.as_view(), name='pending2-commandes'),  #done
     path('commandes/<int:pk>/change_status/', ChangeCommandeStatusView.as_view(), name='change-commande-status'),
     path('commandes/<int:pk>/change_status/livreur/', LivreurChangeCommandeStatusView.as_view(), name='livreur-change-commande-status'),
-    path('commandes/pending/livreur/', PendingCommandesView.as_view(), name='pending-commandes'),  #done
+    path('commandes/pending/livreur/', PendingCommandesLivreurView.as_view(), name='pending-livreur-commandes'),  #done
+    path('commandes/claim-next/', ClaimNextCommandeView.as_view(), name='claim-next-commande'),
+    path('livreur/position/', LivreurPositionView.as_view(), name='livreur-position'),
+    path('commandes/events/', order_events, name='commande-events'),
 
     # User-related views
     path('update_password/', UpdatePasswordView.as_view(), name='update-password'),
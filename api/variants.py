@@ -0,0 +1,69 @@
+import logging
+import os
+
+from cloudinary import CloudinaryResource
+from django.conf import settings
+
+from . import images
+
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'variants'
+
+
+def local_source(resource):
+    """The file under MEDIA_ROOT this image refers to, if it is a local one."""
+    name = f'{resource.public_id}.{resource.format}' if resource.format else resource.public_id
+    path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, name))
+    if path.startswith(os.path.normpath(settings.MEDIA_ROOT) + os.sep) and os.path.isfile(path):
+        return name, path
+    return None, None
+
+
+def cloudinary_variants(resource):
+    # Cloudinary derives (and caches) each size the first time its URL is hit.
+    return {
+        name: resource.build_url(width=size, height=size, crop='limit', quality='auto', fetch_format='auto')
+        for name, size in settings.IMAGE_VARIANTS.items()
+    }
+
+
+def local_variants(name, path):
+    variants = {}
+    for variant, size in settings.IMAGE_VARIANTS.items():
+        relative = os.path.join(VARIANTS_DIR, variant, os.path.splitext(name)[0] + '.webp')
+        target = os.path.join(settings.MEDIA_ROOT, relative)
+
+        if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            images.save_resized(path, target, size, 'WEBP', settings.IMAGE_VARIANT_QUALITY)
+
+        variants[variant] = settings.MEDIA_URL + relative.replace(os.sep, '/')
+    return variants
+
+
+def build_variants(field, value):
+    """
+    Return ``{variant: url}`` for the image stored in ``field``.
+
+    Cloudinary images get transformation URLs; files that live under
+    MEDIA_ROOT get WebP derivatives written next to them.
+    """
+    stored = field.get_prep_value(value)
+    if not stored:
+        return {}
+
+    resource = field.to_python(stored)
+    if not isinstance(resource, CloudinaryResource):
+        return {}
+
+    name, path = local_source(resource)
+    if path:
+        try:
+            return local_variants(name, path)
+        except (OSError, images.InvalidImage):
+            logger.exception('Could not build image variants for %s', path)
+            return {}
+
+    return cloudinary_variants(resource)
@@ -1,24 +1,40 @@
-import random
-from django.db import DatabaseError
-import requests
+from django.conf import settings
+from django.db import DatabaseError, transaction
 from rest_framework import viewsets, generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken,  TokenError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
 from django.contrib.auth import authenticate
-from .models import User, Vendor, Commande, ItemCommande
+from .models import User, Vendor, ItemVendor, Commande, ItemCommande
 from .serializers import *
+from . import captures, catalog, dispatch, events, fees, geo, images, otp, pricing, search, stats, transitions
+from .pagination import CommandeCursorPagination
+from .throttling import (
+    OTPPhoneBurstThrottle, OTPPhoneSustainedThrottle, OTPIPThrottle, OTPVerifyPhoneThrottle, OTPVerifyIPThrottle,
+)
+from .profiling import span
 from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from rest_framework.permissions import AllowAny
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.utils.urls import replace_query_param
+import asyncio
 import json
+from datetime import timedelta
 
-from firebase_admin import messaging
-from .firebase_init import *
-from firebase_admin._messaging_utils import UnregisteredError
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .sms import queue_validation_sms
+from .notifications import send_notification, notify_user, notify_admins, sync_admin_topic
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -27,17 +43,18 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 class VendorViewSet(viewsets.ModelViewSet):
-    queryset = Vendor.objects.all()
+    queryset = Vendor.objects.prefetch_related('vendor_items')
     serializer_class = VendorSerializer
 
 
 class CommandeViewSet(viewsets.ModelViewSet):
-    queryset = Commande.objects.all()
+    queryset = Commande.objects.with_details()
     serializer_class = CommandeSerializer
+    pagination_class = CommandeCursorPagination
 
 
 class ItemCommandeViewSet(viewsets.ModelViewSet):
-    queryset = ItemCommande.objects.all()
+    queryset = ItemCommande.objects.select_related('vendor', 'item')
     serializer_class = ItemCommandeSerializer
 
 
@@ -61,8 +78,10 @@ class LoginView(TokenObtainPairView):
             if user:
                 if fcm_token:
                     print('Saving fcm_token...')
+                    old_token = user.fcm_token
                     user.fcm_token = fcm_token
                     user.save(update_fields=['fcm_token'])
+                    sync_admin_topic(user, old_token, user.default_lang)
 
                 print(f'The user\'s token now is: {user.fcm_token}')
                 refresh = RefreshToken.for_user(user)
@@ -83,43 +102,159 @@ class LoginView(TokenObtainPairView):
 
 # --- Vendor details by type ---
 
-    
 
-class RestaurantVendorView(APIView):
+class CategoryVendorView(APIView):
     permission_classes = [AllowAny]
-    def get(self, request):
-        print('Here')
-        categories = Vendor.objects.filter(type='restaurant')
-        serializer = VendorSerializer(categories, many=True)
-        data = serializer.data
 
-        return Response(data)
-    
+    def get(self, request, type=None):
+        if type is not None and type not in catalog.vendor_types():
+            return Response({'detail': 'Invalid category type.'}, status=status.HTTP_404_NOT_FOUND)
 
+        snapshot = catalog.get_snapshot(type)
+        etag = snapshot['etag']
 
-class PharmacieVendorView(APIView):
-    permission_classes = [AllowAny]
-    def get(self, request):
-        print('Here')
-        categories = Vendor.objects.filter(type='pharmacie')
-        serializer = VendorSerializer(categories, many=True)
-        data = serializer.data
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = HttpResponse(snapshot['gzip'], content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(snapshot['body'], content_type='application/json')
 
-        return Response(data)
-    
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        response['Vary'] = 'Accept-Encoding'
+        return response
 
 
-class EpicerieVendorView(APIView):
+
+
+class SearchView(APIView):
+    """
+    Ranked search over vendor and item names: ``?q=<text>&type=<category>&page=<n>``.
+    """
     permission_classes = [AllowAny]
+    page_size = 20
+    max_page_size = 50
+
     def get(self, request):
-        print('Here')
-        categories = Vendor.objects.filter(type='epicerie')
-        serializer = VendorSerializer(categories, many=True)
-        data = serializer.data
+        vendor_type = request.query_params.get('type') or None
+        if vendor_type is not None and vendor_type not in catalog.vendor_types():
+            return Response({'detail': 'Invalid category type.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(data)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            return Response({'detail': 'page and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One extra row tells us whether there is a next page without a COUNT.
+        documents = search.search(
+            request.query_params.get('q', ''), vendor_type, limit=page_size + 1, offset=(page - 1) * page_size,
+        )
+        has_next = len(documents) > page_size
+        documents = documents[:page_size]
 
+        with span('serialize'):
+            results = search_results(documents)
 
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'results': results,
+        })
+
+
+def search_results(documents):
+    vendor_ids = [d.object_id for d in documents if d.kind == 'vendor']
+    item_ids = [d.object_id for d in documents if d.kind == 'item']
+    vendors = Vendor.objects.in_bulk(vendor_ids) if vendor_ids else {}
+    items = ItemVendor.objects.in_bulk(item_ids) if item_ids else {}
+
+    results = []
+    for document in documents:
+        if document.kind == 'vendor' and document.object_id in vendors:
+            data = VendorDetailSerializer(vendors[document.object_id]).data
+        elif document.kind == 'item' and document.object_id in items:
+            data = ItemVendorDetailSerializer(items[document.object_id]).data
+        else:
+            continue
+        results.append({'kind': document.kind, 'vendor_id': document.vendor_id, document.kind: data})
+    return results
+
+
+def paginate_commandes(request, queryset, view, bucket=None):
+    # Each bucket of a multi-list response pages independently: ?<bucket>_cursor=...
+    paginator = CommandeCursorPagination(f'{bucket}_cursor' if bucket else None)
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    with span('serialize'):
+        data = CommandeSerializer(page, many=True).data
+    return paginator.get_page_data(data)
+
+
+def parse_watermark(raw):
+    if raw is None:
+        return None
+    since = parse_datetime(raw.replace(' ', '+'))
+    if since is None or timezone.is_naive(since):
+        raise ValidationError({'since': 'Invalid watermark.'})
+    return since
+
+
+def next_watermark():
+    # Trail the clock a little: a row saved just before this request but
+    # committed just after it is still picked up by the next delta.
+    return (timezone.now() - timedelta(seconds=settings.COMMANDE_WATERMARK_LAG)).isoformat()
+
+
+def list_commandes(request, view, scope, buckets=None):
+    """
+    Orders from ``scope``, either paginated or, with ``?since=<watermark>``,
+    only those changed since then. ``buckets`` maps each list of a
+    multi-list response to the field values its rows must have.
+
+    Every response carries a ``watermark`` to send back as ``since``.
+    """
+    since = parse_watermark(request.query_params.get('since'))
+    watermark = next_watermark()
+
+    if since is not None:
+        return commandes_delta(scope, since, buckets, watermark)
+    if buckets is None:
+        return dict(paginate_commandes(request, scope, view), watermark=watermark)
+    return {
+        name: dict(paginate_commandes(request, scope.filter(**fields), view, name), watermark=watermark)
+        for name, fields in buckets.items()
+    }
+
+
+def commandes_delta(scope, since, buckets, watermark):
+    # On an idle system this id lookup on the updated_at index is the only query.
+    changed = list(
+        scope.filter(updated_at__gt=since).order_by('updated_at', 'id')
+        .values_list('id', flat=True)[:settings.COMMANDE_DELTA_LIMIT + 1]
+    )
+    if len(changed) > settings.COMMANDE_DELTA_LIMIT:
+        # Too far behind; a full reload is cheaper.
+        reset = {'reset': True, 'watermark': watermark}
+        return reset if buckets is None else {name: reset for name in buckets}
+
+    rows = list(scope.filter(id__in=changed).order_by('-date', '-id')) if changed else []
+
+    def delta(members):
+        kept = {row.id for row in members}
+        with span('serialize'):
+            results = CommandeSerializer(members, many=True).data
+        # Rows that changed but no longer belong here (e.g. moved to another status).
+        return {'results': results, 'removed': [pk for pk in changed if pk not in kept], 'watermark': watermark}
+
+    if buckets is None:
+        return delta(rows)
+    return {
+        name: delta([row for row in rows if all(getattr(row, f) == value for f, value in fields.items())])
+        for name, fields in buckets.items()
+    }
 
 
 # --- Mes Commandes ---
@@ -127,9 +262,8 @@ class MesCommandesView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        commandes = Commande.objects.filter(user=request.user)
-        serializer = CommandeSerializer(commandes, many=True)
-        return Response(serializer.data)
+        commandes = Commande.objects.with_details().filter(user=request.user)
+        return Response(list_commandes(request, self, commandes))
 
 
 class AddCommandeView(APIView):
@@ -150,18 +284,25 @@ class AddCommandeView(APIView):
             return Response({'detail': 'A list of items is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-        print(request.data.get('livraison'))
         commande_data = {
-            'prix': request.data.get('prix'),
             'location': request.data.get('location'),
-            'livraison': request.data.get('livraison'),
             'phone': request.data.get('phone'),
             'user': request.user.id,
             'title': request.data.get('title'),
         }
+        for coordinate in ('latitude', 'longitude'):
+            if request.data.get(coordinate) not in (None, ''):
+                commande_data[coordinate] = request.data.get(coordinate)
 
-        if 'capture' in request.FILES:
-            commande_data['capture'] = request.FILES['capture']
+        items_serializer = ItemCommandeBulkSerializer(data={'items': items_data})
+        if not items_serializer.is_valid():
+            return Response({
+                'detail': 'Invalid item data.',
+                'errors': items_serializer.errors.get('items', items_serializer.errors)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # The total comes from the catalog, not from the client.
+        commande_data['prix'] = pricing.subtotal(items_serializer.validated_data['items'])
 
         commande_serializer = CommandeSerializer(data=commande_data, context={'user': request.user})
         if not commande_serializer.is_valid():
@@ -170,35 +311,82 @@ class AddCommandeView(APIView):
                 'errors': commande_serializer.errors
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        commande = commande_serializer.save()
+        # So is the delivery fee, from how far the vendors are from the address.
+        validated = commande_serializer.validated_data
+        try:
+            livraison = fees.quote_order(
+                items_serializer.validated_data['items'],
+                validated.get('latitude'), validated.get('longitude'), validated.get('location'),
+            )
+        except fees.OutOfRange as err:
+            return Response({'detail': 'Delivery address is out of range.', 'distance_km': err.distance_km},
+                            status=status.HTTP_400_BAD_REQUEST)
 
+        # The capture goes to Cloudinary in the background; the order exists right away.
+        capture = {}
+        if 'capture' in request.FILES:
+            try:
+                images.check(request.FILES['capture'])
+            except images.InvalidImage as err:
+                return Response({'capture': [str(err)]}, status=status.HTTP_400_BAD_REQUEST)
+            capture = {'capture_staged': captures.stage(request.FILES['capture']), 'capture_status': 'pending'}
 
-        print('Created commande:', commande)
+        # The order and all of its lines land together or not at all.
+        try:
+            with transaction.atomic():
+                commande = commande_serializer.save(livraison=livraison.fee, **capture)
+                items_serializer.save(commande=commande)
+                if capture:
+                    captures.queue_upload(commande)
+        except Exception:
+            if capture:
+                captures.discard(capture['capture_staged'])
+            raise
 
-        for item in items_data:
-            item['commande'] = commande.id
-            item_serializer = ItemCommandeSerializer(data=item)
-            print('Item data:', items_data)
-            if not item_serializer.is_valid():
-                commande.delete()
-                print('Item errors:', item_serializer.errors)
-                return Response({
-                    'detail': 'Invalid item data.',
-                    'errors': item_serializer.errors
-                }, status=status.HTTP_400_BAD_REQUEST)
+        notify_admins({
+            'ar': ('طلب جديد', f'تمت إضافة طلب جديد من الرقم {commande.phone} بالكود {commande.code}'),
+            'fr': ('Nouvelle commande', f'Nouvelle commande ajoutee par {commande.phone} avec le code {commande.code}'),
+        })
 
-            item_serializer.save()
-        
 
-        user = request.user
+        commande = Commande.objects.with_details().get(pk=commande.pk)
+        return Response(CommandeSerializer(commande).data, status=status.HTTP_201_CREATED)
 
-        if user.default_lang == 'ar' :
-            send_notifications_to_admins('طلب جديد', f'تمت إضافة طلب جديد من الرقم {commande.phone} بالكود {commande.code}')
-        else :
-            send_notifications_to_admins(f'Nouvelle commande', f'Nouvelle commande ajoutee par {commande.phone} avec le code {commande.code}')
 
+class QuoteCommandeView(APIView):
+    """
+    Price a basket before it is ordered: ``items`` as for ``commandes/add/``
+    plus ``latitude``/``longitude`` or a ``location``. Same numbers the order
+    will be created with.
+    """
+    permission_classes = [IsAuthenticated]
 
-        return Response(CommandeSerializer(commande).data, status=status.HTTP_201_CREATED)
+    def post(self, request):
+        items_serializer = ItemCommandeBulkSerializer(data={'items': request.data.get('items')})
+        if not items_serializer.is_valid():
+            return Response({
+                'detail': 'Invalid item data.',
+                'errors': items_serializer.errors.get('items', items_serializer.errors)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            latitude, longitude = (
+                float(request.data[name]) if request.data.get(name) not in (None, '') else None
+                for name in ('latitude', 'longitude')
+            )
+        except (TypeError, ValueError):
+            return Response({'detail': 'Invalid coordinates.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = items_serializer.validated_data['items']
+        prix = pricing.subtotal(lines)
+        try:
+            livraison = fees.quote_order(lines, latitude, longitude, request.data.get('location'))
+        except fees.OutOfRange as err:
+            return Response({'prix': prix, 'livraison': None, 'total': None,
+                             'distance_km': err.distance_km, 'deliverable': False})
+
+        return Response({'prix': prix, 'livraison': livraison.fee, 'total': prix + livraison.fee,
+                         'distance_km': livraison.distance_km, 'deliverable': True})
 
 
 class UpdatePasswordView(APIView):
@@ -242,16 +430,74 @@ class MeView(APIView):
 
 
 
+async def order_events(request):
+    """
+    Server-Sent Events stream of order created / status_changed / assigned
+    events for the authenticated user (admins see every order, couriers
+    their own and the unassigned pool, customers their own).
+
+    Authenticate with the usual ``Authorization: Bearer`` header, or with
+    ``?token=`` for EventSource clients that cannot set headers. Served by
+    the ASGI application; polling the pending lists stays available.
+    """
+    if not isinstance(request, ASGIRequest):
+        # WSGI buffers a streaming response from an async iterator into a
+        # list before sending it: this endless stream would never answer
+        # and would hold the worker forever.
+        return JsonResponse(
+            {'detail': 'The event stream is only served by the ASGI application; poll the pending lists.'},
+            status=503,
+        )
+
+    user = await sync_to_async(stream_user)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    broker = events.get_broker()
+    audiences = events.audiences_for_user(user)
+    heartbeat = settings.ORDER_EVENTS_HEARTBEAT
+
+    async def stream():
+        # Subscribed only while the response is actually being streamed.
+        subscription = broker.subscribe(audiences)
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscription.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield events.format_sse(event)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_user(request):
+    authenticator = JWTAuthentication()
+    try:
+        authenticated = authenticator.authenticate(request)
+        if authenticated is None and request.GET.get('token'):
+            token = authenticator.get_validated_token(request.GET['token'])
+            authenticated = (authenticator.get_user(token), token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return authenticated[0] if authenticated else None
+
+
 class PendingCommandesView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        paid = Commande.objects.filter(status='paid')
-        loading = Commande.objects.filter(status='loading')
-        return Response({
-            "paid": CommandeSerializer(paid, many=True).data,
-            "loading": CommandeSerializer(loading, many=True).data
-        })
+        return Response(list_commandes(request, self, Commande.objects.with_details(), {
+            "paid": {'status': 'paid'},
+            "loading": {'status': 'loading'},
+        }))
     
 
 
@@ -261,24 +507,20 @@ class PendingCommandesLivreurView(APIView):
     def get(self, request):
 
         user = request.user
-        paid = Commande.objects.filter(status='paid', livreur__isnull=True)
-        loading = Commande.objects.filter(status='loading', livreur=user)
-        return Response({
-            "paid": CommandeSerializer(paid, many=True).data,
-            "loading": CommandeSerializer(loading, many=True).data
-        })
+        return Response(list_commandes(request, self, Commande.objects.with_details(), {
+            "paid": {'status': 'paid', 'livreur_id': None},
+            "loading": {'status': 'loading', 'livreur_id': user.pk},
+        }))
     
 
 class PendingCommandesView2(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        waiting = Commande.objects.filter(status='waiting')
-        delivered = Commande.objects.filter(status='delivered')
-        return Response({
-            "waiting": CommandeSerializer(waiting, many=True).data,
-            "delivered": CommandeSerializer(delivered, many=True).data
-        })
+        return Response(list_commandes(request, self, Commande.objects.with_details(), {
+            "waiting": {'status': 'waiting'},
+            "delivered": {'status': 'delivered'},
+        }))
     
 
 
@@ -305,12 +547,16 @@ class StatisticsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        counters = stats.read([
+            'users:simple', 'users:traitor',
+            'commandes:delivered', 'commandes:waiting', 'commandes:loading',
+        ])
         data = {
-            "simple_users": User.objects.filter(type='simple').count(),
-            "traitors": User.objects.filter(type='traitor').count(),
-            "commandes_delivered": Commande.objects.filter(status='delivered').count(),
-            "commandes_waiting": Commande.objects.filter(status='waiting').count(),
-            "commandes_loading": Commande.objects.filter(status='loading').count(),
+            "simple_users": counters['users:simple'],
+            "traitors": counters['users:traitor'],
+            "commandes_delivered": counters['commandes:delivered'],
+            "commandes_waiting": counters['commandes:waiting'],
+            "commandes_loading": counters['commandes:loading'],
         }
         return Response(data)
     
@@ -323,9 +569,13 @@ class LivreurStatisticsView(APIView):
 
         user = request.user
 
+        delivered = f'commandes:delivered:livreur:{user.pk}'
+        loading = f'commandes:loading:livreur:{user.pk}'
+        counters = stats.read([delivered, loading])
+
         data = {
-            "commandes_delivered": Commande.objects.filter(status='delivered', livreur=user).count(),
-            "commandes_loading": Commande.objects.filter(status='loading', livreur=user).count(),
+            "commandes_delivered": counters[delivered],
+            "commandes_loading": counters[loading],
         }
         return Response(data)
     
@@ -333,54 +583,67 @@ class LivreurStatisticsView(APIView):
 
 
 
-class ChangeCommandeStatusView(APIView):
-    permission_classes = [IsAuthenticated]
+STATUS_LABELS = {
+    'ar': {
+        'waiting': 'قيد الانتظار',
+        'paid': 'مدفوع',
+        'loading': 'قيد المعالجة',
+        'delivered': 'تم التوصيل',
+        'rejected': 'مرفوض',
+    },
+    'fr' : {
+        'waiting' : 'en attente',
+        'paid' : 'paye',
+        'loading' : 'en cours',
+        'delivered' : 'livre',
+        'rejected' : 'rejecte',
+    }
+}
 
-    def post(self, request, pk):
-        new_status = request.data.get('status')
-        if new_status not in ['waiting', 'paid', 'loading', 'delivered', 'rejected']:
-            return Response({'detail': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-        commande = get_object_or_404(Commande, pk=pk)
-        commande.status = new_status
-        commande.save()
+def notify_status_change(commande):
+    # Localize for the customer receiving it, not for whoever changed the status
+    if commande.user.default_lang == 'ar' :
+        notify_user(
+            STATUS_LABELS['ar'][commande.status],
+            f'تم تغيير حالة طلبك {commande.code}',
+            commande.user.fcm_token
+        )
+    else :
+        notify_user(
+            STATUS_LABELS['fr'][commande.status],
+            f'Votre commande {commande.code} a change de status ',
+            commande.user.fcm_token
+        )
 
-        print(request.user.fcm_token)
-        user = request.user
 
+def change_status(pk, new_status, actor, user):
+    """Apply the transition; returns an error response, or None when it went through."""
+    try:
+        transitions.apply(pk, new_status, actor, user)
+    except Commande.DoesNotExist:
+        raise Http404
+    except transitions.TransitionRefused as refused:
+        return Response({
+            'detail': f'Cannot move this commande to {new_status}.',
+            'status': refused.current_status,
+        }, status=status.HTTP_409_CONFLICT)
+    return None
 
 
-        statuses = {
-            'ar': {
-                'waiting': 'قيد الانتظار',
-                'paid': 'مدفوع',
-                'loading': 'قيد المعالجة',
-                'delivered': 'تم التوصيل',
-                'rejected': 'مرفوض',
-            },
-            'fr' : {
-                'waiting' : 'en attente',
-                'paid' : 'paye',
-                'loading' : 'en cours',
-                'delivered' : 'livre',
-                'rejected' : 'rejecte',
-            }
-        }
+class ChangeCommandeStatusView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request, pk):
+        new_status = request.data.get('status')
+        if new_status not in ['waiting', 'paid', 'loading', 'delivered', 'rejected']:
+            return Response({'detail': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-                
-        if user.default_lang == 'ar' :
-            send_notification(
-                statuses['ar'][commande.status], 
-                f'تم تغيير حالة طلبك {commande.code}',
-                commande.user.fcm_token
-            )
-        else :
-            send_notification(
-                statuses['fr'][commande.status], 
-                f'Votre commande {commande.code} a change de status ',
-                commande.user.fcm_token
-            )
+        conflict = change_status(pk, new_status, transitions.ADMIN, request.user)
+        if conflict is not None:
+            return conflict
+        commande = Commande.objects.with_details().get(pk=pk)
+        notify_status_change(commande)
         return Response({'detail': 'Status updated successfully', 'commande': CommandeSerializer(commande).data})
     
 
@@ -395,51 +658,69 @@ class LivreurChangeCommandeStatusView(APIView):
         if new_status not in ['loading', 'delivered']:
             return Response({'detail': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-        commande = get_object_or_404(Commande, pk=pk)
-        commande.status = new_status
-        if new_status == 'loading' :
-            commande.livreur = user
-        commande.save()
+        # "Take" only succeeds while the order is still paid and unassigned.
+        conflict = change_status(pk, new_status, transitions.COURIER, user)
+        if conflict is not None:
+            return conflict
+        commande = Commande.objects.with_details().get(pk=pk)
+        notify_status_change(commande)
+        return Response({'detail': 'Status updated successfully', 'commande': CommandeSerializer(commande).data})
+    
 
-        print(request.user.fcm_token)
-        
 
 
 
-        statuses = {
-            'ar': {
-                'loading': 'قيد المعالجة',
-                'delivered': 'تم التوصيل',
-            },
-            'fr' : {
-                'loading' : 'en cours',
-                'delivered' : 'livre',
-            }
-        }
 
 
-        
+class ClaimNextCommandeView(APIView):
+    """
+    Hand the calling courier the oldest paid, unassigned order (201), or
+    204 when the queue is empty. Concurrent couriers never get the same order.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        if user.type != 'traitor':
+            return Response({"detail": "Not a traitor user"}, status=status.HTTP_403_FORBIDDEN)
 
+        pk = transitions.claim_next(user)
+        if pk is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-                
-        if user.default_lang == 'ar' :
-            send_notification(
-                statuses['ar'][commande.status], 
-                f'تم تغيير حالة طلبك {commande.code}',
-                commande.user.fcm_token
-            )
-        else :
-            send_notification(
-                statuses['fr'][commande.status], 
-                f'Votre commande {commande.code} a change de status ',
-                commande.user.fcm_token
-            )
-        return Response({'detail': 'Status updated successfully', 'commande': CommandeSerializer(commande).data})
-    
+        commande = Commande.objects.with_details().get(pk=pk)
+        notify_status_change(commande)
+        return Response({'detail': 'Commande claimed', 'commande': CommandeSerializer(commande).data},
+                        status=status.HTTP_201_CREATED)
 
 
+class LivreurPositionView(APIView):
+    """
+    Couriers report where they are (``latitude``/``longitude``) so newly paid
+    orders can be offered to the nearest one; ``{"available": false}`` takes
+    them off the map.
+    """
+    permission_classes = [IsAuthenticated]
 
+    def post(self, request):
+        user = request.user
+        if user.type != 'traitor':
+            return Response({"detail": "Not a traitor user"}, status=status.HTTP_403_FORBIDDEN)
 
+        if request.data.get('available') is False:
+            dispatch.go_offline(user.pk)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        try:
+            latitude = float(request.data.get('latitude'))
+            longitude = float(request.data.get('longitude'))
+        except (TypeError, ValueError):
+            return Response({'detail': 'latitude and longitude are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not geo.valid(latitude, longitude):
+            return Response({'detail': 'Coordinates out of range.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        dispatch.report_position(user.pk, latitude, longitude)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ToggleUserTypeView(APIView):
@@ -467,9 +748,14 @@ class SignupView(APIView):
     permission_classes = [AllowAny] 
 
     def post(self, request):
+        phone = request.data.get('phone')
+        if otp.required() and not otp.is_verified(phone, 'signup'):
+            return Response({"error": "Phone number not verified."}, status=status.HTTP_403_FORBIDDEN)
+
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
+            otp.consume(phone, 'signup')
             return Response({
                 "message": "User created successfully",
                 "user": UserDetailSerializer(user).data
@@ -478,11 +764,9 @@ class SignupView(APIView):
 
 
 
-def generate_otp():
-    return str(random.randint(100000, 999999))
-
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPPhoneBurstThrottle, OTPPhoneSustainedThrottle, OTPIPThrottle])
 def check_phone_exists(request):
     phone = request.data.get('phone')
     purpose = request.data.get('purpose') 
@@ -495,17 +779,32 @@ def check_phone_exists(request):
 
     exists = User.objects.filter(phone=phone).exists()
 
-    if purpose == 'signup' and not exists:
-        code = generate_otp()
-        send_validation_sms(phone, code)
-        return Response({"otp_sent": code, "exists": False})
+    if (purpose == 'signup' and not exists) or (purpose == 'forgot_password' and exists):
+        code = otp.issue(phone, purpose)
+        queue_validation_sms(phone, code)
+        return Response({"otp_sent": code if settings.OTP_EXPOSE_CODE else True, "exists": exists})
+
+    return Response({"otp_sent": False, "exists": exists})
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([OTPVerifyPhoneThrottle, OTPVerifyIPThrottle])
+def verify_otp(request):
+    phone = request.data.get('phone')
+    purpose = request.data.get('purpose')
+    code = request.data.get('code')
+
+    if not phone or not code or purpose not in ['signup', 'forgot_password']:
+        return Response(
+            {"error": "Phone, code and valid purpose ('signup' or 'forgot_password') are required."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    elif purpose == 'forgot_password' and exists:
-        code = generate_otp()
-        send_validation_sms(phone, code)
-        return Response({"otp_sent": code, "exists": True})
+    if not otp.verify(phone, purpose, code):
+        return Response({"verified": False, "error": "Invalid or expired code."}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({"otp_sent": code, "exists": exists})
+    return Response({"verified": True})
 
 
 
@@ -521,10 +820,14 @@ def reset_password(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    if otp.required() and not otp.is_verified(phone, 'forgot_password'):
+        return Response({"error": "Phone number not verified."}, status=status.HTTP_403_FORBIDDEN)
+
     try:
         user = User.objects.get(phone=phone)
         user.set_password(new_password)
         user.save()
+        otp.consume(phone, 'forgot_password')
         return Response({"success": "Password updated successfully."}, status=status.HTTP_200_OK)
 
     except User.DoesNotExist:
@@ -547,40 +850,6 @@ class DeleteAccountView(APIView):
 
 
 
-def send_validation_sms(phone_number: str, code: str):
-    url = 'https://chinguisoft.com/api/sms/validation/o5MSMshKgDe6hZJ5'
-    headers = {
-        # 'Validation-token': 'MnQK3bW88JD5KPPUzeB5DDxuU4RwXT71',
-        'Validation-token': 'pPjqb4VQbMi1wkmJRc4B7eZKqh3jlGme',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "phone": phone_number,
-        "lang": "fr",
-        "code": code
-    }
-    print('otp code')
-    print(code)
-
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()  # Will raise an exception for HTTP error codes
-        print("Message sent successfully:", response.json())
-        return response.json()
-    except requests.exceptions.HTTPError as errh:
-        print("HTTP Error:", errh)
-    except requests.exceptions.ConnectionError as errc:
-        print("Connection Error:", errc)
-    except requests.exceptions.Timeout as errt:
-        print("Timeout Error:", errt)
-    except requests.exceptions.RequestException as err:
-        print("Request Error:", err)
-
-
-
-
-
-
 ################## FIREBASE CONFIG
 
 
@@ -599,67 +868,6 @@ def test_notification(request):
 
 
 
-def send_notification(title, body, token):
-    print(token)
-
-    # Skip empty or None tokens
-    if not token:
-        return
-
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title=title,
-            body=body,
-        ),
-        token=token,
-    )
-
-    try:
-        response = messaging.send(message)
-        print("✅ Notification envoyée avec ID:", response)
-
-    except UnregisteredError:
-        # Token no longer valid — skip silently
-        pass
-
-    except Exception:
-        # Any other Firebase error — skip silently
-        pass
-
-
-
-def send_notifications_to_admins(title, body):
-    admins = User.objects.filter(type__in=['admin', 'super_admin'])
-
-    for admin in admins:
-        token = admin.fcm_token
-
-        # Skip empty or None tokens
-        if not token:
-            continue  
-
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            token=token,
-        )
-
-        try:
-            response = messaging.send(message)
-            print("Message envoyé avec ID:", response)
-
-        except UnregisteredError:
-            # Token no longer valid — skip silently
-            pass
-
-        except Exception:
-            # Any other Firebase error — skip silently
-            pass
-
-
-
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -673,8 +881,10 @@ class LogoutView(APIView):
             token = RefreshToken(refresh_token)
             token.blacklist()
 
+            old_token = request.user.fcm_token
             request.user.fcm_token = ""
             request.user.save(update_fields=["fcm_token"])
+            sync_admin_topic(request.user, old_token, request.user.default_lang)
 
             return Response({"detail": "Successfully logged out."}, status=status.HTTP_205_RESET_CONTENT)
 
@@ -693,8 +903,10 @@ def update_default_lang(request):
     if new_lang not in ['fr', 'ar']:  
         return Response({"error": "Langue invalide."}, status=status.HTTP_400_BAD_REQUEST)
 
+    old_lang = user.default_lang
     user.default_lang = new_lang
     user.save()
+    sync_admin_topic(user, user.fcm_token, old_lang)
 
     return Response({
         "message": "Langue par défaut mise à jour avec succès.",
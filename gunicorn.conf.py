@@ -0,0 +1,17 @@
+# Read by any ``gunicorn`` started from the project root. Which application
+# and worker class to run is left to the start command (see Procfile):
+#
+#     gunicorn livrily_backend.asgi:application -k uvicorn_worker.UvicornWorker
+#
+# Uvicorn workers running the ASGI application let the order event stream
+# (/api/commandes/events/) stay open without holding a worker per client.
+# The event broker and the courier position index are per process
+# (api/events.py, api/dispatch.py): keep one worker per host until
+# ORDER_EVENTS_BROKER points to a shared bus.
+import os
+
+bind = f'0.0.0.0:{os.getenv("PORT", "8000")}'
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+# Streams are long-lived; this only bounds how long a worker may stop checking in.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 10
@@ -2,6 +2,13 @@
 ASGI config for livrily_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is what production serves (Procfile):
+
+    gunicorn livrily_backend.asgi:application -k uvicorn_worker.UvicornWorker
+
+The order event stream (``/api/commandes/events/``) needs it; under WSGI the
+view refuses with a 503, since Django would buffer the endless response and
+the worker would never answer.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 from datetime import timedelta
 import cloudinary
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -86,6 +87,14 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # OTP sends and verifications (api/throttling.py): sliding windows per phone and per IP.
+    'DEFAULT_THROTTLE_RATES': {
+        'otp_phone_burst': '1/min',
+        'otp_phone_sustained': '5/hour',
+        'otp_ip': '30/hour',
+        'otp_verify_phone': '15/hour',
+        'otp_verify_ip': '60/hour',
+    },
 }
 
 SIMPLE_JWT = {
@@ -102,6 +111,42 @@ SIMPLE_JWT = {
 AUTH_USER_MODEL = 'api.User'
 
 
+# Catalog snapshots and generation (api/catalog.py), OTPs and throttles live
+# here, so every worker has to see the same cache: the database by default
+# (its table is created by migration 0028), Redis when REDIS_URL is set
+# (needs the ``redis`` package).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'livrily_cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
+# Snapshots are replaced on every catalog change; this only bounds how long
+# an orphaned copy can linger.
+CATALOG_SNAPSHOT_TTL = 24 * 60 * 60
+
+
+# Server-side OTPs (api/otp.py), held in the cache above.
+OTP_TTL = 5 * 60
+OTP_MAX_ATTEMPTS = 5
+OTP_VERIFIED_TTL = 10 * 60
+# Older app builds verify the code on the device; keep sending it to them until they update.
+# While on, signup and password reset don't require a verify-otp call first.
+OTP_EXPOSE_CODE = os.getenv('OTP_EXPOSE_CODE', '') == '1'
+
+
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -138,27 +183,56 @@ WSGI_APPLICATION = 'livrily_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default; DB_ENGINE=postgresql for production (DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST, DB_PORT, DB_SSLMODE).
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE not in ('sqlite', 'postgresql'):
+    raise ImproperlyConfigured(f"DB_ENGINE must be 'sqlite' or 'postgresql', not {DB_ENGINE!r}.")
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'chwily_db'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Under ASGI every request may run its queries on a different
+            # thread, and a persistent connection stays open with the thread
+            # it was made on, so connections are closed after each request.
+            # Pool them with PgBouncer instead (DB_PGBOUNCER below). Only
+            # raise this for a WSGI deployment.
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'sslmode': os.getenv('DB_SSLMODE', 'require'),
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
+    }
+    # PgBouncer is the supported pooler: point DB_HOST/DB_PORT at it. In
+    # transaction mode, cursors can't outlive a transaction.
+    DISABLE_SERVER_SIDE_CURSORS = os.getenv('DB_PGBOUNCER', '') == '1'
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Writers queue for the lock for up to this many seconds
+                # instead of failing with "database is locked"...
+                'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '20')),
+                # ...which only helps if they take it when the transaction
+                # starts: a deferred transaction that later tries to write
+                # fails straight away.
+                'transaction_mode': 'IMMEDIATE',
+                # Readers no longer block the writer, nor it them.
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
     }
-}
-
-
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': 'chwily_db',
-#         'USER': 'khalef',
-#         'PASSWORD': 'qL26ShuMwwo9Dz6ayY0bDt6CoZlcMAqa',
-#         'HOST': 'dpg-d14ns8vdiees73fbjjn0-a.oregon-postgres.render.com',
-#         'PORT': '5432',
-#         'OPTIONS': {
-#             'sslmode': 'require',
-#         }
-#     }
-# }
 
 
 # Password validation
@@ -208,4 +282,114 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 INSTALLED_APPS += ['corsheaders']
 MIDDLEWARE.insert(0, 'corsheaders.middleware.CorsMiddleware')
 
-CORS_ALLOW_ALL_ORIGINS = True  
+CORS_ALLOW_ALL_ORIGINS = True
+
+
+# Push notifications are sent from a small background pool (api/notifications.py)
+# so order creation and status changes never wait on Firebase.
+NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', '4'))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', '1000'))
+# Subscribe admins to per-language FCM topics at login so a new-order
+# broadcast is one call per language instead of a multicast per 500 admins.
+NOTIFY_ADMINS_VIA_TOPIC = os.getenv('NOTIFY_ADMINS_VIA_TOPIC', '') == '1'
+FIREBASE_BREAKER_THRESHOLD = 5
+FIREBASE_BREAKER_RESET = 30.0
+
+
+# OTP SMS gateway (api/sms.py). Sends run on their own pool with strict
+# timeouts, bounded retries and a circuit breaker; `manage.py sms_stub` runs
+# a local stand-in gateway.
+SMS_GATEWAY_URL = os.getenv('SMS_GATEWAY_URL', 'https://chinguisoft.com/api/sms/validation/o5MSMshKgDe6hZJ5')
+SMS_GATEWAY_TOKEN = os.getenv('SMS_GATEWAY_TOKEN', 'pPjqb4VQbMi1wkmJRc4B7eZKqh3jlGme')
+SMS_CONNECT_TIMEOUT = 3.05
+SMS_READ_TIMEOUT = 10
+SMS_RETRIES = 2
+SMS_RETRY_BACKOFF = 0.5
+SMS_WORKERS = int(os.getenv('SMS_WORKERS', '8'))
+SMS_QUEUE_SIZE = int(os.getenv('SMS_QUEUE_SIZE', '1000'))
+SMS_BREAKER_THRESHOLD = 5
+SMS_BREAKER_RESET = 30.0
+
+
+# Payment captures are streamed to disk, staged locally and pushed to
+# Cloudinary by a background pool (api/captures.py).
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+CAPTURE_STAGING_DIR = os.getenv('CAPTURE_STAGING_DIR', os.path.join(BASE_DIR, 'capture_staging'))
+CAPTURE_UPLOAD_WORKERS = 2
+CAPTURE_UPLOAD_QUEUE_SIZE = 500
+CAPTURE_UPLOAD_ATTEMPTS = 4
+CAPTURE_UPLOAD_BACKOFF = 2.0
+# Captures are re-encoded before upload (api/images.py).
+CAPTURE_MAX_DIMENSION = 1600
+CAPTURE_MAX_PIXELS = 50_000_000
+CAPTURE_FORMAT = os.getenv('CAPTURE_FORMAT', 'WEBP')  # or 'JPEG'
+CAPTURE_QUALITY = 80
+
+
+# Catalog image sizes (longest side, px) served as Vendor/ItemVendor.image_variants.
+IMAGE_VARIANTS = {'thumbnail': 160, 'medium': 480, 'full': 1200}
+IMAGE_VARIANT_QUALITY = 80
+
+
+# Delta sync of order lists (?since=<watermark>).
+COMMANDE_WATERMARK_LAG = 2  # seconds
+COMMANDE_DELTA_LIMIT = 500
+
+
+# Order event stream (api/events.py), served by the ASGI application.
+ORDER_EVENTS_BROKER = 'api.events.InProcessBroker'
+ORDER_EVENTS_QUEUE_SIZE = 100
+ORDER_EVENTS_HEARTBEAT = 15
+
+
+# Nearest-courier offers for newly paid orders (api/dispatch.py).
+DISPATCH_OFFERS = True
+DISPATCH_CELL_DEGREES = 0.01  # ~1 km grid cells
+DISPATCH_MAX_KM = 50
+COURIER_POSITION_TTL = 600  # seconds without a report before a courier drops off
+
+
+# Delivery fees from vendor-to-customer distance (api/fees.py), in MRU.
+DELIVERY_FEE_BASE = 50
+DELIVERY_FEE_PER_KM = 10
+DELIVERY_FEE_STEP = 10  # fees are rounded up to a multiple of this
+DELIVERY_FEE_EXTRA_VENDOR = 20  # per additional pickup in the same order
+DELIVERY_FEE_DEFAULT = 100  # when either end has no coordinates
+DELIVERY_MAX_KM = 20
+DELIVERY_ZONE_DEGREES = 0.005  # ~500 m; coordinates are rounded to this before lookup
+DELIVERY_DISTANCE_CACHE_SIZE = 100_000
+
+
+# Per-request SQL / serialization / outbound timings (api/profiling.py).
+# Off unless REQUEST_PROFILING=1; results go to Server-Timing headers and a
+# rotating JSON-lines log.
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', '') == '1'
+REQUEST_PROFILING_LOG = os.getenv('REQUEST_PROFILING_LOG', os.path.join(BASE_DIR, 'logs', 'requests.jsonl'))
+
+MIDDLEWARE.insert(0, 'api.profiling.RequestProfilingMiddleware')
+
+if REQUEST_PROFILING:
+    os.makedirs(os.path.dirname(REQUEST_PROFILING_LOG), exist_ok=True)
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'raw': {'format': '%(message)s'},
+        },
+        'handlers': {
+            'profiling': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': REQUEST_PROFILING_LOG,
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+                'formatter': 'raw',
+            },
+        },
+        'loggers': {
+            'api.profiling': {
+                'handlers': ['profiling'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }